@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
@@ -7,13 +8,25 @@ from alembic import context
 # access to the values within the .ini file in use.
 config = context.config
 
+# The application reads its database URL from the environment; keep migrations on the same database
+if os.getenv("ADDRESS_BOOK_DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["ADDRESS_BOOK_DATABASE_URL"].replace("%", "%%"))
+
 # Interpret the config file for Python logging.
-# This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# This line sets up loggers basically. The application's startup schema check runs migrations
+# in process and keeps its own logging configuration.
+if config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
 
 from app.models import Base
 target_metadata = Base.metadata
 
+def include_object(object, name, type_, reflected, compare_to):
+    # The name search index is an FTS5 virtual table created by raw DDL, so neither it nor its shadow
+    # tables (addresses_fts_data, _idx, _docsize, _config) are in the metadata; without this,
+    # autogenerate and `alembic check` would want to drop them
+    return not (type_ == "table" and name.startswith("addresses_fts"))
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
     This configures the context with just a URL
@@ -25,7 +38,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata, literal_binds=True
+        url=url, target_metadata=target_metadata, literal_binds=True,
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -36,6 +50,14 @@ def run_migrations_online():
     In this scenario we need to create an Engine
     and associate a connection with the context.
     """
+    # The application's startup schema check passes its own connection
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix="sqlalchemy.",
@@ -43,7 +65,7 @@ def run_migrations_online():
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(connection=connection, target_metadata=target_metadata, include_object=include_object)
 
         with context.begin_transaction():
             context.run_migrations()
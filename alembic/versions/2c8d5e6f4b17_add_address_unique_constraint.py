@@ -0,0 +1,30 @@
+"""add address unique constraint
+
+Revision ID: 2c8d5e6f4b17
+Revises: 7b3e2f1c9a40
+Create Date: 2026-10-18 10:41:07.532918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c8d5e6f4b17'
+down_revision: Union[str, None] = '7b3e2f1c9a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The model has always declared _address_uc but the initial migration did not create it.
+    # Bulk imports rely on it to report duplicates, so databases with duplicate rows must be
+    # cleaned up before this migration can run.
+    with op.batch_alter_table('addresses') as batch_op:
+        batch_op.create_unique_constraint('_address_uc', ['name', 'latitude', 'longitude'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('addresses') as batch_op:
+        batch_op.drop_constraint('_address_uc', type_='unique')
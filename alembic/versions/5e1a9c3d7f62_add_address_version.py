@@ -0,0 +1,26 @@
+"""add address version
+
+Revision ID: 5e1a9c3d7f62
+Revises: 2c8d5e6f4b17
+Create Date: 2026-10-18 13:27:52.804113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e1a9c3d7f62'
+down_revision: Union[str, None] = '2c8d5e6f4b17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('addresses', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade() -> None:
+    op.drop_column('addresses', 'version')
@@ -0,0 +1,87 @@
+"""add geohash and coordinate index
+
+Revision ID: 7b3e2f1c9a40
+Revises: d4aec9b15847
+Create Date: 2026-10-18 09:12:41.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b3e2f1c9a40'
+down_revision: Union[str, None] = 'd4aec9b15847'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of app.geo.encode_geohash as of this revision, so the backfill does not change when
+# the application's encoder or its precision does
+_GEOHASH_PRECISION = 9
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def _encode_geohash(latitude: float, longitude: float) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < _GEOHASH_PRECISION:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def upgrade() -> None:
+    op.add_column('addresses', sa.Column('geohash', sa.String(), nullable=True))
+    op.create_index(op.f('ix_addresses_geohash'), 'addresses', ['geohash'], unique=False)
+    op.create_index('ix_addresses_latitude_longitude', 'addresses', ['latitude', 'longitude'], unique=False)
+
+    # Backfill the geohash of existing rows
+    connection = op.get_bind()
+    addresses = sa.table(
+        'addresses',
+        sa.column('id', sa.Integer),
+        sa.column('latitude', sa.Float),
+        sa.column('longitude', sa.Float),
+        sa.column('geohash', sa.String),
+    )
+    rows = connection.execute(
+        sa.select(addresses.c.id, addresses.c.latitude, addresses.c.longitude)
+        .where(addresses.c.latitude.is_not(None), addresses.c.longitude.is_not(None))
+    ).all()
+    if rows:
+        connection.execute(
+            addresses.update().where(addresses.c.id == sa.bindparam('_id')),
+            [{'_id': row.id, 'geohash': _encode_geohash(row.latitude, row.longitude)} for row in rows],
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_addresses_latitude_longitude', table_name='addresses')
+    op.drop_index(op.f('ix_addresses_geohash'), table_name='addresses')
+    op.drop_column('addresses', 'geohash')
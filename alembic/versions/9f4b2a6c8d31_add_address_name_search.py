@@ -0,0 +1,46 @@
+"""add address name search
+
+Revision ID: 9f4b2a6c8d31
+Revises: 5e1a9c3d7f62
+Create Date: 2026-10-18 20:41:06.527310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9f4b2a6c8d31'
+down_revision: Union[str, None] = '5e1a9c3d7f62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE VIRTUAL TABLE addresses_fts USING fts5("
+        "name, content='addresses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    op.execute(
+        "CREATE TRIGGER addresses_fts_ai AFTER INSERT ON addresses BEGIN "
+        "INSERT INTO addresses_fts(rowid, name) VALUES (new.id, new.name); END"
+    )
+    op.execute(
+        "CREATE TRIGGER addresses_fts_ad AFTER DELETE ON addresses BEGIN "
+        "INSERT INTO addresses_fts(addresses_fts, rowid, name) VALUES ('delete', old.id, old.name); END"
+    )
+    op.execute(
+        "CREATE TRIGGER addresses_fts_au AFTER UPDATE OF name ON addresses BEGIN "
+        "INSERT INTO addresses_fts(addresses_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+        "INSERT INTO addresses_fts(rowid, name) VALUES (new.id, new.name); END"
+    )
+    # Index the existing rows
+    op.execute("INSERT INTO addresses_fts(addresses_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER addresses_fts_au")
+    op.execute("DROP TRIGGER addresses_fts_ad")
+    op.execute("DROP TRIGGER addresses_fts_ai")
+    op.execute("DROP TABLE addresses_fts")
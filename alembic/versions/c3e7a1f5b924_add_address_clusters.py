@@ -0,0 +1,74 @@
+"""add address clusters
+
+Revision ID: c3e7a1f5b924
+Revises: 9f4b2a6c8d31
+Create Date: 2026-10-18 21:07:52.904118
+
+"""
+import math
+from typing import Sequence, Union
+
+from alembic import op
+import numpy as np
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e7a1f5b924'
+down_revision: Union[str, None] = '9f4b2a6c8d31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Frozen copy of the aggregation in app.clusters.rebuild as of this revision, so the backfill does
+# not change with the application's zoom range or projection
+_MAX_ZOOM = 16
+_MAX_LATITUDE = 85.0511287798066
+_BATCH_SIZE = 50000
+
+
+def _backfill(connection, clusters) -> None:
+    addresses = sa.table('addresses', sa.column('latitude', sa.Float), sa.column('longitude', sa.Float))
+    rows = connection.execute(
+        sa.select(addresses.c.latitude, addresses.c.longitude)
+        .where(addresses.c.latitude.is_not(None), addresses.c.longitude.is_not(None))
+    ).all()
+    points = np.array(rows, dtype=np.float64).reshape(-1, 2)
+    latitudes, longitudes = points[:, 0], points[:, 1]
+    # Web Mercator (slippy map) tile coordinates scaled to [0, 1]
+    u = (longitudes + 180.0) / 360.0
+    v = (1.0 - np.arcsinh(np.tan(np.radians(np.clip(latitudes, -_MAX_LATITUDE, _MAX_LATITUDE)))) / math.pi) / 2.0
+    for zoom in range(_MAX_ZOOM + 1):
+        n = 1 << zoom
+        x = np.clip(np.floor(u * n), 0, n - 1).astype(np.int64)
+        y = np.clip(np.floor(v * n), 0, n - 1).astype(np.int64)
+        keys, inverse = np.unique(x * n + y, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        latitude_sums = np.bincount(inverse, weights=latitudes, minlength=len(keys))
+        longitude_sums = np.bincount(inverse, weights=longitudes, minlength=len(keys))
+        cells = [{'zoom': zoom, 'x': key >> zoom, 'y': key & (n - 1), 'count': count,
+                  'latitude_sum': latitude_sum, 'longitude_sum': longitude_sum}
+                 for key, count, latitude_sum, longitude_sum in zip(keys.tolist(), counts.tolist(),
+                                                                    latitude_sums.tolist(), longitude_sums.tolist())]
+        for offset in range(0, len(cells), _BATCH_SIZE):
+            connection.execute(clusters.insert(), cells[offset:offset + _BATCH_SIZE])
+
+
+def upgrade() -> None:
+    clusters = op.create_table(
+        'address_clusters',
+        sa.Column('zoom', sa.Integer(), nullable=False),
+        sa.Column('x', sa.Integer(), nullable=False),
+        sa.Column('y', sa.Integer(), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('latitude_sum', sa.Float(), nullable=False),
+        sa.Column('longitude_sum', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('zoom', 'x', 'y'),
+        sqlite_with_rowid=False,
+    )
+
+    # Aggregate the existing addresses
+    _backfill(op.get_bind(), clusters)
+
+
+def downgrade() -> None:
+    op.drop_table('address_clusters')
@@ -0,0 +1,70 @@
+"""add address change feed
+
+Revision ID: e8b4d2f6a1c7
+Revises: c3e7a1f5b924
+Create Date: 2026-10-18 21:42:17.306518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b4d2f6a1c7'
+down_revision: Union[str, None] = 'c3e7a1f5b924'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('addresses', sa.Column('change_seq', sa.Integer(), nullable=False, server_default='0'))
+    # Existing rows enter the feed in id order; ids are unique, so they serve as their first sequence numbers
+    op.execute("UPDATE addresses SET change_seq = id")
+    op.create_index('ix_addresses_change_seq', 'addresses', ['change_seq'], unique=False)
+
+    op.create_table(
+        'address_change_sequence',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('last_seq', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute("INSERT INTO address_change_sequence (id, last_seq) SELECT 1, coalesce(max(id), 0) FROM addresses")
+    op.create_table(
+        'address_tombstones',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('change_seq', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sqlite_with_rowid=False,
+    )
+    op.create_index('ix_address_tombstones_change_seq', 'address_tombstones', ['change_seq'], unique=False)
+
+    op.execute(
+        "CREATE TRIGGER addresses_changes_ai AFTER INSERT ON addresses BEGIN "
+        "UPDATE address_change_sequence SET last_seq = last_seq + 1 WHERE id = 1; "
+        "UPDATE addresses SET change_seq = (SELECT last_seq FROM address_change_sequence WHERE id = 1) WHERE id = new.id; "
+        "DELETE FROM address_tombstones WHERE id = new.id; END"
+    )
+    op.execute(
+        "CREATE TRIGGER addresses_changes_au AFTER UPDATE OF name, latitude, longitude ON addresses BEGIN "
+        "UPDATE address_change_sequence SET last_seq = last_seq + 1 WHERE id = 1; "
+        "UPDATE addresses SET change_seq = (SELECT last_seq FROM address_change_sequence WHERE id = 1) WHERE id = new.id; END"
+    )
+    op.execute(
+        "CREATE TRIGGER addresses_changes_ad AFTER DELETE ON addresses BEGIN "
+        "UPDATE address_change_sequence SET last_seq = last_seq + 1 WHERE id = 1; "
+        "INSERT OR REPLACE INTO address_tombstones (id, change_seq) "
+        "VALUES (old.id, (SELECT last_seq FROM address_change_sequence WHERE id = 1)); END"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER addresses_changes_ad")
+    op.execute("DROP TRIGGER addresses_changes_au")
+    op.execute("DROP TRIGGER addresses_changes_ai")
+    op.drop_index('ix_address_tombstones_change_seq', table_name='address_tombstones')
+    op.drop_table('address_tombstones')
+    op.drop_table('address_change_sequence')
+    op.drop_index('ix_addresses_change_seq', table_name='addresses')
+    op.drop_column('addresses', 'change_seq')
@@ -0,0 +1,194 @@
+from fastapi import HTTPException
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from . import clusters, crud, distance, geo, models, schemas
+from .cache import address_cache
+from .spatial_index import index as spatial_index
+import logging
+
+# Async counterparts of the functions in crud.py. Query building and the pure geometry helpers
+# are shared with crud; distance kernels run in the threadpool so they never block the event loop.
+
+logger = logging.getLogger(__name__)
+
+async def _candidate_coordinates(db: AsyncSession, latitude: float, longitude: float, distance_km: float):
+    if spatial_index.ready:
+        min_lat, max_lat, lon_ranges = geo.bounding_box(latitude, longitude, distance_km)
+        return spatial_index.query_bbox(min_lat, max_lat, lon_ranges)
+    result = await db.execute(crud._candidate_statement(latitude, longitude, distance_km))
+    return crud._coordinate_arrays(result.all())
+
+async def _apply_cluster_changes(db: AsyncSession, removed=(), added=()):
+    for stmt, parameters in clusters.statements(removed, added):
+        await db.execute(stmt, parameters)
+
+async def _get_addresses_by_ids(db: AsyncSession, ids, chunk_size: int = 900):
+    ids = [int(address_id) for address_id in ids]
+    addresses = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        result = await db.execute(select(*crud._ADDRESS_COLUMNS).where(models.Address.id.in_(chunk)))
+        addresses.extend(result.all())
+    return addresses
+
+async def get_address(db: AsyncSession, address_id: int):
+    try:
+        logger.debug("Fetching address with ID: %s", address_id)
+        address = await db.get(models.Address, address_id)
+        if address is None:
+            logger.warning("No address found with ID: %s", address_id)
+        return address
+    except Exception as e:
+        logger.error("Error in get_address: %s", str(e))
+        raise
+
+async def get_address_payload(db: AsyncSession, address_id: int):
+    cached = address_cache.get(address_id)
+    if cached is not None:
+        return cached
+    # Taken before reading, so a write that lands meanwhile keeps the row read out of the cache
+    generation = address_cache.generation(address_id)
+    try:
+        logger.debug("Fetching address with ID: %s", address_id)
+        result = await db.execute(
+            select(models.Address.id, models.Address.name, models.Address.latitude, models.Address.longitude, models.Address.change_seq)
+            .where(models.Address.id == address_id)
+        )
+        row = result.first()
+    except Exception as e:
+        logger.error("Error in get_address_payload: %s", str(e))
+        raise
+    if row is None:
+        logger.warning("No address found with ID: %s", address_id)
+        return None
+    entry = ({"id": row.id, "name": row.name, "latitude": row.latitude, "longitude": row.longitude},
+             crud.address_etag(row.id, row.change_seq))
+    address_cache.set(address_id, entry, generation)
+    return entry
+
+async def get_addresses(db: AsyncSession, page: int = 1, page_size: int = 10, lookahead: bool = False):
+    try:
+        offset = (page - 1) * page_size
+        limit = page_size + 1 if lookahead else page_size
+        result = await db.execute(select(*crud._ADDRESS_COLUMNS).order_by(models.Address.id).offset(offset).limit(limit))
+        return result.all()
+    except Exception as e:
+        logger.error("Error in get_addresses: %s", str(e))
+        raise
+
+async def get_addresses_after(db: AsyncSession, after_id: int = None, limit: int = 10):
+    try:
+        stmt = select(*crud._ADDRESS_COLUMNS)
+        if after_id is not None:
+            stmt = stmt.where(models.Address.id > after_id)
+        result = await db.execute(stmt.order_by(models.Address.id).limit(limit))
+        return result.all()
+    except Exception as e:
+        logger.error("Error in get_addresses_after: %s", str(e))
+        raise
+
+async def count_addresses(db: AsyncSession):
+    try:
+        return await db.scalar(select(func.count(models.Address.id)))
+    except Exception as e:
+        logger.error("Error in count_addresses: %s", str(e))
+        raise
+
+async def create_address(db: AsyncSession, address: schemas.AddressCreate):
+    try:
+        logger.debug("Creating new address with data: %s", address)
+        row = (await db.execute(crud._address_insert, crud._address_values(address))).first()
+        if row is not None:
+            await _apply_cluster_changes(db, added=[(row.latitude, row.longitude)])
+            await db.commit()
+    except Exception as e:
+        logger.error("Error in create_address: %s", str(e))
+        await db.rollback()
+        raise
+    if row is None:
+        await db.rollback()  # nothing was written; end the transaction
+        raise HTTPException(status_code=400, detail=crud._DUPLICATE_ADDRESS)
+    if spatial_index.ready:
+        spatial_index.add(row.id, row.latitude, row.longitude)
+    logger.debug("New address created with ID: %s", row.id)
+    return row
+
+async def update_address(db: AsyncSession, address_id: int, address: schemas.AddressCreate):
+    try:
+        logger.debug("Updating address with ID: %s", address_id)
+        old = (await db.execute(select(models.Address.latitude, models.Address.longitude)
+                                .where(models.Address.id == address_id))).first()
+        if old is None:
+            logger.warning("No address found to update with ID: %s", address_id)
+            return None
+        row = (await db.execute(crud._update_address_statement(address_id, crud._address_values(address)))).first()
+        if row is None:
+            await db.rollback()  # nothing was written; end the read transaction
+            raise HTTPException(status_code=400, detail=crud._DUPLICATE_ADDRESS)
+        await _apply_cluster_changes(db, removed=[tuple(old)], added=[(row.latitude, row.longitude)])
+        await db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in update_address: %s", str(e))
+        await db.rollback()
+        raise
+    address_cache.invalidate(address_id)
+    if spatial_index.ready:
+        spatial_index.add(row.id, row.latitude, row.longitude)
+    return row
+
+async def delete_address(db: AsyncSession, address_id: int):
+    table = models.Address.__table__
+    try:
+        logger.debug("Deleting address with ID: %s", address_id)
+        row = (await db.execute(delete(table).where(table.c.id == address_id).returning(*crud._RETURNED_COLUMNS))).first()
+        if row is None:
+            await db.rollback()  # nothing was written; end the transaction
+            logger.warning("No address found to delete with ID: %s", address_id)
+            return None
+        await _apply_cluster_changes(db, removed=[(row.latitude, row.longitude)])
+        await db.commit()
+    except Exception as e:
+        logger.error("Error in delete_address: %s", str(e))
+        await db.rollback()
+        raise
+    address_cache.invalidate(address_id)
+    if spatial_index.ready:
+        spatial_index.remove(address_id)
+    logger.debug("Address deleted with ID: %s", address_id)
+    return row
+
+async def get_addresses_within_distance(db: AsyncSession, latitude: float, longitude: float, distance_km: float, accuracy: str = "exact"):
+    try:
+        logger.debug("Fetching addresses within %s km of (%s, %s)", distance_km, latitude, longitude)
+        ids, latitudes, longitudes = await _candidate_coordinates(db, latitude, longitude, distance_km)
+        mask = await run_in_threadpool(distance.within_distance_mask, latitude, longitude, latitudes, longitudes, distance_km, accuracy)
+        nearby_addresses = sorted(await _get_addresses_by_ids(db, ids[mask]), key=lambda address: address.id)
+        logger.debug("%s addresses found within %s km of (%s, %s)", len(nearby_addresses), distance_km, latitude, longitude)
+        return nearby_addresses
+    except Exception as e:
+        logger.error("Error in get_addresses_within_distance: %s", str(e))
+        raise
+
+async def get_nearest_addresses(db: AsyncSession, latitude: float, longitude: float, k: int, accuracy: str = "exact"):
+    try:
+        logger.debug("Fetching %s addresses nearest to (%s, %s)", k, latitude, longitude)
+        radius = crud._NEAREST_INITIAL_RADIUS_KM
+        while True:
+            ids, latitudes, longitudes = await _candidate_coordinates(db, latitude, longitude, radius)
+            next_radius = await run_in_threadpool(crud._next_nearest_radius, latitude, longitude, latitudes, longitudes, radius, k)
+            if next_radius is None:
+                break
+            radius = next_radius
+        order, nearest_distances = await run_in_threadpool(crud._rank_nearest, latitude, longitude, latitudes, longitudes, k, accuracy)
+
+        addresses = {address.id: address for address in await _get_addresses_by_ids(db, ids[order])}
+        nearest = [(addresses[int(address_id)], float(d)) for address_id, d in zip(ids[order], nearest_distances)
+                   if int(address_id) in addresses]
+        logger.debug("%s nearest addresses found within %s km of (%s, %s)", len(nearest), radius, latitude, longitude)
+        return nearest
+    except Exception as e:
+        logger.error("Error in get_nearest_addresses: %s", str(e))
+        raise
@@ -0,0 +1,94 @@
+import codecs
+import csv
+import json
+import logging
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import crud, schemas
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the per-row details kept in the import report; counts are always exact
+MAX_REPORTED_ROWS = 1000
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]):
+    """Split a stream of UTF-8 byte chunks into lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def parse_rows(lines, fmt: str):
+    """Yield ``(line_number, address, error)`` for each non-blank NDJSON or CSV line.
+
+    CSV input must start with a header row naming the ``name``, ``latitude`` and
+    ``longitude`` columns; quoted fields may not contain line breaks.
+    """
+    header = None
+    line_number = 0
+    async for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            data = dict(zip(header, values))
+        else:
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                yield line_number, None, f"Invalid JSON: {e}"
+                continue
+        try:
+            yield line_number, schemas.AddressCreate.model_validate(data), None
+        except ValidationError as e:
+            yield line_number, None, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+def _report(rows: list, line_number: int, detail: str):
+    if len(rows) < MAX_REPORTED_ROWS:
+        rows.append(schemas.BulkImportIssue(line=line_number, detail=detail))
+
+
+async def import_addresses(db: Session, chunks: AsyncIterator[bytes], fmt: str, chunk_size: int) -> schemas.BulkImportResult:
+    """Stream-parse an upload and insert it chunk by chunk, one transaction per chunk."""
+    result = schemas.BulkImportResult(inserted=0, conflicts=0, invalid=0, conflict_rows=[], invalid_rows=[])
+
+    async def flush(batch):
+        ids = await run_in_threadpool(crud.create_addresses_bulk, db, [address for _, address in batch])
+        for (line_number, address), address_id in zip(batch, ids):
+            if address_id is None:
+                result.conflicts += 1
+                _report(result.conflict_rows, line_number, "Address with the same name and coordinates already exists")
+            else:
+                result.inserted += 1
+
+    batch = []
+    async for line_number, address, error in parse_rows(iter_lines(chunks), fmt):
+        if error is not None:
+            result.invalid += 1
+            _report(result.invalid_rows, line_number, error)
+            continue
+        batch.append((line_number, address))
+        if len(batch) >= chunk_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    logger.info("Bulk import finished: %d inserted, %d conflicts, %d invalid", result.inserted, result.conflicts, result.invalid)
+    return result
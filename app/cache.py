@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+from . import config
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after they were stored.
+
+    ``maxsize <= 0`` disables the cache: ``get`` always misses and ``set`` is a no-op.
+
+    Each key has a generation that ``invalidate`` advances. A reader that loads a value from the
+    database takes ``generation(key)`` first and passes it to ``set``, which drops the value if the
+    key was invalidated in the meantime: the value may predate the write, and caching it would
+    serve it for the whole TTL.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+        # key -> generation of its last invalidation, oldest first. Keys forgotten to bound the dict
+        # raise _generation_floor, the generation of every key not in it, to theirs.
+        self._generations = OrderedDict()
+        self._generation = 0
+        self._generation_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key):
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def set(self, key, value, generation=None):
+        """Store the value, unless ``generation`` is given and the key was invalidated since."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and self._generations.get(key, self._generation_floor) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+            self._generation += 1
+            self._generations[key] = self._generation
+            self._generations.move_to_end(key)
+            while len(self._generations) > max(self.maxsize, 1):
+                _, forgotten = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, forgotten)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# Serialized addresses by id for GET /addresses/{address_id}
+address_cache = TTLCache(config.ADDRESS_CACHE_SIZE, config.ADDRESS_CACHE_TTL)
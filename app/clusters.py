@@ -0,0 +1,171 @@
+import logging
+import math
+import time
+
+import numpy as np
+from sqlalchemy import and_, bindparam, delete, insert, or_, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import models
+
+# Per-zoom address counts for map viewports, served at /addresses/clusters. Cells are the Web
+# Mercator (slippy map) tiles of each zoom level; address_clusters keeps the count and the
+# coordinate sums of every non-empty cell, so a viewport is answered from its cells alone
+# whatever the number of addresses inside. The crud write functions apply their changes to the
+# table in the same transaction as the write.
+
+logger = logging.getLogger(__name__)
+
+# Aggregates are kept for zoom levels 0..MAX_ZOOM; changing it requires rebuild()
+MAX_ZOOM = 16
+# Web Mercator is undefined at the poles; points beyond this latitude fall in the edge tiles
+MAX_LATITUDE = 85.0511287798066
+
+_table = models.AddressCluster.__table__
+
+
+def _unit_xy(latitudes, longitudes):
+    # Web Mercator coordinates of the points scaled to [0, 1]; tile indices at zoom z are these times 2 ** z,
+    # an exact scaling, so every zoom level is derived from one projection
+    latitudes = np.radians(np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    u = (np.asarray(longitudes, dtype=np.float64) + 180.0) / 360.0
+    v = (1.0 - np.arcsinh(np.tan(latitudes)) / math.pi) / 2.0
+    return u, v
+
+
+def _tiles(u, v, zoom: int):
+    n = 1 << zoom
+    return np.clip(np.floor(u * n), 0, n - 1).astype(np.int64), np.clip(np.floor(v * n), 0, n - 1).astype(np.int64)
+
+
+def tile_xy(latitudes, longitudes, zoom: int):
+    """Tile column and row arrays of the points at ``zoom``."""
+    return _tiles(*_unit_xy(latitudes, longitudes), zoom)
+
+
+def _cell_deltas(removed, added):
+    # Net change of every cell touched by the points, as rows for the upsert; cells whose changes
+    # cancel out (a point moving within its cell) are left out. Writes touch a handful of points,
+    # so all zoom levels are projected at once and summed in a dict rather than per zoom.
+    points = [(latitude, longitude, -1) for latitude, longitude in removed if latitude is not None and longitude is not None]
+    points += [(latitude, longitude, 1) for latitude, longitude in added if latitude is not None and longitude is not None]
+    if not points:
+        return []
+    latitudes, longitudes, signs = zip(*points)
+    u, v = _unit_xy(latitudes, longitudes)
+    # Same arithmetic as _tiles, for every zoom level at once (one row per zoom)
+    scale = np.array([float(1 << zoom) for zoom in range(MAX_ZOOM + 1)])[:, None]
+    xs = np.clip(np.floor(u * scale), 0, scale - 1).astype(np.int64).tolist()
+    ys = np.clip(np.floor(v * scale), 0, scale - 1).astype(np.int64).tolist()
+    cells = {}
+    for zoom in range(MAX_ZOOM + 1):
+        for x, y, latitude, longitude, sign in zip(xs[zoom], ys[zoom], latitudes, longitudes, signs):
+            cell = cells.get((zoom, x, y))
+            if cell is None:
+                cell = cells[(zoom, x, y)] = [0, 0.0, 0.0]
+            cell[0] += sign
+            cell[1] += sign * latitude
+            cell[2] += sign * longitude
+    return [{"zoom": zoom, "x": x, "y": y, "count": count, "latitude_sum": latitude_sum, "longitude_sum": longitude_sum}
+            for (zoom, x, y), (count, latitude_sum, longitude_sum) in cells.items()
+            if count or latitude_sum or longitude_sum]
+
+
+def _upsert_statement():
+    stmt = sqlite_insert(_table)
+    return stmt.on_conflict_do_update(
+        index_elements=[_table.c.zoom, _table.c.x, _table.c.y],
+        set_={"count": _table.c.count + stmt.excluded.count,
+              "latitude_sum": _table.c.latitude_sum + stmt.excluded.latitude_sum,
+              "longitude_sum": _table.c.longitude_sum + stmt.excluded.longitude_sum},
+    )
+
+
+_upsert = _upsert_statement()
+_delete_emptied = delete(_table).where(_table.c.zoom == bindparam("c_zoom"), _table.c.x == bindparam("c_x"),
+                                       _table.c.y == bindparam("c_y"), _table.c.count <= 0)
+
+
+def statements(removed=(), added=()):
+    """(statement, parameters) pairs applying the removal and addition of points to the aggregates.
+
+    ``removed`` and ``added`` are (latitude, longitude) pairs; an update removes the old coordinates
+    and adds the new ones. The caller executes the pairs in the transaction of the write.
+    """
+    rows = _cell_deltas(removed, added)
+    if not rows:
+        return []
+    pairs = [(_upsert, rows)]
+    emptied = [{"c_zoom": row["zoom"], "c_x": row["x"], "c_y": row["y"]} for row in rows if row["count"] < 0]
+    if emptied:
+        pairs.append((_delete_emptied, emptied))
+    return pairs
+
+
+def apply(db, removed=(), added=()):
+    """Execute :func:`statements` on ``db`` (a Session or Connection) without committing."""
+    for stmt, parameters in statements(removed, added):
+        db.execute(stmt, parameters)
+
+
+def rebuild(connection, batch_size: int = 50000):
+    """Recompute the whole table from the addresses; used to backfill and after changing MAX_ZOOM."""
+    start = time.perf_counter()
+    addresses = models.Address.__table__
+    latitudes, longitudes = [], []
+    stmt = (select(addresses.c.latitude, addresses.c.longitude)
+            .where(addresses.c.latitude.is_not(None), addresses.c.longitude.is_not(None))
+            .execution_options(yield_per=batch_size))
+    for partition in connection.execute(stmt).partitions():
+        chunk = np.array(partition, dtype=np.float64).reshape(-1, 2)
+        latitudes.append(chunk[:, 0])
+        longitudes.append(chunk[:, 1])
+    latitudes = np.concatenate(latitudes) if latitudes else np.empty(0)
+    longitudes = np.concatenate(longitudes) if longitudes else np.empty(0)
+
+    connection.execute(delete(_table))
+    u, v = _unit_xy(latitudes, longitudes)
+    cells = 0
+    for zoom in range(MAX_ZOOM + 1):
+        x, y = _tiles(u, v, zoom)
+        keys, inverse = np.unique(x * (1 << zoom) + y, return_inverse=True)
+        counts = np.bincount(inverse, minlength=len(keys))
+        latitude_sums = np.bincount(inverse, weights=latitudes, minlength=len(keys))
+        longitude_sums = np.bincount(inverse, weights=longitudes, minlength=len(keys))
+        rows = [{"zoom": zoom, "x": key >> zoom, "y": key & ((1 << zoom) - 1), "count": count,
+                 "latitude_sum": latitude_sum, "longitude_sum": longitude_sum}
+                for key, count, latitude_sum, longitude_sum in zip(keys.tolist(), counts.tolist(),
+                                                                   latitude_sums.tolist(), longitude_sums.tolist())]
+        for offset in range(0, len(rows), batch_size):
+            connection.execute(insert(_table), rows[offset:offset + batch_size])
+        cells += len(rows)
+    logger.info("Address clusters rebuilt for %d addresses (%d cells) in %.3fs", len(latitudes), cells,
+                time.perf_counter() - start)
+
+
+def tile_ranges(min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int):
+    """Inclusive (x_min, x_max, y_min, y_max) tile ranges covering the box.
+
+    A box with min_lon > max_lon crosses the antimeridian and is split in two.
+    """
+    lon_ranges = [(min_lon, max_lon)] if min_lon <= max_lon else [(min_lon, 180.0), (-180.0, max_lon)]
+    ranges = []
+    for west, east in lon_ranges:
+        x, y = tile_xy([max_lat, min_lat], [west, east], zoom)  # rows grow southwards
+        ranges.append((int(x[0]), int(x[1]), int(y[0]), int(y[1])))
+    return ranges
+
+
+def clusters_statement(min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int):
+    """Select the non-empty cells of ``zoom`` inside the box, using the (zoom, x, y) primary key."""
+    return (select(_table.c.x, _table.c.y, _table.c.count, _table.c.latitude_sum, _table.c.longitude_sum)
+            .where(_table.c.zoom == zoom,
+                   or_(*(and_(_table.c.x.between(x_min, x_max), _table.c.y.between(y_min, y_max))
+                         for x_min, x_max, y_min, y_max in tile_ranges(min_lon, min_lat, max_lon, max_lat, zoom))))
+            .order_by(_table.c.x, _table.c.y))
+
+
+def cell_count(min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int) -> int:
+    """Number of grid cells, empty or not, covering the box at ``zoom``."""
+    return sum((x_max - x_min + 1) * (y_max - y_min + 1)
+               for x_min, x_max, y_min, y_max in tile_ranges(min_lon, min_lat, max_lon, max_lat, zoom))
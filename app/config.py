@@ -0,0 +1,107 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Number of app worker processes; uvicorn and gunicorn both take their default --workers from it
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# In-memory spatial index over address coordinates (see app/spatial_index.py). The index lives in
+# one process and only sees that process's writes, so it only works with a single worker; startup
+# refuses to load it when WEB_CONCURRENCY is above 1.
+SPATIAL_INDEX_ENABLED = _env_bool("ADDRESS_BOOK_SPATIAL_INDEX", False)
+SPATIAL_INDEX_LEAF_SIZE = int(os.getenv("ADDRESS_BOOK_SPATIAL_INDEX_LEAF_SIZE", "64"))
+# Rebuild once tombstones and unindexed inserts exceed this fraction of the tree
+SPATIAL_INDEX_REBUILD_RATIO = float(os.getenv("ADDRESS_BOOK_SPATIAL_INDEX_REBUILD_RATIO", "0.25"))
+
+# Serve the core address routes through the async engine and async crud (see app/async_crud.py)
+ASYNC_DB_ENABLED = _env_bool("ADDRESS_BOOK_ASYNC_DB", False)
+
+# Database engine profile (see app/database.py)
+DATABASE_URL = os.getenv("ADDRESS_BOOK_DATABASE_URL", "sqlite:///./test.db")
+SQLITE_JOURNAL_MODE = os.getenv("ADDRESS_BOOK_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("ADDRESS_BOOK_SQLITE_SYNCHRONOUS", "NORMAL")
+# Negative values are KiB, positive values are pages (SQLite convention)
+SQLITE_CACHE_SIZE = int(os.getenv("ADDRESS_BOOK_SQLITE_CACHE_SIZE", "-65536"))
+SQLITE_MMAP_SIZE = int(os.getenv("ADDRESS_BOOK_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("ADDRESS_BOOK_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Read-only connections serving GET routes
+DB_READ_POOL_SIZE = int(os.getenv("ADDRESS_BOOK_DB_READ_POOL_SIZE", "5"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("ADDRESS_BOOK_DB_READ_MAX_OVERFLOW", "10"))
+# Seconds a write waits for the single writer connection before failing
+DB_WRITE_TIMEOUT = float(os.getenv("ADDRESS_BOOK_DB_WRITE_TIMEOUT", "30"))
+# Group commit (see app/write_coalescer.py): single-address writes arriving within the window of
+# each other share one transaction, up to WRITE_COALESCE_MAX_BATCH writes
+WRITE_COALESCING = _env_bool("ADDRESS_BOOK_WRITE_COALESCING", False)
+WRITE_COALESCE_WINDOW_MS = float(os.getenv("ADDRESS_BOOK_WRITE_COALESCE_WINDOW_MS", "2"))
+WRITE_COALESCE_MAX_BATCH = int(os.getenv("ADDRESS_BOOK_WRITE_COALESCE_MAX_BATCH", "256"))
+# Startup connection attempts, and seconds between them, before giving up on the database
+DB_CONNECT_RETRIES = int(os.getenv("ADDRESS_BOOK_DB_CONNECT_RETRIES", "3"))
+DB_CONNECT_RETRY_DELAY = float(os.getenv("ADDRESS_BOOK_DB_CONNECT_RETRY_DELAY", "1"))
+
+# Request and SQL metrics served at /metrics (see app/metrics.py)
+METRICS_ENABLED = _env_bool("ADDRESS_BOOK_METRICS", True)
+
+# Opt-in slow-query log and per-request query budget (see app/profiling.py)
+PROFILING_ENABLED = _env_bool("ADDRESS_BOOK_PROFILING", False)
+SLOW_QUERY_MS = float(os.getenv("ADDRESS_BOOK_SLOW_QUERY_MS", "100"))
+# Requests running more statements or fetching more rows than this are flagged; 0 disables a limit
+QUERY_BUDGET_STATEMENTS = int(os.getenv("ADDRESS_BOOK_QUERY_BUDGET_STATEMENTS", "20"))
+QUERY_BUDGET_ROWS = int(os.getenv("ADDRESS_BOOK_QUERY_BUDGET_ROWS", "10000"))
+# Slow queries and budget violations kept for /debug/profiling
+PROFILING_MAX_ENTRIES = int(os.getenv("ADDRESS_BOOK_PROFILING_MAX_ENTRIES", "200"))
+
+# Logging (see app/logging_config.py)
+ENVIRONMENT = os.getenv("ADDRESS_BOOK_ENV", "development")
+LOG_LEVEL = os.getenv("ADDRESS_BOOK_LOG_LEVEL", "DEBUG" if ENVIRONMENT == "development" else "INFO").upper()
+# Size-based rotation needs a single worker (see logging_config._logging_config)
+LOG_FILE = os.getenv("ADDRESS_BOOK_LOG_FILE", "address-book-app.log")
+LOG_MAX_BYTES = int(os.getenv("ADDRESS_BOOK_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("ADDRESS_BOOK_LOG_BACKUP_COUNT", "5"))
+# Fraction of DEBUG records kept per logger, e.g. "app.crud=0.01,app.routers=0.1"
+LOG_SAMPLING = os.getenv("ADDRESS_BOOK_LOG_SAMPLING", "")
+
+# Maximum ids or patches accepted by one /addresses/batch request
+BATCH_MAX_ITEMS = int(os.getenv("ADDRESS_BOOK_BATCH_MAX_ITEMS", "10000"))
+
+# POST /addresses/within_distance/batch: maximum queries per request, largest distance matrix
+# (origins x matched addresses) with accuracy=fast and with accuracy=exact, whose geodesic cells
+# cost about 250 us each, and the process pool that batches of at least
+# PROXIMITY_PARALLEL_MIN_QUERIES queries are split across (1 keeps them in process)
+PROXIMITY_BATCH_MAX_QUERIES = int(os.getenv("ADDRESS_BOOK_PROXIMITY_BATCH_MAX_QUERIES", "1000"))
+PROXIMITY_MATRIX_MAX_CELLS = int(os.getenv("ADDRESS_BOOK_PROXIMITY_MATRIX_MAX_CELLS", "1000000"))
+PROXIMITY_EXACT_MATRIX_MAX_CELLS = int(os.getenv("ADDRESS_BOOK_PROXIMITY_EXACT_MATRIX_MAX_CELLS", "10000"))
+PROXIMITY_WORKERS = int(os.getenv("ADDRESS_BOOK_PROXIMITY_WORKERS", str(min(os.cpu_count() or 1, 4))))
+PROXIMITY_PARALLEL_MIN_QUERIES = int(os.getenv("ADDRESS_BOOK_PROXIMITY_PARALLEL_MIN_QUERIES", "200"))
+
+# Largest viewport, in grid cells at the requested zoom, accepted by /addresses/clusters
+CLUSTER_MAX_CELLS = int(os.getenv("ADDRESS_BOOK_CLUSTER_MAX_CELLS", "65536"))
+
+# Change feed stream (/addresses/changes/stream): seconds between polls for new changes, and
+# seconds before a stream is closed so clients reconnect (with Last-Event-ID) and spread over workers
+CHANGES_POLL_INTERVAL = float(os.getenv("ADDRESS_BOOK_CHANGES_POLL_INTERVAL", "1"))
+CHANGES_STREAM_TIMEOUT = float(os.getenv("ADDRESS_BOOK_CHANGES_STREAM_TIMEOUT", "300"))
+
+# Maximum vertices, over all rings, of the polygon posted to /addresses/in_polygon
+POLYGON_MAX_VERTICES = int(os.getenv("ADDRESS_BOOK_POLYGON_MAX_VERTICES", "10000"))
+
+# Largest radius, in meters, accepted by /addresses/duplicates; the scan keeps two latitude bands
+# of this height in memory
+DUPLICATES_MAX_RADIUS_M = float(os.getenv("ADDRESS_BOOK_DUPLICATES_MAX_RADIUS_M", "1000"))
+
+# Read-through cache for GET /addresses/{address_id} (see app/cache.py); a size of 0 disables it.
+# The cache is per process, so with several workers an entry may be stale for up to the TTL.
+ADDRESS_CACHE_SIZE = int(os.getenv("ADDRESS_BOOK_CACHE_SIZE", "10000"))
+ADDRESS_CACHE_TTL = float(os.getenv("ADDRESS_BOOK_CACHE_TTL", "30"))
+
+# What startup does when the database is not at the latest Alembic revision (see database.check_schema):
+# "upgrade" migrates it, "error" refuses to start, "warn" only logs, "off" skips the check.
+# Upgrading is opt-in: run `alembic upgrade head` once before starting the workers. When several
+# workers do upgrade at startup, they take turns on SQLite's write lock.
+SCHEMA_CHECK = os.getenv("ADDRESS_BOOK_SCHEMA_CHECK", "error")
+ALEMBIC_CONFIG = os.getenv("ADDRESS_BOOK_ALEMBIC_CONFIG", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "alembic.ini"))
@@ -1,102 +1,829 @@
-from fastapi import HTTPException
-from sqlalchemy.orm import Session
-from geopy.distance import geodesic
-from . import models, schemas
-import logging
-from sqlalchemy.exc import IntegrityError
-
-logger = logging.getLogger(__name__)
-
-def get_address(db: Session, address_id: int):
-    try:
-        logger.debug(f"Fetching address with ID: {address_id}")
-        address = db.query(models.Address).filter(models.Address.id == address_id).first()
-        if address:
-            logger.info(f"Address found: {address}")
-        else:
-            logger.warning(f"No address found with ID: {address_id}")
-        return address
-    except Exception as e:
-        logger.error("Error in get_address: %s", str(e))
-        raise
-
-def get_addresses(db: Session, page: int = 1, page_size: int = 10):
-    try:
-        offset = (page - 1) * page_size
-        logger.debug(f"Fetching addresses for page: {page}, page size: {page_size}, offset: {offset}")
-        addresses = db.query(models.Address).offset(offset).limit(page_size).all()
-        logger.info(f"{len(addresses)} addresses found on page {page}")
-        return addresses
-    except Exception as e:
-        logger.error("Error in get_addresses: %s", str(e))
-        raise
-
-def update_address(db: Session, address_id: int, address: schemas.AddressCreate):
-    db_address = db.query(models.Address).filter(models.Address.id == address_id).first()
-    if not db_address:
-        return None
-    for key, value in address.model_dump().items():
-        setattr(db_address, key, value)
-    try:
-        db.commit()
-        db.refresh(db_address)
-        return db_address
-    except IntegrityError as e:
-        logger.error("Integrity Error in create_address: %s", str(e))
-        db.rollback()
-        raise HTTPException(status_code=400, detail="Address with the same name and coordinates already exists")
-    except Exception as e:
-        logger.error("Error in create_address: %s", str(e))
-        db.rollback()
-        raise
-
-
-def create_address(db: Session, address: schemas.AddressCreate):
-    try:
-        logger.debug(f"Creating new address with data: {address}")
-        db_address = models.Address(**address.model_dump())
-        db.add(db_address)
-        db.commit()
-        db.refresh(db_address)
-        logger.info(f"New address created: {db_address}")
-        return db_address
-    except IntegrityError as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail="Address with the same name and coordinates already exists")
-    except Exception as e:
-        logger.error("Error in create_address: %s", str(e))
-        db.rollback()
-        raise
-
-def delete_address(db: Session, address_id: int):
-    try:
-        logger.debug(f"Deleting address with ID: {address_id}")
-        db_address = db.query(models.Address).filter(models.Address.id == address_id).first()
-        if db_address:
-            db.delete(db_address)
-            db.commit()
-            logger.info(f"Address deleted: {db_address}")
-        else:
-            logger.warning(f"No address found to delete with ID: {address_id}")
-        return db_address
-    except Exception as e:
-        logger.error("Error in delete_address: %s", str(e))
-        db.rollback()  # rollback in case of error
-        raise
-
-def get_addresses_within_distance(db: Session, latitude: float, longitude: float, distance_km: float):
-    try:
-        logger.debug(f"Fetching addresses within {distance_km} km of ({latitude}, {longitude})")
-        addresses = db.query(models.Address).all()
-        nearby_addresses = []
-        for address in addresses:
-            address_coords = (address.latitude, address.longitude)
-            distance = geodesic((latitude, longitude), address_coords).km
-            logger.debug(f"Distance to ({address.latitude}, {address.longitude}) is {distance} km")
-            if distance <= distance_km:
-                nearby_addresses.append(address)
-        logger.info(f"{len(nearby_addresses)} addresses found within {distance_km} km of ({latitude}, {longitude})")
-        return nearby_addresses
-    except Exception as e:
-        logger.error("Error in get_addresses_within_distance: %s", str(e))
-        raise
+from fastapi import HTTPException
+from sqlalchemy import and_, bindparam, column, delete, func, literal, null, or_, select, table, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+import numpy as np
+from . import clusters, config, distance, geo, models, schemas
+from .cache import address_cache
+from .spatial_index import index as spatial_index
+import heapq
+import logging
+import math
+import re
+from typing import List
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Nearest-neighbour search starts with this radius and widens it until it holds k addresses
+_NEAREST_INITIAL_RADIUS_KM = 1.0
+# A bounding box of this radius covers the whole globe
+_NEAREST_MAX_RADIUS_KM = 20040.0
+
+# Read queries select these columns as plain rows instead of loading Address entities;
+# rows support the same attribute access (row.id, row.name, ...) and unpack as tuples.
+_ADDRESS_COLUMNS = (models.Address.id, models.Address.name, models.Address.latitude, models.Address.longitude)
+# Single-address writes return the whole row, like the Address entity they used to load
+_RETURNED_COLUMNS = _ADDRESS_COLUMNS + (models.Address.geohash, models.Address.version)
+
+# FTS5 index over Address.name (see models.ADDRESS_SEARCH_DDL); rank is its bm25 score, lower is better
+_address_fts = table("addresses_fts", column("rowid"), column("rank"))
+
+def _address_values(address: schemas.AddressCreate):
+    values = address.model_dump()
+    values["geohash"] = geo.encode_geohash(address.latitude, address.longitude)
+    return values
+
+def _box_condition(min_lat: float, max_lat: float, lon_ranges):
+    # Served by the (latitude, longitude) index; lon_ranges holds two ranges across the antimeridian
+    condition = models.Address.latitude.between(min_lat, max_lat)
+    if lon_ranges != [(-180.0, 180.0)]:
+        condition = and_(condition, or_(*(models.Address.longitude.between(min_lon, max_lon) for min_lon, max_lon in lon_ranges)))
+    return condition
+
+def _within_bounding_box(query, latitude: float, longitude: float, distance_km: float):
+    # Narrow the candidates with the (latitude, longitude) index before any exact distance check
+    return query.filter(_box_condition(*geo.bounding_box(latitude, longitude, distance_km)))
+
+def _candidate_statement(latitude: float, longitude: float, distance_km: float):
+    stmt = select(models.Address.id, models.Address.latitude, models.Address.longitude)
+    return _within_bounding_box(stmt, latitude, longitude, distance_km)
+
+def _coordinate_arrays(rows):
+    coordinates = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return coordinates[:, 0].astype(np.int64), coordinates[:, 1], coordinates[:, 2]
+
+def _candidate_coordinates(db: Session, latitude: float, longitude: float, distance_km: float):
+    # Returns (ids, latitudes, longitudes) arrays of the points in the bounding box
+    if spatial_index.ready:
+        min_lat, max_lat, lon_ranges = geo.bounding_box(latitude, longitude, distance_km)
+        return spatial_index.query_bbox(min_lat, max_lat, lon_ranges)
+    return _coordinate_arrays(db.execute(_candidate_statement(latitude, longitude, distance_km)).all())
+
+def _next_nearest_radius(latitude: float, longitude: float, latitudes, longitudes, radius: float, k: int):
+    # None once the ring of this radius is known to hold the k nearest addresses, else the radius to try next.
+    # Haversine and geodesic distances differ by a factor of at most (1 + tolerance), so the ring
+    # is complete once k points lie inside radius / (1 + tolerance) ** 3.
+    if radius >= _NEAREST_MAX_RADIUS_KM:
+        return None
+    slack = (1 + distance.BOUNDARY_TOLERANCE) ** 3
+    found = int(np.count_nonzero(distance.haversine_km(latitude, longitude, latitudes, longitudes) <= radius / slack))
+    if found >= k:
+        return None
+    # Grow the ring assuming a locally uniform density, by at least a factor of two
+    growth = math.sqrt(k / found) * 1.2 if found else 4.0
+    return min(radius * max(growth, 2.0), _NEAREST_MAX_RADIUS_KM)
+
+def _rank_nearest(latitude: float, longitude: float, latitudes, longitudes, k: int, accuracy: str):
+    # Positions of the k nearest candidates, nearest first, and their distances
+    distances = distance.haversine_km(latitude, longitude, latitudes, longitudes)
+    order = np.argsort(distances, kind="stable")
+    if accuracy == "exact" and len(order):
+        kth = distances[order[min(k, len(order)) - 1]]
+        order = order[distances[order] <= kth * (1 + distance.BOUNDARY_TOLERANCE) ** 2]
+        exact = distance.geodesic_km(latitude, longitude, latitudes[order], longitudes[order])
+        exact_order = np.argsort(exact, kind="stable")[:k]
+        return order[exact_order], exact[exact_order]
+    order = order[:k]
+    return order, distances[order]
+
+def _get_addresses_by_ids(db: Session, ids, chunk_size: int = 900):
+    # Chunked to stay below SQLite's bound parameter limit
+    ids = [int(address_id) for address_id in ids]
+    addresses = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        addresses.extend(db.execute(select(*_ADDRESS_COLUMNS).where(models.Address.id.in_(chunk))).all())
+    return addresses
+
+def get_address(db: Session, address_id: int):
+    try:
+        logger.debug("Fetching address with ID: %s", address_id)
+        address = db.query(models.Address).filter(models.Address.id == address_id).first()
+        if address:
+            logger.debug("Address found with ID: %s", address_id)
+        else:
+            logger.warning("No address found with ID: %s", address_id)
+        return address
+    except Exception as e:
+        logger.error("Error in get_address: %s", str(e))
+        raise
+
+def address_etag(address_id: int, change_seq: int) -> str:
+    # change_seq comes from a counter shared by every write and never repeats, unlike ids, which
+    # SQLite hands out again after the highest row is deleted
+    return f'"{address_id}-{change_seq}"'
+
+def get_address_payload(db: Session, address_id: int):
+    """Return (serialized address, ETag) for the id, or None, reading through the entity cache."""
+    cached = address_cache.get(address_id)
+    if cached is not None:
+        return cached
+    # Taken before reading, so a write that lands meanwhile keeps the row read out of the cache
+    generation = address_cache.generation(address_id)
+    try:
+        logger.debug("Fetching address with ID: %s", address_id)
+        row = db.execute(
+            select(models.Address.id, models.Address.name, models.Address.latitude, models.Address.longitude, models.Address.change_seq)
+            .where(models.Address.id == address_id)
+        ).first()
+    except Exception as e:
+        logger.error("Error in get_address_payload: %s", str(e))
+        raise
+    if row is None:
+        logger.warning("No address found with ID: %s", address_id)
+        return None
+    entry = ({"id": row.id, "name": row.name, "latitude": row.latitude, "longitude": row.longitude},
+             address_etag(row.id, row.change_seq))
+    address_cache.set(address_id, entry, generation)
+    return entry
+
+def get_addresses(db: Session, page: int = 1, page_size: int = 10, lookahead: bool = False):
+    # With lookahead one extra row is fetched so callers can tell whether a next page exists
+    try:
+        offset = (page - 1) * page_size
+        logger.debug("Fetching addresses for page: %s, page size: %s, offset: %s", page, page_size, offset)
+        limit = page_size + 1 if lookahead else page_size
+        addresses = db.execute(select(*_ADDRESS_COLUMNS).order_by(models.Address.id).offset(offset).limit(limit)).all()
+        logger.debug("%s addresses found on page %s", len(addresses), page)
+        return addresses
+    except Exception as e:
+        logger.error("Error in get_addresses: %s", str(e))
+        raise
+
+def get_addresses_after(db: Session, after_id: int = None, limit: int = 10):
+    """Keyset pagination: the next `limit` addresses with an id greater than `after_id`."""
+    try:
+        logger.debug("Fetching %s addresses after ID: %s", limit, after_id)
+        stmt = select(*_ADDRESS_COLUMNS)
+        if after_id is not None:
+            stmt = stmt.where(models.Address.id > after_id)
+        addresses = db.execute(stmt.order_by(models.Address.id).limit(limit)).all()
+        logger.debug("%s addresses found after ID %s", len(addresses), after_id)
+        return addresses
+    except Exception as e:
+        logger.error("Error in get_addresses_after: %s", str(e))
+        raise
+
+def iter_address_rows(db: Session, batch_size: int = 1000):
+    """Yield lists of (id, name, latitude, longitude) tuples in id order, one batch at a time."""
+    stmt = select(*_ADDRESS_COLUMNS).order_by(models.Address.id).execution_options(yield_per=batch_size)
+    try:
+        for partition in db.execute(stmt).partitions():
+            yield partition
+    except Exception as e:
+        logger.error("Error in iter_address_rows: %s", str(e))
+        raise
+
+def iter_addresses_by_latitude(db: Session, batch_size: int = 10000):
+    """Yield lists of (id, name, latitude, longitude) tuples in latitude order, one batch at a time.
+
+    The order comes from the (latitude, longitude) index, so nothing is sorted in memory.
+    Addresses without coordinates are skipped.
+    """
+    stmt = (select(*_ADDRESS_COLUMNS).where(models.Address.latitude.is_not(None), models.Address.longitude.is_not(None))
+            .order_by(models.Address.latitude).execution_options(yield_per=batch_size))
+    try:
+        for partition in db.execute(stmt).partitions():
+            yield partition
+    except Exception as e:
+        logger.error("Error in iter_addresses_by_latitude: %s", str(e))
+        raise
+
+def iter_addresses_in_bbox(db: Session, min_lat: float, min_lon: float, max_lat: float, max_lon: float, batch_size: int = 1000):
+    """Yield lists of (id, name, latitude, longitude) tuples inside the box, one batch at a time.
+
+    A box with min_lon > max_lon crosses the antimeridian. Rows come in index order, not id order,
+    so the result is never sorted in memory.
+    """
+    stmt = (select(*_ADDRESS_COLUMNS).where(_box_condition(min_lat, max_lat, geo.longitude_ranges(min_lon, max_lon)))
+            .execution_options(yield_per=batch_size))
+    try:
+        for partition in db.execute(stmt).partitions():
+            yield partition
+    except Exception as e:
+        logger.error("Error in iter_addresses_in_bbox: %s", str(e))
+        raise
+
+def iter_addresses_in_polygon(db: Session, polygons, batch_size: int = 1000):
+    """Yield lists of (id, name, latitude, longitude) tuples inside any of ``polygons``, one batch at a time.
+
+    ``polygons`` holds the rings of each polygon as returned by geo.polygon_rings. Candidates are
+    selected by the bounding boxes of the polygons through the coordinate index, and the
+    point-in-polygon test runs vectorized on each batch of candidates.
+    """
+    stmt = (select(*_ADDRESS_COLUMNS).where(or_(*(_box_condition(*geo.polygon_bounds(rings)) for rings in polygons)))
+            .execution_options(yield_per=batch_size))
+    try:
+        for partition in db.execute(stmt).partitions():
+            coordinates = np.array([(row.latitude, row.longitude) for row in partition], dtype=np.float64).reshape(-1, 2)
+            inside = np.zeros(len(partition), dtype=bool)
+            for rings in polygons:
+                inside |= geo.points_in_polygon(coordinates[:, 0], coordinates[:, 1], rings)
+            rows = [row for row, keep in zip(partition, inside) if keep]
+            if rows:
+                yield rows
+    except Exception as e:
+        logger.error("Error in iter_addresses_in_polygon: %s", str(e))
+        raise
+
+def count_addresses(db: Session):
+    try:
+        return db.query(func.count(models.Address.id)).scalar()
+    except Exception as e:
+        logger.error("Error in count_addresses: %s", str(e))
+        raise
+
+def _insert_address_statement():
+    table = models.Address.__table__
+    # A row that would violate _address_uc is skipped and returns nothing, instead of raising
+    return (sqlite_insert(table).on_conflict_do_nothing(index_elements=[table.c.name, table.c.latitude, table.c.longitude])
+            .returning(*_RETURNED_COLUMNS))
+
+_address_insert = _insert_address_statement()
+
+def _update_address_statement(address_id: int, values):
+    table = models.Address.__table__
+    # OR IGNORE skips the row instead of raising when the new values violate _address_uc
+    return (update(table).prefix_with("OR IGNORE").where(table.c.id == address_id)
+            .values(**values, version=table.c.version + 1).returning(*_RETURNED_COLUMNS))
+
+_DUPLICATE_ADDRESS = "Address with the same name and coordinates already exists"
+
+def update_address(db: Session, address_id: int, address: schemas.AddressCreate):
+    """Replace an address with one UPDATE ... RETURNING. Returns the updated row, or None if there is no such address.
+
+    SQLite's RETURNING only reports new values, so the old coordinates that the clusters need
+    are read first, with a primary key lookup that also tells a missing address from a conflict.
+    """
+    try:
+        logger.debug("Updating address with ID: %s", address_id)
+        old = db.execute(select(models.Address.latitude, models.Address.longitude)
+                         .where(models.Address.id == address_id)).first()
+        if old is None:
+            logger.warning("No address found to update with ID: %s", address_id)
+            return None
+        row = db.execute(_update_address_statement(address_id, _address_values(address))).first()
+        if row is None:
+            db.rollback()  # nothing was written; end the read transaction
+            raise HTTPException(status_code=400, detail=_DUPLICATE_ADDRESS)
+        clusters.apply(db, removed=[tuple(old)], added=[(row.latitude, row.longitude)])
+        db.commit()
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in update_address: %s", str(e))
+        db.rollback()
+        raise
+    address_cache.invalidate(address_id)
+    if spatial_index.ready:
+        spatial_index.add(row.id, row.latitude, row.longitude)
+    return row
+
+def _existing_address_statement(address: schemas.AddressCreate):
+    # The address an insert of ``address`` conflicted with
+    return select(*_RETURNED_COLUMNS).where(
+        models.Address.name == address.name, models.Address.latitude == address.latitude,
+        models.Address.longitude == address.longitude)
+
+def _insert_address(db: Session, address: schemas.AddressCreate):
+    # The inserted row, or None when an address with the same name and coordinates exists
+    row = db.execute(_address_insert, _address_values(address)).first()
+    if row is None:
+        return None
+    clusters.apply(db, added=[(row.latitude, row.longitude)])
+    db.commit()
+    if spatial_index.ready:
+        spatial_index.add(row.id, row.latitude, row.longitude)
+    return row
+
+def create_address(db: Session, address: schemas.AddressCreate):
+    """Insert an address with one INSERT ... ON CONFLICT DO NOTHING RETURNING statement."""
+    try:
+        logger.debug("Creating new address with data: %s", address)
+        row = _insert_address(db, address)
+    except Exception as e:
+        logger.error("Error in create_address: %s", str(e))
+        db.rollback()
+        raise
+    if row is None:
+        db.rollback()  # nothing was written; end the transaction
+        raise HTTPException(status_code=400, detail=_DUPLICATE_ADDRESS)
+    logger.debug("New address created with ID: %s", row.id)
+    return row
+
+def upsert_address(db: Session, address: schemas.AddressCreate):
+    """Create the address unless one with the same name and coordinates exists.
+
+    Returns ``(row, created)``. Name and coordinates make up the whole unique key
+    (``_address_uc``), so an existing match has nothing left to update and is returned as is.
+    """
+    try:
+        logger.debug("Upserting address with data: %s", address)
+        while True:
+            row = _insert_address(db, address)
+            if row is not None:
+                return row, True
+            row = db.execute(_existing_address_statement(address)).first()
+            db.rollback()  # nothing was written; end the transaction
+            if row is not None:
+                return row, False
+            # The conflicting address was deleted between the two statements; insert again
+    except Exception as e:
+        logger.error("Error in upsert_address: %s", str(e))
+        db.rollback()
+        raise
+
+def create_addresses_bulk(db: Session, addresses: List[schemas.AddressCreate]):
+    """Insert a batch of addresses in one executemany statement and transaction.
+
+    Rows that violate a unique constraint are skipped. Returns, for each input, the new id or
+    None when the row conflicted with an existing address (or an earlier row of the batch).
+    """
+    if not addresses:
+        return []
+    rows = [_address_values(address) for address in addresses]
+    stmt = (sqlite_insert(models.Address).on_conflict_do_nothing()
+            .returning(models.Address.id, models.Address.name, models.Address.latitude, models.Address.longitude))
+    try:
+        logger.debug("Bulk inserting %s addresses", len(rows))
+        inserted = {(row.name, row.latitude, row.longitude): row.id for row in db.execute(stmt, rows)}
+        clusters.apply(db, added=[(latitude, longitude) for _, latitude, longitude in inserted])
+        db.commit()
+    except Exception as e:
+        logger.error("Error in create_addresses_bulk: %s", str(e))
+        db.rollback()
+        raise
+    ids = [inserted.pop((row["name"], row["latitude"], row["longitude"]), None) for row in rows]
+    if spatial_index.ready:
+        for address_id, row in zip(ids, rows):
+            if address_id is not None:
+                spatial_index.add(address_id, row["latitude"], row["longitude"])
+    logger.debug("%s of %s addresses inserted in bulk", len(rows) - ids.count(None), len(rows))
+    return ids
+
+def delete_address(db: Session, address_id: int):
+    """Delete an address with one DELETE ... RETURNING. Returns the deleted row, or None if there was none."""
+    table = models.Address.__table__
+    try:
+        logger.debug("Deleting address with ID: %s", address_id)
+        row = db.execute(delete(table).where(table.c.id == address_id).returning(*_RETURNED_COLUMNS)).first()
+        if row is None:
+            db.rollback()  # nothing was written; end the transaction
+            logger.warning("No address found to delete with ID: %s", address_id)
+            return None
+        clusters.apply(db, removed=[(row.latitude, row.longitude)])
+        db.commit()
+    except Exception as e:
+        logger.error("Error in delete_address: %s", str(e))
+        db.rollback()  # rollback in case of error
+        raise
+    address_cache.invalidate(address_id)
+    if spatial_index.ready:
+        spatial_index.remove(address_id)
+    logger.debug("Address deleted with ID: %s", address_id)
+    return row
+
+def apply_address_writes(db: Session, writes):
+    """Apply single-address writes from several callers in one transaction with one commit.
+
+    ``writes`` holds ``("create", address)``, ``("upsert", address)``, ``("update", address_id, address)``
+    and ``("delete", address_id)`` tuples. They run in order, so each sees the ones before it as if
+    they had been committed one by one. Returns, for each write, what create_address, upsert_address,
+    update_address or delete_address returns, or the HTTPException it raises for a write that
+    conflicts with an existing address. Any other error rolls back every write and is raised, so an
+    exception always means nothing was committed.
+    """
+    results, added, removed, indexed, invalidated = [], [], [], [], []
+    try:
+        for op, *args in writes:
+            if op in ("create", "upsert"):
+                address, = args
+                row = db.execute(_address_insert, _address_values(address)).first()
+                existing = None
+                while op == "upsert" and row is None and existing is None:
+                    existing = db.execute(_existing_address_statement(address)).first()
+                    if existing is None:
+                        # The conflicting address was deleted after the insert; insert again
+                        row = db.execute(_address_insert, _address_values(address)).first()
+                if row is not None:
+                    added.append((row.latitude, row.longitude))
+                    indexed.append((row.id, row))
+                    results.append((row, True) if op == "upsert" else row)
+                elif op == "upsert":
+                    results.append((existing, False))
+                else:
+                    results.append(HTTPException(status_code=400, detail=_DUPLICATE_ADDRESS))
+            elif op == "update":
+                address_id, address = args
+                old = db.execute(select(models.Address.latitude, models.Address.longitude)
+                                 .where(models.Address.id == address_id)).first()
+                row = None if old is None else db.execute(
+                    _update_address_statement(address_id, _address_values(address))).first()
+                if old is not None and row is None:
+                    results.append(HTTPException(status_code=400, detail=_DUPLICATE_ADDRESS))
+                    continue
+                if row is not None:
+                    removed.append(tuple(old))
+                    added.append((row.latitude, row.longitude))
+                    indexed.append((address_id, row))
+                    invalidated.append(address_id)
+                results.append(row)
+            elif op == "delete":
+                address_id, = args
+                table = models.Address.__table__
+                row = db.execute(delete(table).where(table.c.id == address_id).returning(*_RETURNED_COLUMNS)).first()
+                if row is not None:
+                    removed.append((row.latitude, row.longitude))
+                    indexed.append((address_id, None))
+                    invalidated.append(address_id)
+                results.append(row)
+            else:
+                raise ValueError(f"Unknown write: {op}")
+        if indexed:
+            clusters.apply(db, removed=removed, added=added)
+            db.commit()
+        else:
+            db.rollback()  # nothing was written; end the transaction
+    except Exception as e:
+        logger.error("Error in apply_address_writes: %s", str(e))
+        db.rollback()
+        raise
+    try:
+        for address_id in invalidated:
+            address_cache.invalidate(address_id)
+        if spatial_index.ready:
+            for address_id, row in indexed:
+                if row is None:
+                    spatial_index.remove(address_id)
+                else:
+                    spatial_index.add(address_id, row.latitude, row.longitude)
+    except Exception as e:
+        # The writes are committed, so their callers still get their results; drop the in-process
+        # copies that may have missed them instead (queries fall back to SQL without the index)
+        logger.error("Error updating the cache and spatial index after apply_address_writes: %s", str(e))
+        address_cache.clear()
+        spatial_index.clear()
+    logger.debug("Applied %s address writes in one transaction", len(results))
+    return results
+
+def get_addresses_batch(db: Session, ids: List[int]):
+    """Look up many ids with chunked IN queries. Returns one BatchItemResult per input id, in order."""
+    try:
+        logger.debug("Fetching %s addresses by id", len(ids))
+        found = {address.id: address for address in _get_addresses_by_ids(db, dict.fromkeys(ids))}
+    except Exception as e:
+        logger.error("Error in get_addresses_batch: %s", str(e))
+        raise
+    return [
+        schemas.BatchItemResult(id=address_id, status="ok", address=schemas.Address.model_validate(found[address_id]))
+        if address_id in found else schemas.BatchItemResult(id=address_id, status="not_found")
+        for address_id in ids
+    ]
+
+def delete_addresses_batch(db: Session, ids: List[int], chunk_size: int = 900):
+    """Delete many ids in one transaction with chunked DELETE ... IN ... RETURNING statements.
+
+    Returns one BatchItemResult per input id, carrying the deleted address or not_found.
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    deleted = {}
+    try:
+        logger.debug("Deleting %s addresses by id", len(unique_ids))
+        for start in range(0, len(unique_ids), chunk_size):
+            stmt = (delete(models.Address.__table__)
+                    .where(models.Address.id.in_(unique_ids[start:start + chunk_size]))
+                    .returning(*_ADDRESS_COLUMNS))
+            for row in db.execute(stmt):
+                deleted[row.id] = schemas.Address(id=row.id, name=row.name, latitude=row.latitude, longitude=row.longitude)
+        clusters.apply(db, removed=[(address.latitude, address.longitude) for address in deleted.values()])
+        db.commit()
+    except Exception as e:
+        logger.error("Error in delete_addresses_batch: %s", str(e))
+        db.rollback()
+        raise
+    for address_id in deleted:
+        address_cache.invalidate(address_id)
+        if spatial_index.ready:
+            spatial_index.remove(address_id)
+    logger.debug("%s of %s addresses deleted in batch", len(deleted), len(unique_ids))
+    reported = set()
+    items = []
+    for address_id in ids:
+        if address_id in deleted and address_id not in reported:
+            items.append(schemas.BatchItemResult(id=address_id, status="ok", address=deleted[address_id]))
+            reported.add(address_id)
+        else:
+            items.append(schemas.BatchItemResult(id=address_id, status="not_found"))
+    return items
+
+def _unique_key(values):
+    return (values["name"], values["latitude"], values["longitude"])
+
+def _resolve_batch_conflicts(current, targets, holders):
+    """Choose which patched rows can take their new (name, latitude, longitude) key.
+
+    ``current`` and ``targets`` map each patched id to its key before and after the patch, in
+    request order; ``holders`` maps keys to the ids of other rows that hold them. Rows that are
+    not accepted keep their current key, which may in turn block another row, so this repeats
+    until no key has two owners. Returns the accepted ids.
+    """
+    accepted = set(targets)
+    while True:
+        owners = {}
+        for key, address_ids in holders.items():
+            owners.setdefault(key, []).extend((address_id, True) for address_id in address_ids)
+        for address_id in targets:
+            if address_id in accepted:
+                owners.setdefault(targets[address_id], []).append((address_id, False))
+            else:
+                owners.setdefault(current[address_id], []).append((address_id, True))
+        rejected = set()
+        for key, key_owners in owners.items():
+            if len(key_owners) < 2:
+                continue
+            claimants = [address_id for address_id, fixed in key_owners if not fixed]
+            # A key held by a row that is not moving stays with it. Otherwise the claimant already
+            # holding the key keeps it, or else the first one in request order.
+            keep = None
+            if len(claimants) == len(key_owners):
+                keep = next((address_id for address_id in claimants if current[address_id] == key), claimants[0])
+            rejected.update(address_id for address_id in claimants if address_id != keep)
+        if not rejected:
+            return accepted
+        accepted -= rejected
+
+def update_addresses_batch(db: Session, patches: List[schemas.AddressPatch], chunk_size: int = 300):
+    """Apply partial updates to many addresses in one transaction.
+
+    Existing rows and the rows already holding the new unique keys are read with chunked IN
+    queries, conflicts are resolved in memory, and the accepted rows are written with one
+    executemany UPDATE (two when rows of the batch take over each other's keys). Returns one
+    BatchItemResult per patch, in order.
+    """
+    seen = set()
+    duplicates = set()
+    for position, patch in enumerate(patches):
+        if patch.id in seen:
+            duplicates.add(position)
+        seen.add(patch.id)
+    try:
+        logger.debug("Updating %s addresses in batch", len(patches))
+        existing = {address.id: address for address in _get_addresses_by_ids(db, list(seen))}
+        current, targets = {}, {}
+        for position, patch in enumerate(patches):
+            if position in duplicates or patch.id not in existing:
+                continue
+            db_address = existing[patch.id]
+            values = {"name": db_address.name, "latitude": db_address.latitude, "longitude": db_address.longitude}
+            current[patch.id] = _unique_key(values)
+            targets[patch.id] = _unique_key(values | patch.model_dump(exclude={"id"}, exclude_none=True))
+
+        keys = list(dict.fromkeys(targets.values()))
+        holders = {}
+        for start in range(0, len(keys), chunk_size):
+            stmt = (select(*_ADDRESS_COLUMNS)
+                    .where(tuple_(models.Address.name, models.Address.latitude, models.Address.longitude)
+                           .in_(keys[start:start + chunk_size])))
+            for row in db.execute(stmt):
+                if row.id not in targets:
+                    holders.setdefault((row.name, row.latitude, row.longitude), []).append(row.id)
+        accepted = _resolve_batch_conflicts(current, targets, holders)
+
+        rows = [{"b_id": address_id, "b_name": name, "b_latitude": latitude, "b_longitude": longitude,
+                 "b_geohash": geo.encode_geohash(latitude, longitude)}
+                for address_id, (name, latitude, longitude) in targets.items() if address_id in accepted]
+        if rows:
+            table = models.Address.__table__
+            # SQLite checks the unique constraint row by row, so rows whose current key is taken over
+            # by another row of the batch (including swaps) first move to a placeholder name
+            claimed = {targets[address_id] for address_id in accepted if targets[address_id] != current[address_id]}
+            vacating = [{"b_id": address_id, "b_name": f"\x00batch-{address_id}"} for address_id in accepted
+                        if current[address_id] in claimed and targets[address_id] != current[address_id]]
+            if vacating:
+                db.execute(update(table).where(table.c.id == bindparam("b_id")).values(name=bindparam("b_name")), vacating)
+            stmt = (update(table).where(table.c.id == bindparam("b_id"))
+                    .values(name=bindparam("b_name"), latitude=bindparam("b_latitude"), longitude=bindparam("b_longitude"),
+                            geohash=bindparam("b_geohash"), version=table.c.version + 1))
+            db.execute(stmt, rows)
+            clusters.apply(db, removed=[current[row["b_id"]][1:] for row in rows],
+                           added=[(row["b_latitude"], row["b_longitude"]) for row in rows])
+        db.commit()
+    except IntegrityError as e:
+        # Only reachable when a concurrent write took one of the keys
+        logger.error("Integrity Error in update_addresses_batch: %s", str(e))
+        db.rollback()
+        raise HTTPException(status_code=400, detail=_DUPLICATE_ADDRESS)
+    except Exception as e:
+        logger.error("Error in update_addresses_batch: %s", str(e))
+        db.rollback()
+        raise
+    for row in rows:
+        address_cache.invalidate(row["b_id"])
+        if spatial_index.ready:
+            spatial_index.add(row["b_id"], row["b_latitude"], row["b_longitude"])
+    logger.debug("%s of %s addresses updated in batch", len(rows), len(patches))
+
+    items = []
+    for position, patch in enumerate(patches):
+        if position in duplicates:
+            items.append(schemas.BatchItemResult(id=patch.id, status="conflict", detail="Duplicate id in batch"))
+        elif patch.id not in existing:
+            items.append(schemas.BatchItemResult(id=patch.id, status="not_found"))
+        elif patch.id not in accepted:
+            items.append(schemas.BatchItemResult(id=patch.id, status="conflict",
+                                                 detail=_DUPLICATE_ADDRESS))
+        else:
+            name, latitude, longitude = targets[patch.id]
+            items.append(schemas.BatchItemResult(id=patch.id, status="ok", address=schemas.Address(
+                id=patch.id, name=name, latitude=latitude, longitude=longitude)))
+    return items
+
+def get_addresses_within_distance(db: Session, latitude: float, longitude: float, distance_km: float, accuracy: str = "exact"):
+    try:
+        logger.debug("Fetching addresses within %s km of (%s, %s)", distance_km, latitude, longitude)
+        ids, latitudes, longitudes = _candidate_coordinates(db, latitude, longitude, distance_km)
+        mask = distance.within_distance_mask(latitude, longitude, latitudes, longitudes, distance_km, accuracy)
+        nearby_addresses = sorted(_get_addresses_by_ids(db, ids[mask]), key=lambda address: address.id)
+        logger.debug("%s addresses found within %s km of (%s, %s)", len(nearby_addresses), distance_km, latitude, longitude)
+        return nearby_addresses
+    except Exception as e:
+        logger.error("Error in get_addresses_within_distance: %s", str(e))
+        raise
+
+def _batch_candidates(db: Session, queries, chunk_size: int = 100):
+    # (ids, latitudes, longitudes) of the points in any query's bounding box, each point once and sorted
+    # by id: one index probe per box, or one statement per chunk of boxes (at most 6 parameters each)
+    boxes = list(dict.fromkeys((min_lat, max_lat, tuple(lon_ranges)) for min_lat, max_lat, lon_ranges
+                               in (geo.bounding_box(*query) for query in queries)))
+    if spatial_index.ready:
+        parts = [spatial_index.query_bbox(min_lat, max_lat, list(lon_ranges)) for min_lat, max_lat, lon_ranges in boxes]
+    else:
+        parts = []
+        for start in range(0, len(boxes), chunk_size):
+            condition = or_(*(_box_condition(min_lat, max_lat, list(lon_ranges))
+                              for min_lat, max_lat, lon_ranges in boxes[start:start + chunk_size]))
+            stmt = select(models.Address.id, models.Address.latitude, models.Address.longitude).where(condition)
+            parts.append(_coordinate_arrays(db.execute(stmt).all()))
+    ids = np.concatenate([part[0] for part in parts])
+    ids, first = np.unique(ids, return_index=True)
+    return ids, np.concatenate([part[1] for part in parts])[first], np.concatenate([part[2] for part in parts])[first]
+
+def get_addresses_within_distance_batch(db: Session, queries, accuracy: str = "exact", matrix: bool = False):
+    """Answer many ``(latitude, longitude, distance_km)`` queries against one shared candidate load.
+
+    Returns ``(results, distances)``: for each query, its address rows sorted by id (as
+    get_addresses_within_distance returns them), and, when ``matrix`` is set, ``(address_ids,
+    distances_km)`` with the distance from every origin to every matched address. Batches of at
+    least PROXIMITY_PARALLEL_MIN_QUERIES queries run on the process pool in app/distance.py.
+    """
+    workers = config.PROXIMITY_WORKERS if len(queries) >= config.PROXIMITY_PARALLEL_MIN_QUERIES else 1
+    try:
+        logger.debug("Fetching addresses within distance of %s points", len(queries))
+        ids, latitudes, longitudes = _batch_candidates(db, queries)
+        by_latitude = np.argsort(latitudes, kind="stable")
+        matches = distance.match_within_distance(queries, latitudes[by_latitude], longitudes[by_latitude], accuracy, workers)
+        matched_ids = [np.sort(ids[by_latitude[positions]]) for positions in matches]
+        address_ids = np.unique(np.concatenate(matched_ids)) if matched_ids else np.empty(0, dtype=np.int64)
+        max_cells = config.PROXIMITY_MATRIX_MAX_CELLS if accuracy == "fast" else config.PROXIMITY_EXACT_MATRIX_MAX_CELLS
+        if matrix and len(queries) * len(address_ids) > max_cells:
+            raise HTTPException(status_code=400, detail=f"Distance matrix would have more than {max_cells} cells"
+                                + ("" if accuracy == "fast" else "; larger matrices need accuracy=fast"))
+        rows = {row.id: row for row in _get_addresses_by_ids(db, address_ids)}
+        results = [[rows[address_id] for address_id in query_ids.tolist() if address_id in rows] for query_ids in matched_ids]
+        distances = None
+        if matrix:
+            columns = np.searchsorted(ids, address_ids)
+            distances = (address_ids, distance.distance_matrix([query[:2] for query in queries], latitudes[columns],
+                                                               longitudes[columns], accuracy, workers))
+        logger.debug("%s addresses matched by %s queries", len(address_ids), len(queries))
+        return results, distances
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error in get_addresses_within_distance_batch: %s", str(e))
+        raise
+
+def get_nearest_addresses(db: Session, latitude: float, longitude: float, k: int, accuracy: str = "exact"):
+    """Return the k addresses closest to the point as (address row, distance_km) pairs, nearest first."""
+    try:
+        logger.debug("Fetching %s addresses nearest to (%s, %s)", k, latitude, longitude)
+        radius = _NEAREST_INITIAL_RADIUS_KM
+        while True:
+            ids, latitudes, longitudes = _candidate_coordinates(db, latitude, longitude, radius)
+            next_radius = _next_nearest_radius(latitude, longitude, latitudes, longitudes, radius, k)
+            if next_radius is None:
+                break
+            radius = next_radius
+        order, nearest_distances = _rank_nearest(latitude, longitude, latitudes, longitudes, k, accuracy)
+
+        addresses = {address.id: address for address in _get_addresses_by_ids(db, ids[order])}
+        nearest = [(addresses[int(address_id)], float(d)) for address_id, d in zip(ids[order], nearest_distances)
+                   if int(address_id) in addresses]
+        logger.debug("%s nearest addresses found within %s km of (%s, %s)", len(nearest), radius, latitude, longitude)
+        return nearest
+    except Exception as e:
+        logger.error("Error in get_nearest_addresses: %s", str(e))
+        raise
+
+def get_changes(db: Session, since: int = 0, limit: int = 100):
+    """Changes made after sequence number ``since``, oldest first, for /addresses/changes.
+
+    Returns ``(changes, has_more)``. Changes are ``(seq, op, id, name, latitude, longitude)`` rows
+    with op "upsert" or "delete" (no name or coordinates). An address appears once, in its latest
+    state, so a client converges on the current book without replaying every intermediate write.
+    Both queries are range scans of a change_seq index, so their cost follows the number of changes.
+    """
+    tombstones = models.AddressTombstone
+    try:
+        logger.debug("Fetching up to %s changes after %s", limit, since)
+        upserts = db.execute(
+            select(models.Address.change_seq, literal("upsert"), *_ADDRESS_COLUMNS)
+            .where(models.Address.change_seq > since).order_by(models.Address.change_seq).limit(limit + 1)
+        ).all()
+        deletes = db.execute(
+            select(tombstones.change_seq, literal("delete"), tombstones.id, null(), null(), null())
+            .where(tombstones.change_seq > since).order_by(tombstones.change_seq).limit(limit + 1)
+        ).all()
+    except Exception as e:
+        logger.error("Error in get_changes: %s", str(e))
+        raise
+    changes = list(heapq.merge(upserts, deletes, key=lambda change: change[0]))
+    return changes[:limit], len(changes) > limit
+
+def get_address_clusters(db: Session, min_lon: float, min_lat: float, max_lon: float, max_lat: float, zoom: int):
+    """Return the non-empty grid cells of ``zoom`` inside the box as (x, y, count, latitude, longitude) tuples.
+
+    Cells come from the maintained address_clusters table; latitude and longitude are the centroid
+    of the addresses in the cell.
+    """
+    try:
+        logger.debug("Fetching zoom %s clusters in (%s, %s, %s, %s)", zoom, min_lon, min_lat, max_lon, max_lat)
+        rows = db.execute(clusters.clusters_statement(min_lon, min_lat, max_lon, max_lat, zoom)).all()
+        return [(x, y, count, latitude_sum / count, longitude_sum / count)
+                for x, y, count, latitude_sum, longitude_sum in rows]
+    except Exception as e:
+        logger.error("Error in get_address_clusters: %s", str(e))
+        raise
+
+def _fts_query(q: str) -> str:
+    # Quote every token so FTS5 syntax in user input is matched literally. The last token may be
+    # incomplete and also matches as a prefix; names holding the whole word still rank higher.
+    tokens = re.findall(r"\w+", q)
+    if not tokens:
+        raise ValueError("Search query has no searchable terms")
+    *words, last = (f'"{token}"' for token in tokens)
+    return " AND ".join(words + [f"({last} OR {last}*)"])
+
+def search_addresses(db: Session, q: str, limit: int = 20, latitude: float = None, longitude: float = None,
+                     distance_km: float = None, accuracy: str = "exact", order_by: str = "relevance", batch_size: int = 500):
+    """Return up to ``limit`` addresses whose name matches ``q`` as (address row, score, distance_km) triples.
+
+    Every token of ``q`` must match and the last one also matches as a prefix, so "cafe ro" finds
+    "Café Rouge". The score is the negated bm25 rank, higher is better. Given a location and
+    distance_km, the bounding box of the radius is applied in the same query and the exact distance
+    is only computed for the name matches, which are then ordered by relevance or, with
+    order_by="distance", nearest first. Without a location distance_km is None in the results.
+    """
+    match = _fts_query(q)
+    try:
+        logger.debug("Searching addresses for %r", q)
+        stmt = (select(*_ADDRESS_COLUMNS, _address_fts.c.rank)
+                .select_from(_address_fts.join(models.Address, models.Address.id == _address_fts.c.rowid))
+                .where(text("addresses_fts MATCH :match").bindparams(match=match))
+                .order_by(_address_fts.c.rank, models.Address.id))
+        if distance_km is None:
+            return [(tuple(row[:4]), -row.rank, None) for row in db.execute(stmt.limit(limit))]
+
+        stmt = _within_bounding_box(stmt, latitude, longitude, distance_km).execution_options(yield_per=batch_size)
+        matches = []
+        result = db.execute(stmt)
+        try:
+            for partition in result.partitions():
+                coordinates = np.array([(row.latitude, row.longitude) for row in partition], dtype=np.float64)
+                mask = distance.within_distance_mask(latitude, longitude, coordinates[:, 0], coordinates[:, 1],
+                                                     distance_km, accuracy)
+                matches.extend(row for row, inside in zip(partition, mask) if inside)
+                # Rows arrive by relevance, so the first `limit` matches are the answer unless ordering by distance
+                if order_by == "relevance" and len(matches) >= limit:
+                    break
+        finally:
+            result.close()
+
+        latitudes = np.array([row.latitude for row in matches], dtype=np.float64)
+        longitudes = np.array([row.longitude for row in matches], dtype=np.float64)
+        if order_by == "distance":
+            order, distances = _rank_nearest(latitude, longitude, latitudes, longitudes, limit, accuracy)
+        else:
+            order = np.arange(min(limit, len(matches)))
+            if accuracy == "exact":
+                distances = distance.geodesic_km(latitude, longitude, latitudes[order], longitudes[order])
+            else:
+                distances = distance.haversine_km(latitude, longitude, latitudes[order], longitudes[order])
+        found = [(tuple(matches[i][:4]), -matches[i].rank, float(d)) for i, d in zip(order, distances)]
+        logger.debug("%s addresses found for %r within %s km of (%s, %s)", len(found), q, distance_km, latitude, longitude)
+        return found
+    except Exception as e:
+        logger.error("Error in search_addresses: %s", str(e))
+        raise
+
@@ -1,48 +1,262 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
-import logging
-
-logger = logging.getLogger(__name__)
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-
-# Function to initialize the database engine with retries
-def create_db_engine(url, retries=3):
-    attempt = 0
-    while attempt < retries:
-        try:
-            logger.debug("Creating database engine")
-            engine = create_engine(url, connect_args={"check_same_thread": False})
-            logger.info("Database engine created successfully")
-            return engine
-        except Exception as e:
-            logger.error("Error creating database engine: %s", str(e))
-            attempt += 1
-            if attempt < retries:
-                logger.warning(f"Retrying to create database engine ({attempt}/{retries})")
-    raise Exception("Failed to create database engine after multiple attempts")
-
-try:
-    # Initialize db engine
-    engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
-except Exception as e:
-    logger.critical("Failed to initialize database engine: %s", str(e))
-    raise
-
-try:
-    # Initialize session
-    logger.debug("Creating session local")
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    logger.info("Session local created successfully")
-except Exception as e:
-    logger.critical("Error creating session local: %s", str(e))
-    raise
-
-try:
-    # Base model class
-    logger.debug("Creating base model class")
-    Base = declarative_base()
-    logger.info("Base model class created successfully")
-except Exception as e:
-    logger.critical("Error creating base model class: %s", str(e))
-    raise
\ No newline at end of file
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from . import config, metrics, profiling
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+def _is_memory_database(url):
+    database = make_url(url).database
+    return not database or database == ":memory:" or database.startswith("file::memory:")
+
+def _sqlite_pragmas(read_only=False):
+    pragmas = [
+        ("journal_mode", config.SQLITE_JOURNAL_MODE),
+        ("synchronous", config.SQLITE_SYNCHRONOUS),
+        ("cache_size", config.SQLITE_CACHE_SIZE),
+        ("mmap_size", config.SQLITE_MMAP_SIZE),
+        ("busy_timeout", config.SQLITE_BUSY_TIMEOUT_MS),
+    ]
+    if read_only:
+        pragmas.append(("query_only", "ON"))
+    return pragmas
+
+def apply_sqlite_pragmas(engine, read_only=False):
+    """Run the configured PRAGMAs on every new DBAPI connection of the engine."""
+    pragmas = _sqlite_pragmas(read_only)
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
+def create_db_engine(url, read_only=False, name=None, **engine_kwargs):
+    """Create an engine with the SQLite PRAGMAs applied; ``name`` labels its statements in /metrics.
+
+    Creating an engine does not connect; see check_database() for the startup connection check.
+    """
+    logger.debug("Creating database engine")
+    connect_args = {"check_same_thread": False}
+    if config.PROFILING_ENABLED and make_url(url).get_backend_name() == "sqlite":
+        # Cursors that count and time fetched rows (see app/profiling.py)
+        connect_args["factory"] = profiling.ProfilingConnection
+    engine = create_engine(url, connect_args=connect_args, **engine_kwargs)
+    if engine.dialect.name == "sqlite":
+        apply_sqlite_pragmas(engine, read_only=read_only)
+    if config.PROFILING_ENABLED:
+        profiling.instrument_engine(engine)
+    if config.METRICS_ENABLED and name is not None:
+        metrics.instrument_engine(engine, name)
+    logger.info("Database engine created successfully")
+    return engine
+
+def _pool_kwargs(url, pool_size, max_overflow, pool_timeout=30):
+    # In-memory databases keep SQLAlchemy's default SingletonThreadPool, one connection per thread;
+    # they take no pool size or timeout
+    if _is_memory_database(url):
+        return {}
+    return {"pool_size": pool_size, "max_overflow": max_overflow, "pool_timeout": pool_timeout}
+
+# Engines are created on first use rather than at import, so importing the app (a worker
+# booting, test collection, Alembic) does no database work
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _get_or_create_engine(name, factory):
+    engine = _engines.get(name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = _engines[name] = factory()
+    return engine
+
+def get_engine():
+    """Engine for writes: one dedicated connection serializes writes in the pool instead of
+    letting concurrent writers fail with "database is locked"."""
+    return _get_or_create_engine("write", lambda: create_db_engine(
+        SQLALCHEMY_DATABASE_URL, name="write", **_pool_kwargs(SQLALCHEMY_DATABASE_URL, 1, 0, config.DB_WRITE_TIMEOUT)))
+
+def get_read_engine():
+    """Read-only engine for GET routes; under WAL readers never wait for the writer."""
+    if _is_memory_database(SQLALCHEMY_DATABASE_URL):
+        return get_engine()
+    return _get_or_create_engine("read", lambda: create_db_engine(
+        SQLALCHEMY_DATABASE_URL, read_only=True, name="read",
+        **_pool_kwargs(SQLALCHEMY_DATABASE_URL, config.DB_READ_POOL_SIZE, config.DB_READ_MAX_OVERFLOW)))
+
+def _create_async_engine():
+    async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+    apply_sqlite_pragmas(async_engine.sync_engine)
+    if config.METRICS_ENABLED:
+        metrics.instrument_engine(async_engine.sync_engine, "async")
+    return async_engine
+
+def get_async_engine():
+    """Async engine for the async routes, or None when ADDRESS_BOOK_ASYNC_DB is off (aiosqlite is only needed then)."""
+    if not config.ASYNC_DB_ENABLED:
+        return None
+    return _get_or_create_engine("async", _create_async_engine)
+
+def init_engines():
+    """Create every configured engine now instead of on the first request."""
+    get_engine()
+    get_read_engine()
+    get_async_engine()
+
+class _BindOnFirstUse:
+    # Session factory mixin that binds the factory to its engine when the first session is made
+    def __init__(self, get_bind, **kw):
+        super().__init__(**kw)
+        self._get_bind = get_bind
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self._get_bind())
+        return super().__call__(**local_kw)
+
+class _LazySessionmaker(_BindOnFirstUse, sessionmaker):
+    pass
+
+class _LazyAsyncSessionmaker(_BindOnFirstUse, async_sessionmaker):
+    pass
+
+SessionLocal = _LazySessionmaker(get_engine, autocommit=False, autoflush=False)
+ReadSessionLocal = _LazySessionmaker(get_read_engine, autocommit=False, autoflush=False)
+AsyncSessionLocal = _LazyAsyncSessionmaker(get_async_engine, autoflush=False, expire_on_commit=False)
+
+# Base model class
+Base = declarative_base()
+
+def check_database(retries=None, retry_delay=None):
+    """Open a connection on each engine so configuration errors surface at startup.
+
+    A database that is not reachable yet (a network volume still mounting, say) is retried
+    ``retries`` times, ``retry_delay`` seconds apart.
+    """
+    retries = config.DB_CONNECT_RETRIES if retries is None else retries
+    retry_delay = config.DB_CONNECT_RETRY_DELAY if retry_delay is None else retry_delay
+    engine, read_engine = get_engine(), get_read_engine()
+    for attempt in range(1, retries + 1):
+        try:
+            with engine.connect() as connection:
+                journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar() if engine.dialect.name == "sqlite" else None
+            with read_engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            break
+        except OperationalError as e:
+            if attempt >= retries:
+                logger.critical("Could not connect to the database after %s attempts: %s", retries, str(e))
+                raise
+            logger.warning("Could not connect to the database (%s/%s): %s", attempt, retries, str(e))
+            time.sleep(retry_delay)
+    logger.info("Database ready at %s (journal_mode=%s)", engine.url.render_as_string(hide_password=True), journal_mode)
+
+def _alembic_config():
+    from alembic.config import Config
+
+    alembic_config = Config(config.ALEMBIC_CONFIG)
+    # script_location in alembic.ini is relative to the repository root, not to the working directory
+    alembic_config.set_main_option("script_location", os.path.join(os.path.dirname(os.path.abspath(config.ALEMBIC_CONFIG)), "alembic"))
+    # Keep the application's logging configuration (see alembic/env.py)
+    alembic_config.attributes["configure_logger"] = False
+    return alembic_config
+
+_REVISION_LINE = re.compile(r"^(down_revision|revision)\b[^=]*=(.*)$", re.MULTILINE)
+
+def _migration_heads(versions_directory):
+    # Read revision/down_revision from the scripts with a regex rather than through Alembic's
+    # ScriptDirectory: importing Alembic costs ~200 ms, which every worker would pay at startup
+    # even though the schema is almost always current
+    revisions, parents = set(), set()
+    for filename in os.listdir(versions_directory):
+        if not filename.endswith(".py"):
+            continue
+        with open(os.path.join(versions_directory, filename), encoding="utf-8") as f:
+            for name, value in _REVISION_LINE.findall(f.read()):
+                ids = re.findall(r"['\"]([^'\"]+)['\"]", value)
+                if name == "revision":
+                    revisions.update(ids)
+                else:
+                    parents.update(ids)
+    return revisions - parents
+
+def _schema_state(connection):
+    # (Alembic revisions of the database, whether it has the addresses table)
+    database_inspector = inspect(connection)
+    current = set()
+    if database_inspector.has_table("alembic_version"):
+        current = set(connection.execute(text("SELECT version_num FROM alembic_version")).scalars())
+    return current, database_inspector.has_table("addresses")
+
+def _upgrade_schema(engine, heads):
+    from alembic import command
+
+    with engine.begin() as connection:
+        if connection.dialect.name == "sqlite":
+            # Take the write lock before reading the revision again: workers starting together
+            # upgrade one at a time, and those that waited find the schema already current
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+        current, _ = _schema_state(connection)
+        if current == heads:
+            logger.info("Database schema was upgraded by another process to %s", ", ".join(sorted(current)))
+            return
+        logger.info("Upgrading database schema from %s to %s", ", ".join(sorted(current)) or "an empty database",
+                    ", ".join(sorted(heads)))
+        alembic_config = _alembic_config()
+        alembic_config.attributes["connection"] = connection
+        command.upgrade(alembic_config, "heads")
+
+def check_schema(mode=None):
+    """Compare the database's Alembic revision with the head of the migration scripts.
+
+    ``mode`` (ADDRESS_BOOK_SCHEMA_CHECK) decides what happens when they differ: ``upgrade`` runs
+    the pending migrations, ``error`` refuses to start, ``warn`` logs a warning and ``off``
+    skips the check. Alembic itself is only imported to upgrade.
+    """
+    mode = mode or config.SCHEMA_CHECK
+    if mode == "off":
+        return
+    if not os.path.exists(config.ALEMBIC_CONFIG):
+        logger.warning("Schema check skipped: %s not found", config.ALEMBIC_CONFIG)
+        return
+    heads = _migration_heads(os.path.join(os.path.dirname(os.path.abspath(config.ALEMBIC_CONFIG)), "alembic", "versions"))
+    engine = get_engine()
+    with engine.connect() as connection:
+        current, has_tables = _schema_state(connection)
+    if current == heads:
+        logger.info("Database schema is at revision %s", ", ".join(sorted(current)))
+        return
+    if not current and has_tables:
+        # Tables made by metadata.create_all(), which older versions ran on import
+        logger.warning("Database has no Alembic revision; once its schema matches the models, run `alembic stamp head`")
+        return
+    if mode == "upgrade":
+        _upgrade_schema(engine, heads)
+        return
+    message = (f"Database schema is at revision {', '.join(sorted(current)) or 'none'} but the migrations are at "
+               f"{', '.join(sorted(heads))}; run `alembic upgrade head`")
+    if mode == "error":
+        raise RuntimeError(message)
+    logger.warning(message)
+
+async def dispose_engines():
+    for name, engine in list(_engines.items()):
+        if name == "async":
+            await engine.dispose()
+        else:
+            engine.dispose()
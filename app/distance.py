@@ -0,0 +1,144 @@
+import concurrent.futures
+import multiprocessing
+import threading
+
+import numpy as np
+from geopy.distance import geodesic
+
+from . import geo
+
+# Mean earth radius (IUGG) used by the spherical haversine kernel
+EARTH_RADIUS_KM = 6371.0088
+
+# Haversine on the mean sphere differs from the WGS-84 geodesic by less than
+# 0.6%, so only points within this relative band around the radius can be
+# classified differently by the two and need an exact geodesic check.
+BOUNDARY_TOLERANCE = 0.006
+
+ACCURACY_MODES = ("fast", "exact")
+
+
+def haversine_km(latitude: float, longitude: float, latitudes, longitudes) -> np.ndarray:
+    """Great-circle distances in km from one point to arrays of points."""
+    lat1 = np.radians(latitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(longitudes, dtype=np.float64) - longitude)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_km(latitude: float, longitude: float, latitudes, longitudes) -> np.ndarray:
+    """Ellipsoidal (WGS-84) distances in km; one geopy call per point, so keep the arrays short."""
+    return np.fromiter((geodesic((latitude, longitude), (lat, lon)).km for lat, lon in zip(latitudes, longitudes)),
+                       dtype=np.float64, count=len(latitudes))
+
+
+def within_distance_mask(latitude: float, longitude: float, latitudes, longitudes,
+                         distance_km: float, accuracy: str = "exact") -> np.ndarray:
+    """Boolean mask of the points lying within ``distance_km`` of ``(latitude, longitude)``.
+
+    ``fast`` uses the spherical haversine distance only. ``exact`` matches a
+    per-point geodesic comparison while running geodesic only on the points
+    whose haversine distance falls inside the tolerance band around the radius.
+    """
+    if accuracy not in ACCURACY_MODES:
+        raise ValueError(f"Unknown accuracy mode: {accuracy}")
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    if accuracy == "fast":
+        return distances <= distance_km
+
+    margin = distance_km * BOUNDARY_TOLERANCE + 1e-9
+    mask = distances <= distance_km - margin
+    for i in np.flatnonzero(np.abs(distances - distance_km) <= margin):
+        mask[i] = geodesic((latitude, longitude), (latitudes[i], longitudes[i])).km <= distance_km
+    return mask
+
+
+def _match_queries(queries, latitudes, longitudes, accuracy):
+    # ``latitudes`` is sorted, so each query only tests the slice inside its latitude band
+    matches = []
+    for latitude, longitude, distance_km in queries:
+        min_lat, max_lat, _ = geo.bounding_box(latitude, longitude, distance_km)
+        lo = int(np.searchsorted(latitudes, min_lat, side="left"))
+        hi = int(np.searchsorted(latitudes, max_lat, side="right"))
+        mask = within_distance_mask(latitude, longitude, latitudes[lo:hi], longitudes[lo:hi], distance_km, accuracy)
+        matches.append(np.flatnonzero(mask) + lo)
+    return matches
+
+
+def _distance_rows(origins, latitudes, longitudes, accuracy):
+    kernel = haversine_km if accuracy == "fast" else geodesic_km
+    return np.array([kernel(latitude, longitude, latitudes, longitudes) for latitude, longitude in origins],
+                    dtype=np.float64).reshape(len(origins), len(latitudes))
+
+
+# Process pool for large proximity batches; geodesic checks run in Python and hold the GIL, so
+# threads would not help. Created on first use and shut down with the app (see app/startup.py).
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the app process runs threads (log listener, threadpool) that fork would copy mid-state
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
+
+def match_within_distance(queries, latitudes, longitudes, accuracy: str = "exact", workers: int = 1):
+    """Positions of the points within each query's distance, for many ``(latitude, longitude, distance_km)`` queries.
+
+    ``latitudes`` and ``longitudes`` are the shared candidates, sorted by latitude. With
+    ``workers`` > 1 the queries are split, in latitude order, into chunks that run in a process
+    pool; each chunk is sent only the candidates inside its latitude band.
+    """
+    if accuracy not in ACCURACY_MODES:
+        raise ValueError(f"Unknown accuracy mode: {accuracy}")
+    if workers <= 1 or len(queries) < 2:
+        return _match_queries(queries, latitudes, longitudes, accuracy)
+    order = sorted(range(len(queries)), key=lambda i: queries[i][0])
+    chunk_size = -(-len(order) // (workers * 4))  # a few chunks per worker evens out uneven bands
+    futures = []
+    for start in range(0, len(order), chunk_size):
+        chunk = [queries[i] for i in order[start:start + chunk_size]]
+        bands = [geo.bounding_box(*query)[:2] for query in chunk]
+        lo = int(np.searchsorted(latitudes, min(band[0] for band in bands), side="left"))
+        hi = int(np.searchsorted(latitudes, max(band[1] for band in bands), side="right"))
+        futures.append((lo, _get_pool(workers).submit(_match_queries, chunk, latitudes[lo:hi], longitudes[lo:hi], accuracy)))
+    matches = [None] * len(queries)
+    position = 0
+    for lo, future in futures:
+        for positions in future.result():
+            matches[order[position]] = positions + lo
+            position += 1
+    return matches
+
+
+def distance_matrix(origins, latitudes, longitudes, accuracy: str = "exact", workers: int = 1) -> np.ndarray:
+    """Distances in km from each ``(latitude, longitude)`` origin to every point, one row per origin.
+
+    ``exact`` computes geodesic distances, one geopy call per cell, so rows are spread over the
+    process pool when ``workers`` > 1.
+    """
+    if accuracy not in ACCURACY_MODES:
+        raise ValueError(f"Unknown accuracy mode: {accuracy}")
+    if workers <= 1 or len(origins) < 2:
+        return _distance_rows(origins, latitudes, longitudes, accuracy)
+    chunk_size = -(-len(origins) // (workers * 4))
+    futures = [_get_pool(workers).submit(_distance_rows, origins[start:start + chunk_size], latitudes, longitudes, accuracy)
+               for start in range(0, len(origins), chunk_size)]
+    return np.concatenate([future.result() for future in futures]).reshape(len(origins), len(latitudes))
+
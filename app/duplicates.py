@@ -0,0 +1,371 @@
+import argparse
+import difflib
+import functools
+import logging
+import math
+import re
+import sys
+import time
+import unicodedata
+
+import numpy as np
+import orjson
+from sqlalchemy.orm import Session
+
+from . import crud, distance
+
+# Near-duplicate detection, served at /addresses/duplicates and runnable as a batch job with
+# `python -m app.duplicates`. _address_uc only rejects exact (name, latitude, longitude) copies;
+# this finds addresses within radius_m of each other whose normalized names are at least
+# name_similarity alike, and groups them into clusters (connected components of matching pairs).
+#
+# Addresses are read once in latitude order. Latitude is cut into bands one radius high, so a
+# point can only match points of its own band and the band below; within a pair of bands,
+# longitude is cut into cells at least one radius wide at the pair's highest latitude. Candidate
+# pairs are equal-key joins between neighbouring cells, computed with sorted key arrays, and only
+# the pairs within the radius have their names compared. Memory holds the band being read, the
+# band below it and the clusters still open; a cluster is emitted once the scan has passed it.
+#
+# Keys also block on names, so a crowded cell does not compare every name with every other. With
+# name_similarity 1 the key holds the normalized name. Below 1 a row gets one key per character of
+# its name prefix (see _name_tokens), and two names can only be similar enough if their prefixes
+# share a character. The blocking never drops a matching pair.
+
+logger = logging.getLogger(__name__)
+
+_EARTH_RADIUS_M = distance.EARTH_RADIUS_KM * 1000
+_METERS_PER_DEGREE = _EARTH_RADIUS_M * math.pi / 180
+_NON_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_name(name: str) -> str:
+    """Casefold, strip accents and punctuation, and collapse whitespace: "Café  St.-Louis" -> "cafe st louis"."""
+    decomposed = unicodedata.normalize("NFKD", name or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(_NON_ALPHANUMERIC.sub(" ", stripped.casefold()).split())
+
+
+def names_similar(a: str, b: str, threshold: float) -> bool:
+    """Whether the normalized names have a difflib similarity ratio of at least ``threshold``."""
+    a, b = normalize_name(a), normalize_name(b)
+    if a == b:
+        return True
+    if threshold >= 1:
+        return False
+    # The ratio is 2 * matches / (len(a) + len(b)); cheap upper bounds first
+    if 2 * min(len(a), len(b)) < threshold * (len(a) + len(b)):
+        return False
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+
+# Characters ordered from rarest to most common in names; characters not listed (digits, accented
+# and non-Latin letters) count as rarer than all of them
+_CHARACTER_ORDER = {c: rank for rank, c in enumerate("zqxjkvbpygfwmucldrhsnioate ")}
+
+
+@functools.lru_cache(maxsize=65536)
+def _name_tokens(normalized: str, threshold: float) -> tuple:
+    """Blocking tokens of a normalized name: names with a similarity of at least ``threshold`` share one.
+
+    difflib's ratio is 2M / (len(a) + len(b)), and its M matching characters are at most the
+    characters the names have in common (counting repeats), so similar names share at least
+    t (len(a) + len(b)) / 2 of them. With the length bound of names_similar that is at least
+    r = t len(a) / (2 - t) for either name. Two multisets sharing r elements share one of their
+    first len - r + 1 elements in any fixed order (prefix filtering), so those are the tokens, rarest
+    characters first to keep the blocks small. Each character occurrence is a token: the k-th "e" is
+    ord("e") << 16 | k.
+    """
+    if threshold <= 0:
+        return (0,)
+    if threshold >= 1:
+        return (hash(normalized) & 0xFFFFFFFFFFFFFFFF,)
+    if not normalized:
+        return (0,)
+    seen = {}
+    occurrences = []
+    for c in normalized:
+        seen[c] = seen.get(c, 0) + 1
+        occurrences.append((_CHARACTER_ORDER.get(c, -1), c, -seen[c]))
+    shared = math.ceil(threshold * len(normalized) / (2 - threshold) - 1e-9)
+    prefix = sorted(occurrences)[:max(len(normalized) - shared + 1, 1)]
+    return tuple(ord(c) << 16 | -k for _, c, k in prefix)
+
+
+def _block_keys(cells, tokens):
+    # One key per (cell, token); unrelated pairs that collide only add candidates
+    return (cells.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ tokens
+
+
+def _join(query_keys, target_keys, max_pairs=1 << 22):
+    # (query position, target position) pairs with equal keys, in chunks of about max_pairs
+    order = np.argsort(target_keys, kind="stable")
+    sorted_keys = target_keys[order]
+    lo = np.searchsorted(sorted_keys, query_keys, "left")
+    counts = np.searchsorted(sorted_keys, query_keys, "right") - lo
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(query_keys):
+        stop = max(int(np.searchsorted(ends, ends[start] - counts[start] + max_pairs, "right")), start + 1)
+        chunk_counts = counts[start:stop]
+        queries = np.repeat(np.arange(start, stop), chunk_counts)
+        starts = np.repeat(lo[start:stop] - (np.cumsum(chunk_counts) - chunk_counts), chunk_counts)
+        yield queries, order[np.arange(int(chunk_counts.sum())) + starts]
+        start = stop
+
+
+def _unique(values):
+    # np.unique by sorting: its hash-based path is many times slower on large int64 arrays
+    values = np.sort(values)
+    return values[np.concatenate(([True], values[1:] != values[:-1]))] if len(values) else values
+
+
+_COUNT_BUCKETS = 32
+
+
+def _character_counts(normalized):
+    # (characters per name hashed into _COUNT_BUCKETS buckets, name lengths). Summed bucket minimums
+    # bound the characters two names have in common from above, like difflib's quick_ratio
+    lengths = np.fromiter(map(len, normalized), dtype=np.int64, count=len(normalized))
+    codes = np.frombuffer("".join(normalized).encode("utf-32-le"), dtype=np.uint32)
+    rows = np.repeat(np.arange(len(normalized)), lengths)
+    counts = np.bincount(rows * _COUNT_BUCKETS + codes % _COUNT_BUCKETS, minlength=len(normalized) * _COUNT_BUCKETS)
+    return counts.reshape(len(normalized), _COUNT_BUCKETS).astype(np.int32), lengths
+
+
+class DuplicateFinder:
+    """Streaming near-duplicate clustering over addresses fed in latitude order.
+
+    Call :meth:`add` with each batch of ``(id, name, latitude, longitude)`` rows and :meth:`finish`
+    at the end; both return the clusters completed so far, each a list of rows sorted by id.
+    """
+
+    def __init__(self, radius_m: float, name_similarity: float):
+        if radius_m < 1:
+            raise ValueError("radius_m must be at least 1")
+        self.radius_m = radius_m
+        self.name_similarity = name_similarity
+        self.scanned = 0
+        self.clusters = 0
+        self._band_height = radius_m / _METERS_PER_DEGREE
+        # Cell keys are band * _cells_per_band + cell, with bands offset to be non-negative
+        self._band_offset = math.ceil(90 / self._band_height) + 2
+        self._cells_per_band = int(360 / self._band_height) + 2
+        self._half_angle = math.sin(radius_m / _EARTH_RADIUS_M / 2)
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=object), np.empty(0), np.empty(0))
+        self._pending = empty  # rows of bands not read completely yet
+        self._below = empty  # rows of the last processed band
+        self._parent = {}
+        self._members = {}  # cluster root -> rows
+        self._last_band = {}  # cluster root -> highest band of its rows
+
+    def _bands(self, latitudes):
+        return np.floor(latitudes / self._band_height).astype(np.int64)
+
+    def _cell_counts(self, bands):
+        # Cells of the grid shared by band b and band b - 1: at least one radius wide at the highest
+        # latitude of the pair, since hav(d) >= cos(lat1) cos(lat2) hav(dlon) bounds dlon by
+        # 2 asin(sin(d / 2R) / cos(max latitude))
+        top = np.minimum(np.maximum(np.abs(bands - 1), np.abs(bands + 1)) * self._band_height, 90.0)
+        ratio = self._half_angle / np.maximum(np.cos(np.radians(top)), 1e-12)
+        width = np.degrees(2 * np.arcsin(np.minimum(ratio, 1.0))) * (1 + 1e-9)
+        return np.maximum(np.floor(360 / width), 1).astype(np.int64)
+
+    def _keys(self, bands, longitudes, offset=0):
+        counts = self._cell_counts(bands)
+        cells = np.minimum(np.floor((longitudes + 180) / 360 * counts).astype(np.int64), counts - 1)
+        return (bands + self._band_offset) * self._cells_per_band + (cells + offset) % counts
+
+    def _tokens(self, normalized):
+        # (token, row) for every blocking token of every row
+        tokens = [_name_tokens(name, self.name_similarity) for name in normalized]
+        rows = np.repeat(np.arange(len(tokens)), [len(row_tokens) for row_tokens in tokens])
+        return np.fromiter((token for row_tokens in tokens for token in row_tokens), dtype=np.uint64, count=len(rows)), rows
+
+    @staticmethod
+    def _crowded(own, above, neighbours, first_new):
+        # Whether each row may share a neighbourhood with another row. Most rows do not, and those
+        # skip name blocking. A row counts itself through its own cell, more than once in the one or
+        # two cells around a pole, which only makes it crowded when it need not be.
+        def count(keys, values):
+            return np.searchsorted(keys, values, "right") - np.searchsorted(keys, values, "left")
+        queries = np.sort(np.concatenate(neighbours))
+        hits = count(queries, own) + count(queries, above)
+        itself = sum(keys == own[first_new:] for keys in neighbours)
+        hits[first_new:] -= itself
+        targets = np.sort(np.concatenate((own, above)))
+        hits[first_new:] += sum(count(targets, keys) for keys in neighbours) - itself
+        return hits > 0
+
+    def _candidate_pairs(self, names, latitudes, longitudes, first_new):
+        # Unordered pairs (i < j) of rows within radius_m whose names may be similar enough, each
+        # with at least one row from first_new on
+        bands = self._bands(latitudes)
+        own = self._keys(bands, longitudes)
+        # A row's key in the grid of the band above, where it is the lower band
+        above = self._keys(bands + 1, longitudes)
+        neighbours = [self._keys(bands[first_new:], longitudes[first_new:], offset) for offset in (-1, 0, 1)]
+        rows = np.nonzero(self._crowded(own, above, neighbours, first_new))[0]
+        new = rows >= first_new
+        normalized = [normalize_name(name) for name in names[rows].tolist()]
+        tokens, owners = self._tokens(normalized)
+        # Positions in rows from here on
+        own, above = (_block_keys(keys[rows][owners], tokens) for keys in (own, above))
+        queries = np.nonzero(new[owners])[0]
+        pairs = [np.empty(0, dtype=np.int64)]
+        for keys in neighbours:
+            keys = _block_keys(keys[rows[owners[queries]] - first_new], tokens[queries])
+            for targets in (own, above):
+                # Rows sharing several tokens come up once per token, so chunks are deduplicated early
+                for matched_queries, matches in _join(keys, targets):
+                    i, j = owners[queries[matched_queries]], owners[matches]
+                    i, j = np.minimum(i, j)[i != j], np.maximum(i, j)[i != j]
+                    pairs.append(_unique(i * len(rows) + j))
+        pairs = _unique(np.concatenate(pairs))
+        i, j = pairs // max(len(rows), 1), pairs % max(len(rows), 1)
+        i, j = self._enough_in_common(normalized, i, j)
+        i, j = rows[i], rows[j]
+        near = distance.haversine_km(latitudes[i], longitudes[i], latitudes[j], longitudes[j]) * 1000 <= self.radius_m
+        return i[near], j[near]
+
+    def _enough_in_common(self, normalized, i, j, chunk_size=1 << 18):
+        # Drop the pairs whose names have too few characters in common to reach name_similarity
+        if not 0 < self.name_similarity < 1 or not len(i):
+            return i, j
+        counts, lengths = _character_counts(normalized)
+        keep = np.empty(len(i), dtype=bool)
+        for start in range(0, len(i), chunk_size):
+            a, b = i[start:start + chunk_size], j[start:start + chunk_size]
+            common = np.minimum(counts[a], counts[b]).sum(axis=1)
+            keep[start:start + chunk_size] = 2 * common >= self.name_similarity * (lengths[a] + lengths[b]) - 1e-9
+        return i[keep], j[keep]
+
+    def _find(self, row_id):
+        parent = self._parent
+        root = row_id
+        while parent[root] != root:
+            root = parent[root]
+        while parent[row_id] != root:
+            parent[row_id], row_id = root, parent[row_id]
+        return root
+
+    def _union(self, a, b, band):
+        for row in (a, b):
+            if row[0] not in self._parent:
+                self._parent[row[0]] = row[0]
+                self._members[row[0]] = [row]
+                self._last_band[row[0]] = band
+        root_a, root_b = self._find(a[0]), self._find(b[0])
+        if root_a == root_b:
+            self._last_band[root_a] = max(self._last_band[root_a], band)
+            return
+        if len(self._members[root_a]) < len(self._members[root_b]):
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._members[root_a].extend(self._members.pop(root_b))
+        self._last_band[root_a] = max(self._last_band[root_a], self._last_band.pop(root_b), band)
+
+    def _process(self, rows):
+        ids, names, latitudes, longitudes = (np.concatenate(columns) for columns in zip(self._below, rows))
+        first_new = len(self._below[0])
+        i, j = self._candidate_pairs(names, latitudes, longitudes, first_new)
+        bands = self._bands(latitudes)
+        parent = self._parent
+        row_ids = ids.tolist()
+        for a, b in zip(i.tolist(), j.tolist()):
+            # Pairs already joined through other matches need no comparison
+            if row_ids[a] in parent and row_ids[b] in parent and self._find(row_ids[a]) == self._find(row_ids[b]):
+                continue
+            if names_similar(names[a], names[b], self.name_similarity):
+                self._union((int(ids[a]), names[a], float(latitudes[a]), float(longitudes[a])),
+                            (int(ids[b]), names[b], float(latitudes[b]), float(longitudes[b])), int(bands[b]))
+        top = bands[-1]
+        self._below = tuple(column[bands == top] for column in (ids, names, latitudes, longitudes))
+        # Rows read later lie in bands above top, so they can only join clusters reaching top
+        return self._close(lambda last_band: last_band < top)
+
+    def _close(self, done):
+        finished = []
+        for root in [root for root, last_band in self._last_band.items() if done(last_band)]:
+            members = self._members.pop(root)
+            del self._last_band[root]
+            for row in members:
+                del self._parent[row[0]]
+            finished.append(sorted(members))
+        self.clusters += len(finished)
+        return sorted(finished)
+
+    def add(self, rows):
+        """Feed the next rows in latitude order; returns the clusters that can no longer grow."""
+        self.scanned += len(rows)
+        rows = [row for row in rows if row[2] is not None and row[3] is not None]
+        if not rows:
+            return []
+        ids, names, latitudes, longitudes = zip(*rows)
+        batch = (np.array(ids, dtype=np.int64), np.array(names, dtype=object),
+                 np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64))
+        self._pending = tuple(np.concatenate(columns) for columns in zip(self._pending, batch))
+        # Rows of the last band may continue in the next batch
+        bands = self._bands(self._pending[2])
+        complete = bands < bands[-1]
+        if not complete.any():
+            return []
+        ready = tuple(column[complete] for column in self._pending)
+        self._pending = tuple(column[~complete] for column in self._pending)
+        return self._process(ready)
+
+    def finish(self):
+        """Process the rows still pending and return every remaining cluster."""
+        finished = self._process(self._pending) if len(self._pending[0]) else []
+        return sorted(finished + self._close(lambda last_band: True))
+
+
+def _cluster_dict(rows):
+    return {"type": "cluster", "addresses": [
+        {"id": row[0], "name": row[1], "latitude": row[2], "longitude": row[3]} for row in rows]}
+
+
+def iter_duplicate_events(db: Session, radius_m: float, name_similarity: float, batch_size: int = 10000):
+    """Scan every address and yield progress, cluster and summary events as dicts.
+
+    A ``progress`` event follows each batch read, ``cluster`` events come as soon as a cluster is
+    complete, and a final ``done`` event carries the totals.
+    """
+    start = time.perf_counter()
+    total = crud.count_addresses(db)
+    finder = DuplicateFinder(radius_m, name_similarity)
+    logger.info("Looking for duplicates within %s m and name similarity %s among %s addresses", radius_m, name_similarity, total)
+    for rows in crud.iter_addresses_by_latitude(db, batch_size=batch_size):
+        for cluster in finder.add(rows):
+            yield _cluster_dict(cluster)
+        yield {"type": "progress", "scanned": finder.scanned, "total": total, "clusters": finder.clusters}
+    for cluster in finder.finish():
+        yield _cluster_dict(cluster)
+    seconds = time.perf_counter() - start
+    logger.info("Found %s duplicate clusters among %s addresses in %.1fs", finder.clusters, finder.scanned, seconds)
+    yield {"type": "done", "scanned": finder.scanned, "total": total, "clusters": finder.clusters,
+           "seconds": round(seconds, 3)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write near-duplicate address clusters as NDJSON, with progress on stderr.")
+    parser.add_argument("--radius-m", type=float, default=25)
+    parser.add_argument("--name-similarity", type=float, default=0.9)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    from .database import ReadSessionLocal
+    db = ReadSessionLocal()
+    try:
+        for event in iter_duplicate_events(db, args.radius_m, args.name_similarity, args.batch_size):
+            if event["type"] == "cluster":
+                sys.stdout.buffer.write(orjson.dumps(event["addresses"]) + b"\n")
+            else:
+                print(f"{event['scanned']}/{event['total']} addresses scanned, {event['clusters']} clusters", file=sys.stderr)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import math
+
+import numpy as np
+
+# Minimum length of one degree of latitude (at the equator) and of one degree
+# of longitude at the equator on the WGS-84 ellipsoid, in km. Using the minima
+# keeps the bounding boxes below a superset of the exact geodesic circle.
+KM_PER_DEGREE_LATITUDE = 110.574
+KM_PER_DEGREE_LONGITUDE = 111.319
+
+GEOHASH_PRECISION = 9
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode a coordinate as a base32 geohash of the given precision."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def bounding_box(latitude: float, longitude: float, distance_km: float):
+    """Return ``(min_lat, max_lat, lon_ranges)`` enclosing every point within ``distance_km``.
+
+    ``lon_ranges`` is a list of ``(min_lon, max_lon)`` tuples; it holds two
+    ranges when the box crosses the antimeridian.
+    """
+    lat_delta = distance_km / KM_PER_DEGREE_LATITUDE
+    min_lat = max(latitude - lat_delta, -90.0)
+    max_lat = min(latitude + lat_delta, 90.0)
+
+    max_abs_lat = max(abs(min_lat), abs(max_lat))
+    if max_abs_lat >= 90.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+    lon_delta = distance_km / (KM_PER_DEGREE_LONGITUDE * math.cos(math.radians(max_abs_lat)))
+    if lon_delta >= 180.0:
+        return min_lat, max_lat, [(-180.0, 180.0)]
+
+    min_lon = longitude - lon_delta
+    max_lon = longitude + lon_delta
+    if min_lon < -180.0:
+        return min_lat, max_lat, [(min_lon + 360.0, 180.0), (-180.0, max_lon)]
+    if max_lon > 180.0:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360.0)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+
+def longitude_ranges(west: float, east: float):
+    """Split the longitude span from ``west`` eastwards to ``east`` into ranges within [-180, 180].
+
+    The span crosses the antimeridian when ``west > east`` or when ``east`` is beyond 180, and is
+    then returned as two ranges.
+    """
+    if east < west:
+        east += 360.0
+    span = east - west
+    if span >= 360.0:
+        return [(-180.0, 180.0)]
+    west = (west + 180.0) % 360.0 - 180.0
+    east = west + span
+    if east > 180.0:
+        return [(west, 180.0), (-180.0, east - 360.0)]
+    return [(west, east)]
+
+
+def polygon_rings(coordinates):
+    """Convert GeoJSON polygon coordinates (rings of ``[lon, lat]`` positions) to ``(latitudes, longitudes)`` arrays.
+
+    Longitudes are unwrapped so that every edge takes the short way round: a ring crossing the
+    antimeridian gets longitudes beyond 180 (or below -180) instead of jumping across the map.
+    Holes are moved to the same 360 degree window as the outer ring.
+    """
+    rings = []
+    for ring in coordinates:
+        positions = np.asarray([position[:2] for position in ring], dtype=np.float64)
+        steps = (np.diff(positions[:, 0]) + 180.0) % 360.0 - 180.0
+        longitudes = positions[0, 0] + np.concatenate(([0.0], np.cumsum(steps)))
+        if rings:
+            outer_west = rings[0][1].min()
+            longitudes -= 360.0 * math.floor((longitudes[0] - outer_west) / 360.0)
+        rings.append((positions[:, 1], longitudes))
+    return rings
+
+
+def polygon_bounds(rings):
+    """Return ``(min_lat, max_lat, lon_ranges)`` enclosing the polygon, like :func:`bounding_box`."""
+    latitudes, longitudes = rings[0]
+    return float(latitudes.min()), float(latitudes.max()), longitude_ranges(float(longitudes.min()), float(longitudes.max()))
+
+
+def points_in_polygon(latitudes, longitudes, rings, block_elements: int = 1 << 20) -> np.ndarray:
+    """Boolean mask of the points inside the polygon (even-odd rule, so holes are excluded).
+
+    Vectorized over points and edges at once, in blocks of points holding about
+    ``block_elements`` point-edge pairs. Edges are planar in longitude and latitude, as GeoJSON
+    specifies.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    starts, ends = [], []
+    for ring_latitudes, ring_longitudes in rings:
+        vertices = np.column_stack((ring_longitudes, ring_latitudes))
+        starts.append(vertices)
+        ends.append(np.roll(vertices, -1, axis=0))
+    starts, ends = np.concatenate(starts), np.concatenate(ends)
+    # Horizontal edges are never crossed by the horizontal ray
+    keep = starts[:, 1] != ends[:, 1]
+    x1, y1 = starts[keep, 0], starts[keep, 1]
+    x2, y2 = ends[keep, 0], ends[keep, 1]
+    slopes = (x2 - x1) / (y2 - y1)
+
+    # An unwrapped polygon reaching past the antimeridian also holds the points shifted by 360 degrees
+    west, east = min(ring[1].min() for ring in rings), max(ring[1].max() for ring in rings)
+    shifts = [0.0] + ([360.0] if east > 180.0 else []) + ([-360.0] if west < -180.0 else [])
+
+    inside = np.zeros(len(latitudes), dtype=bool)
+    block = max(1, block_elements // max(len(slopes), 1))
+    for start in range(0, len(latitudes), block):
+        py = latitudes[start:start + block, None]
+        spans = (y1 > py) != (y2 > py)
+        crossing_x = x1 + (py - y1) * slopes
+        for shift in shifts:
+            px = longitudes[start:start + block, None] + shift
+            inside[start:start + block] |= np.count_nonzero(spans & (px < crossing_x), axis=1) % 2 == 1
+    return inside
@@ -1,5 +1,11 @@
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
+import random
+
+from . import config
 
 LOGGING_CONFIG = {
     'version': 1,
@@ -19,19 +25,118 @@ LOGGING_CONFIG = {
         'file': {
             'level': 'DEBUG',
             'formatter': 'standard',
-            'class': 'logging.FileHandler',
-            'filename': 'address-book-app.log',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': config.LOG_FILE,
+            'maxBytes': config.LOG_MAX_BYTES,
+            'backupCount': config.LOG_BACKUP_COUNT,
             'mode': 'a',
         },
     },
     'loggers': {
         '': {  # root logger
             'handlers': ['default', 'file'],
-            'level': 'DEBUG',
+            'level': config.LOG_LEVEL,
             'propagate': True
         },
     }
 }
 
+
+def parse_sampling(spec: str):
+    """Parse ``"logger.name=rate,..."`` into a dict of per-logger DEBUG sampling rates."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the DEBUG records of the configured loggers (and their children).
+
+    Records at INFO and above always pass.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    # The queue never leaves the process, so the record is passed as-is and message
+    # formatting happens on the listener thread instead of the request thread
+    def prepare(self, record):
+        return record
+
+
+_listener = None
+
+
+def _logging_config():
+    # RotatingFileHandler rotates by renaming the file, which the other workers keep writing to, so
+    # with several workers the file handler only reopens the file once it is moved and rotation is
+    # left to an external tool such as logrotate
+    if config.WORKERS <= 1:
+        return LOGGING_CONFIG
+    file_handler = {key: value for key, value in LOGGING_CONFIG['handlers']['file'].items()
+                    if key not in ('maxBytes', 'backupCount')}
+    file_handler['class'] = 'logging.handlers.WatchedFileHandler'
+    return {**LOGGING_CONFIG, 'handlers': {**LOGGING_CONFIG['handlers'], 'file': file_handler}}
+
+
 def setup_logging():
-    logging.config.dictConfig(LOGGING_CONFIG)
+    """Configure the handlers from LOGGING_CONFIG and move them behind a queue.
+
+    The log file is rotated by size in a single worker; with several (WEB_CONCURRENCY above 1) it
+    is reopened when an external tool has moved it.
+
+    Request threads only enqueue records; a QueueListener thread formats them and
+    does the console and file I/O.
+    """
+    global _listener
+    stop_logging()
+    logging.config.dictConfig(_logging_config())
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _InProcessQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sampling(config.LOG_SAMPLING)))
+    root.addHandler(queue_handler)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
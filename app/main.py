@@ -1,17 +1,30 @@
-from fastapi import FastAPI
-from .routers import address
-from .logging_config import setup_logging
-import logging
-
-# logger
-setup_logging()
-logger = logging.getLogger(__name__)
-
-try:
-    app = FastAPI()
-    app.include_router(address.router)
-    logger.info("App has started")
-
-except Exception as e:
-    logger.error("Error encountered: %s", str(e))
-
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from .routers import address, address_async, debug
+from .routers import metrics as metrics_router
+from . import config, metrics, profiling, startup
+import logging
+
+# Importing this module only builds the app; logging, engines, the schema check and the
+# spatial index are set up by the lifespan, once per worker (see app/startup.py)
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.startup()
+    yield
+    await startup.shutdown()
+
+try:
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(address_async.with_async_routes(address.router) if config.ASYNC_DB_ENABLED else address.router)
+    app.include_router(debug.router)
+    if config.PROFILING_ENABLED:
+        app.add_middleware(profiling.ProfilingMiddleware)
+    if config.METRICS_ENABLED:
+        app.add_middleware(metrics.MetricsMiddleware)
+        app.include_router(metrics_router.router)
+
+except Exception as e:
+    logger.error("Error encountered: %s", str(e))
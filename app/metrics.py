@@ -0,0 +1,237 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from sqlalchemy import event
+
+# Prometheus metrics kept in process and rendered in the text exposition format at /metrics.
+# Recording a request is a few dict lookups and additions under one lock, cheap enough to leave
+# on in production (see benchmarks/bench_metrics.py).
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}" for labels, value in items)
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}" for labels, value in items)
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; ``observe`` only bumps the one bucket the value falls in."""
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, labels=()):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def sum(self, labels=()):
+        entry = self._values.get(labels)
+        return entry[1] if entry else 0.0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, (list(counts), total, count)) for labels, (counts, total, count) in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = (("le", _format_number(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+http_requests_total = Counter(
+    "http_requests_total", "HTTP requests by route template, method and status code.",
+    ("method", "route", "status"))
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency in seconds, including streamed bodies.",
+    ("method", "route"))
+http_request_db_statements = Histogram(
+    "http_request_db_statements", "SQL statements executed per HTTP request.",
+    ("method", "route"), buckets=STATEMENT_COUNT_BUCKETS)
+http_request_db_duration_seconds = Histogram(
+    "http_request_db_duration_seconds", "Time spent executing SQL per HTTP request, in seconds.",
+    ("method", "route"))
+db_statements_total = Counter(
+    "db_statements_total", "SQL statements executed, by engine.", ("engine",))
+db_statement_duration_seconds = Histogram(
+    "db_statement_duration_seconds", "SQL statement execution time in seconds, by engine.", ("engine",))
+db_write_batch_size = Histogram(
+    "db_write_batch_size", "Writes applied per transaction by the write coalescer.", buckets=BATCH_SIZE_BUCKETS)
+
+startup_duration_seconds = Gauge(
+    "startup_duration_seconds", "Time spent in each phase of this process's startup, in seconds.", ("phase",))
+
+REGISTRY = (http_requests_total, http_request_duration_seconds, http_request_db_statements,
+            http_request_db_duration_seconds, db_statements_total, db_statement_duration_seconds,
+            db_write_batch_size, startup_duration_seconds)
+
+# [statement count, seconds] for the request being served. Sync routes run in the threadpool with
+# a copy of the context, which still points at the same list, so their statements are counted too.
+_request_db_usage = contextvars.ContextVar("request_db_usage", default=None)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _record_statement(labels, elapsed):
+    db_statements_total.inc(labels)
+    db_statement_duration_seconds.observe(elapsed, labels)
+    usage = _request_db_usage.get()
+    if usage is not None:
+        usage[0] += 1
+        usage[1] += elapsed
+
+
+def instrument_engine(engine, name: str):
+    """Count and time every statement executed on ``engine`` (a sync Engine).
+
+    Uses the dialect-level ``do_execute*`` events, which run the statement themselves. Listening
+    to the Connection-level ``before/after_cursor_execute`` events instead would make every
+    connection dispatch its begin/commit/rollback events too, several times the cost of the
+    timing itself.
+    """
+    labels = (name,)
+
+    def timed(execute):
+        def listener(cursor, statement, parameters, context):
+            start = time.perf_counter()
+            try:
+                execute(cursor, statement, parameters)
+            finally:
+                _record_statement(labels, time.perf_counter() - start)
+            return True
+        return listener
+
+    event.listen(engine, "do_execute", timed(lambda cursor, statement, parameters: cursor.execute(statement, parameters)))
+    event.listen(engine, "do_executemany", timed(lambda cursor, statement, parameters: cursor.executemany(statement, parameters)))
+
+    @event.listens_for(engine, "do_execute_no_params")
+    def execute_no_params(cursor, statement, context):
+        start = time.perf_counter()
+        try:
+            cursor.execute(statement)
+        finally:
+            _record_statement(labels, time.perf_counter() - start)
+        return True
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request counts, status codes, latency and SQL usage.
+
+    Routes are labelled by their path template (``/addresses/{address_id}``), so label
+    cardinality stays bounded; requests that match no route share the ``<unmatched>`` label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        usage = [0, 0.0]
+        token = _request_db_usage.set(usage)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db_usage.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "<unmatched>"))
+            http_requests_total.inc(labels + (str(status[0]),))
+            http_request_duration_seconds.observe(elapsed, labels)
+            http_request_db_statements.observe(usage[0], labels)
+            http_request_db_duration_seconds.observe(usage[1], labels)
@@ -1,10 +1,98 @@
-from sqlalchemy import Column, Integer, String, Float, UniqueConstraint
-from .database import Base
-
-class Address(Base):
-    __tablename__ = 'addresses'
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    latitude = Column(Float)
-    longitude = Column(Float)
-    __table_args__ = (UniqueConstraint('name', 'latitude', 'longitude', name='_address_uc'),)
+from sqlalchemy import DDL, Column, Integer, String, Float, UniqueConstraint, Index, event
+from .database import Base
+
+class Address(Base):
+    __tablename__ = 'addresses'
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True)
+    latitude = Column(Float)
+    longitude = Column(Float)
+    geohash = Column(String, index=True)
+    # Incremented on every update; used for ETags
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # Position of the row's last insert or update in the change feed; set by ADDRESS_CHANGES_DDL triggers
+    change_seq = Column(Integer, nullable=False, server_default='0')
+    __table_args__ = (
+        UniqueConstraint('name', 'latitude', 'longitude', name='_address_uc'),
+        Index('ix_addresses_latitude_longitude', 'latitude', 'longitude'),
+        Index('ix_addresses_change_seq', 'change_seq'),
+    )
+
+
+# FTS5 index over Address.name for /addresses/search, kept in sync by triggers. It is an
+# external-content table, so only the index is stored, not a second copy of the names.
+# Migration 9f4b2a6c8d31 creates the same objects on existing databases.
+ADDRESS_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS addresses_fts USING fts5("
+    "name, content='addresses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS addresses_fts_ai AFTER INSERT ON addresses BEGIN "
+    "INSERT INTO addresses_fts(rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER IF NOT EXISTS addresses_fts_ad AFTER DELETE ON addresses BEGIN "
+    "INSERT INTO addresses_fts(addresses_fts, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER IF NOT EXISTS addresses_fts_au AFTER UPDATE OF name ON addresses BEGIN "
+    "INSERT INTO addresses_fts(addresses_fts, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO addresses_fts(rowid, name) VALUES (new.id, new.name); END",
+)
+
+for statement in ADDRESS_SEARCH_DDL:
+    event.listen(Address.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Address.__table__, "before_drop", DDL("DROP TABLE IF EXISTS addresses_fts").execute_if(dialect="sqlite"))
+
+
+class AddressCluster(Base):
+    # Address count and coordinate sums per map tile and zoom level (see app/clusters.py)
+    __tablename__ = 'address_clusters'
+
+    zoom = Column(Integer, primary_key=True)
+    x = Column(Integer, primary_key=True)
+    y = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False)
+    latitude_sum = Column(Float, nullable=False)
+    longitude_sum = Column(Float, nullable=False)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+class AddressChangeSequence(Base):
+    # Single row holding the last change sequence number handed out (see ADDRESS_CHANGES_DDL)
+    __tablename__ = 'address_change_sequence'
+
+    id = Column(Integer, primary_key=True)
+    last_seq = Column(Integer, nullable=False)
+
+
+class AddressTombstone(Base):
+    # Deleted address ids with the sequence number of their deletion, for /addresses/changes
+    __tablename__ = 'address_tombstones'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    change_seq = Column(Integer, nullable=False, index=True)
+
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+# Change feed triggers: every insert, update of name or coordinates, and delete of an address takes
+# the next number of address_change_sequence, stored in addresses.change_seq or, for deletes, in a
+# tombstone. Being triggers, they cover every write path, bulk and batch writes included. Ids can be
+# reused after a delete, so an insert removes the id's tombstone. Migration e8b4d2f6a1c7 creates the
+# same objects on existing databases.
+_NEXT_CHANGE_SEQ = "UPDATE address_change_sequence SET last_seq = last_seq + 1 WHERE id = 1; "
+_LAST_CHANGE_SEQ = "(SELECT last_seq FROM address_change_sequence WHERE id = 1)"
+ADDRESS_CHANGES_DDL = (
+    "CREATE TRIGGER IF NOT EXISTS addresses_changes_ai AFTER INSERT ON addresses BEGIN "
+    + _NEXT_CHANGE_SEQ +
+    f"UPDATE addresses SET change_seq = {_LAST_CHANGE_SEQ} WHERE id = new.id; "
+    "DELETE FROM address_tombstones WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS addresses_changes_au AFTER UPDATE OF name, latitude, longitude ON addresses BEGIN "
+    + _NEXT_CHANGE_SEQ +
+    f"UPDATE addresses SET change_seq = {_LAST_CHANGE_SEQ} WHERE id = new.id; END",
+    "CREATE TRIGGER IF NOT EXISTS addresses_changes_ad AFTER DELETE ON addresses BEGIN "
+    + _NEXT_CHANGE_SEQ +
+    f"INSERT OR REPLACE INTO address_tombstones (id, change_seq) VALUES (old.id, {_LAST_CHANGE_SEQ}); END",
+)
+
+event.listen(AddressChangeSequence.__table__, "after_create",
+             DDL("INSERT INTO address_change_sequence (id, last_seq) VALUES (1, 0)"))
+# The triggers reference all three tables, so they are created once the whole schema exists
+for statement in ADDRESS_CHANGES_DDL:
+    event.listen(Base.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
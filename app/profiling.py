@@ -0,0 +1,237 @@
+import collections
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event
+
+from . import config
+
+# Opt-in query profiling for staging (ADDRESS_BOOK_PROFILING). Statements slower than
+# ADDRESS_BOOK_SLOW_QUERY_MS are logged with their EXPLAIN QUERY PLAN, and requests that run more
+# statements or fetch more rows than the query budget are flagged. Both are kept in bounded
+# buffers served at /debug/profiling.
+#
+# SQLite does most of the work of a scan while rows are fetched, not in cursor.execute(), so the
+# sync engines connect through ProfilingConnection, whose cursors time their fetches and count
+# rows. A statement is judged when SQLAlchemy closes its cursor.
+
+logger = logging.getLogger(__name__)
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_MAX_STATEMENT_LENGTH = 2000
+_TOP_STATEMENTS = 5
+
+_lock = threading.Lock()
+_slow_queries = collections.deque(maxlen=config.PROFILING_MAX_ENTRIES)
+_budget_violations = collections.deque(maxlen=config.PROFILING_MAX_ENTRIES)
+
+
+class _RequestProfile:
+    __slots__ = ("scope", "statements", "rows", "sql_seconds", "statement_counts")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.statements = 0
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.statement_counts = collections.Counter()
+
+    @property
+    def route(self):
+        route = self.scope.get("route")
+        return getattr(route, "path", self.scope.get("path"))
+
+
+_request_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+class _StatementProfile:
+    __slots__ = ("statement", "parameters", "seconds", "rows", "request")
+
+    def __init__(self, statement, parameters, seconds, request):
+        self.statement = statement
+        self.parameters = parameters
+        self.seconds = seconds
+        self.rows = 0
+        self.request = request
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """sqlite3 cursor that times its fetches and counts the rows they return."""
+
+    _profile = None
+
+    def _fetched(self, start, rows):
+        profile = self._profile
+        if profile is None:
+            return
+        profile.seconds += time.perf_counter() - start
+        profile.rows += rows
+        if profile.request is not None:
+            profile.request.rows += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def close(self):
+        profile, self._profile = self._profile, None
+        if profile is not None:
+            _finish_statement(profile, self.connection)
+        super().close()
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """sqlite3 connection factory handing out :class:`ProfilingCursor` cursors."""
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+
+def explain_query_plan(connection, statement, parameters=()):
+    """Return the EXPLAIN QUERY PLAN of ``statement`` as indented lines, or None if it cannot be explained."""
+    if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    # A plain cursor, so explaining is not itself profiled
+    cursor = sqlite3.Cursor(connection)
+    try:
+        rows = cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+    except sqlite3.Error as e:
+        logger.debug("Could not explain statement: %s", str(e))
+        return None
+    finally:
+        cursor.close()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def _finish_statement(profile, connection):
+    if profile.seconds * 1000 < config.SLOW_QUERY_MS:
+        return
+    parameters = profile.parameters
+    if isinstance(parameters, list):  # executemany: explain with the first parameter set
+        parameters = parameters[0] if parameters else ()
+    plan = explain_query_plan(connection, profile.statement, parameters) if connection is not None else None
+    entry = {
+        "timestamp": time.time(),
+        "route": profile.request.route if profile.request is not None else None,
+        "statement": profile.statement[:_MAX_STATEMENT_LENGTH],
+        "parameters": repr(parameters)[:200],
+        "duration_ms": round(profile.seconds * 1000, 3),
+        "rows": profile.rows,
+        "plan": plan,
+        "full_scan": any(line.lstrip().startswith("SCAN") for line in plan or ()),
+    }
+    with _lock:
+        _slow_queries.append(entry)
+    logger.warning("Slow query (%.1f ms, %d rows) on %s: %s%s", entry["duration_ms"], entry["rows"],
+                   entry["route"], entry["statement"], "".join("\n" + line for line in plan or ()))
+
+
+def instrument_engine(engine):
+    """Time the statements of ``engine`` (a sync Engine) and attribute them to the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiling_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["profiling_start_times"].pop()
+        request = _request_profile.get()
+        if request is not None:
+            request.statements += 1
+            request.sql_seconds += elapsed
+            request.statement_counts[statement] += 1
+        profile = _StatementProfile(statement, parameters, elapsed, request)
+        if isinstance(cursor, ProfilingCursor):
+            # Batched executemany runs several statements on one cursor; judge the previous one first
+            if cursor._profile is not None:
+                _finish_statement(cursor._profile, cursor.connection)
+            cursor._profile = profile
+        else:
+            # Without the connection factory fetches are not visible; judge the execute time alone
+            _finish_statement(profile, None)
+
+
+def _check_budget(request, method, elapsed):
+    over_statements = 0 < config.QUERY_BUDGET_STATEMENTS < request.statements
+    over_rows = 0 < config.QUERY_BUDGET_ROWS < request.rows
+    if not (over_statements or over_rows):
+        return
+    entry = {
+        "timestamp": time.time(),
+        "method": method,
+        "route": request.route,
+        "path": request.scope.get("path"),
+        "statements": request.statements,
+        "rows": request.rows,
+        "sql_ms": round(request.sql_seconds * 1000, 3),
+        "duration_ms": round(elapsed * 1000, 3),
+        "top_statements": [{"statement": statement[:_MAX_STATEMENT_LENGTH], "count": count}
+                           for statement, count in request.statement_counts.most_common(_TOP_STATEMENTS)],
+    }
+    with _lock:
+        _budget_violations.append(entry)
+    logger.warning("Query budget exceeded by %s %s: %d statements, %d rows fetched",
+                   method, entry["path"], request.statements, request.rows)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware collecting the statements and fetched rows of each request and checking the query budget."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = _RequestProfile(scope)
+        token = _request_profile.set(request)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_profile.reset(token)
+            _check_budget(request, scope["method"], time.perf_counter() - start)
+
+
+def snapshot():
+    with _lock:
+        slow_queries = list(_slow_queries)
+        budget_violations = list(_budget_violations)
+    return {
+        "enabled": config.PROFILING_ENABLED,
+        "slow_query_ms": config.SLOW_QUERY_MS,
+        "query_budget": {"statements": config.QUERY_BUDGET_STATEMENTS, "rows": config.QUERY_BUDGET_ROWS},
+        "slow_queries": slow_queries,
+        "budget_violations": budget_violations,
+    }
+
+
+def clear():
+    with _lock:
+        _slow_queries.clear()
+        _budget_violations.clear()
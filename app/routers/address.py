@@ -1,151 +1,615 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
-import logging
-from typing import List, Dict, Any
-from urllib.parse import urlencode, urlparse, urlunparse, parse_qsl
-from .. import crud, models, schemas
-from ..database import SessionLocal, engine
-
-models.Base.metadata.create_all(bind=engine)  # Create the tables
-
-logger = logging.getLogger(__name__)
-
-router = APIRouter(
-    prefix="/addresses",
-    tags=["addresses"],
-    responses={404: {"description": "Not found"}},
-)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-@router.post(
-    "/",
-    response_model=schemas.Address,
-    summary="Create a new address",
-    description="Create a new address with the given details. The address must be unique."
-)
-def create_address(address: schemas.AddressCreate, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Creating address with data: {address}")
-        db_address = crud.create_address(db=db, address=address)
-        return schemas.Address.model_validate(db_address)
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error creating address: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.get(
-    "/{address_id}",
-    response_model=schemas.Address,
-    summary="Get an address by ID",
-    description="Retrieve the details of an address by its ID."
-)
-def read_address(address_id: int, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Fetching address with ID: {address_id}")
-        db_address = crud.get_address(db, address_id=address_id)
-        if db_address is None:
-            logger.warning(f"Address with ID {address_id} not found")
-            raise HTTPException(status_code=404, detail="Address not found")
-        return schemas.Address.model_validate(db_address)
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error reading address: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.delete(
-    "/{address_id}",
-    response_model=schemas.Address,
-    summary="Delete an address by ID",
-    description="Delete an address by its ID. Returns the deleted address details."
-)
-def delete_address(address_id: int, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Deleting address with ID: {address_id}")
-        db_address = crud.delete_address(db, address_id=address_id)
-        if db_address is None:
-            logger.warning(f"Address with ID {address_id} not found for deletion")
-            raise HTTPException(status_code=404, detail="Address not found")
-        return schemas.Address.model_validate(db_address)
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error deleting address: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.put(
-    "/{address_id}",
-    response_model=schemas.Address,
-    summary="Update an address by ID",
-    description="Update an address by its ID. The address must be unique."
-)
-def update_address(address_id: int, address: schemas.AddressCreate, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Updating address with ID: {address_id}")
-        db_address = crud.update_address(db, address_id=address_id, address=address)
-        if db_address is None:
-            logger.warning(f"Address with ID {address_id} not found for update")
-            raise HTTPException(status_code=404, detail="Address not found")
-        return schemas.Address.model_validate(db_address)
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error updating address: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.get(
-    "/",
-    response_model=Dict[str, Any],
-    summary="Get a list of addresses with pagination",
-    description="Retrieve a paginated list of addresses. You can specify the page number and page size."
-)
-def read_addresses(request: Request, page: int = 1, page_size: int = 10, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Fetching addresses for page {page} with page size {page_size}")
-        addresses = crud.get_addresses(db, page=page, page_size=page_size)
-        total_addresses = db.query(models.Address).count()
-        current_page = page
-
-        parsed_url = urlparse(str(request.url))  # Ensure URL is a string
-        query_params = dict(parse_qsl(parsed_url.query))
-        
-        previous_page = None if page <= 1 else urlunparse(parsed_url._replace(query=urlencode({**query_params, "page": page - 1})))
-        next_page = None if (page * page_size) >= total_addresses else urlunparse(parsed_url._replace(query=urlencode({**query_params, "page": page + 1})))
-
-        response = {
-            "current_page": current_page,
-            "previous_page": previous_page,
-            "next_page": next_page,
-            "addresses": [schemas.Address.model_validate(address) for address in addresses]
-        }
-        logger.info(f"Returning {len(addresses)} addresses on page {page}")
-        return response
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error reading addresses: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
-
-@router.get(
-    "/within_distance/",
-    response_model=List[schemas.Address],
-    summary="Get addresses within a certain distance",
-    description="Retrieve a list of addresses within a specified distance from a given coordinate."
-)
-def read_addresses_within_distance(latitude: float, longitude: float, distance_km: float, db: Session = Depends(get_db)):
-    try:
-        logger.info(f"Fetching addresses within {distance_km} km of ({latitude}, {longitude})")
-        addresses = crud.get_addresses_within_distance(db, latitude, longitude, distance_km)
-        return [schemas.Address.model_validate(address) for address in addresses]
-    except HTTPException as http_exc:
-        raise http_exc
-    except Exception as e:
-        logger.error(f"Error reading addresses within distance: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import base64
+import orjson
+import csv
+import io
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Literal, Optional
+from urllib.parse import urlencode, urlparse, urlunparse, parse_qsl
+from .. import bulk_import, clusters, config, crud, duplicates, geo, schemas, write_coalescer
+from ..database import ReadSessionLocal, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/addresses",
+    tags=["addresses"],
+    responses={404: {"description": "Not found"}},
+)
+
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db():
+    # Read-only connection pool for GET routes
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def _encode_cursor(address_id: int) -> str:
+    payload = json.dumps({"id": address_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return int(json.loads(payload)["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded with orjson.
+
+    Read routes build their content once from plain column rows and return it in this response,
+    so FastAPI skips validating and serializing it again against the response_model (which is
+    still used for the OpenAPI schema).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+def _address_dicts(rows) -> List[Dict[str, Any]]:
+    return [{"id": address_id, "name": name, "latitude": latitude, "longitude": longitude}
+            for address_id, name, latitude, longitude in rows]
+
+def _page_url(request: Request, **params) -> str:
+    # The request URL with the given query parameters replaced
+    parsed_url = urlparse(str(request.url))
+    return urlunparse(parsed_url._replace(query=urlencode({**dict(parse_qsl(parsed_url.query)), **params})))
+
+def _keyset_page(request: Request, rows, limit: int) -> Dict[str, Any]:
+    # rows were fetched with limit + 1, the extra row telling whether a next page exists
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = _encode_cursor(rows[-1].id) if has_next else None
+    return {
+        "next_cursor": next_cursor,
+        "next": None if next_cursor is None else _page_url(request, after=next_cursor, limit=limit),
+        "addresses": _address_dicts(rows)
+    }
+
+def _numbered_page(request: Request, rows, page: int, page_size: int) -> Dict[str, Any]:
+    # rows were fetched with lookahead, one past the page
+    return {
+        "current_page": page,
+        "previous_page": None if page <= 1 else _page_url(request, page=page - 1),
+        "next_page": _page_url(request, page=page + 1) if len(rows) > page_size else None,
+        "addresses": _address_dicts(rows[:page_size])
+    }
+
+def _nearest_dicts(nearest) -> List[Dict[str, Any]]:
+    return [{"id": address_id, "name": name, "latitude": latitude, "longitude": longitude, "distance_km": distance_km}
+            for (address_id, name, latitude, longitude), distance_km in nearest]
+
+@contextmanager
+def _server_errors(action: str):
+    # Route handlers run in this: HTTPExceptions pass through, anything else is logged and answered with 500
+    try:
+        yield
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error %s: %s", action, e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def _address_response(request: Request, payload: Dict[str, Any], etag: str) -> Response:
+    headers = {"ETag": etag}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(payload, headers=headers)
+
+@router.post(
+    "/",
+    response_model=schemas.Address,
+    summary="Create a new address",
+    description="Create a new address with the given details. The address must be unique."
+)
+def create_address(address: schemas.AddressCreate, db: Session = Depends(get_db)):
+    with _server_errors("creating address"):
+        logger.info("Creating address with data: %s", address)
+        if config.WRITE_COALESCING:
+            db_address = write_coalescer.coalescer.write("create", address)
+        else:
+            db_address = crud.create_address(db=db, address=address)
+        return schemas.Address.model_validate(db_address)
+
+@router.put(
+    "/",
+    response_model=schemas.Address,
+    summary="Create an address unless it exists",
+    description="Idempotent create: inserts the address and returns 201, or returns the existing address with "
+                "the same name and coordinates and 200. Retrying the request never creates a duplicate or fails.",
+    responses={201: {"model": schemas.Address, "description": "Address created"}}
+)
+def upsert_address(address: schemas.AddressCreate, response: Response, db: Session = Depends(get_db)):
+    try:
+        logger.info("Upserting address with data: %s", address)
+        if config.WRITE_COALESCING:
+            db_address, created = write_coalescer.coalescer.write("upsert", address)
+        else:
+            db_address, created = crud.upsert_address(db, address=address)
+        if created:
+            response.status_code = 201
+        return schemas.Address.model_validate(db_address)
+    except Exception as e:
+        logger.error("Error upserting address: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post(
+    "/bulk",
+    response_model=schemas.BulkImportResult,
+    summary="Bulk import addresses",
+    description="Stream NDJSON (one address object per line) or CSV (with a name,latitude,longitude header) "
+                "in the request body. Rows are validated and inserted in chunks, one transaction per chunk. "
+                "Rows that duplicate an existing address are skipped and reported as conflicts."
+)
+async def bulk_create_addresses(
+    request: Request,
+    format: Optional[Literal["ndjson", "csv"]] = None,
+    chunk_size: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    with _server_errors("bulk importing addresses"):
+        if format is None:
+            format = "csv" if request.headers.get("content-type", "").startswith("text/csv") else "ndjson"
+        logger.info("Bulk importing addresses from %s in chunks of %s", format, chunk_size)
+        return await bulk_import.import_addresses(db, request.stream(), format, chunk_size)
+
+def _batch_result(items: List[schemas.BatchItemResult]) -> schemas.BatchResult:
+    statuses = [item.status for item in items]
+    return schemas.BatchResult(ok=statuses.count("ok"), not_found=statuses.count("not_found"),
+                               conflicts=statuses.count("conflict"), items=items)
+
+@router.post(
+    "/batch/get",
+    response_model=schemas.BatchResult,
+    summary="Get many addresses by ID",
+    description="Retrieve the addresses with the given IDs. Each ID gets an item with status ok or not_found, in request order."
+)
+def read_addresses_batch(batch: schemas.BatchIds, db: Session = Depends(get_read_db)):
+    with _server_errors("reading addresses in batch"):
+        logger.info("Fetching %s addresses by ID", len(batch.ids))
+        return _batch_result(crud.get_addresses_batch(db, batch.ids))
+
+@router.patch(
+    "/batch",
+    response_model=schemas.BatchResult,
+    summary="Update many addresses",
+    description="Apply partial updates to the addresses with the given IDs in one transaction. Omitted fields keep their value. "
+                "Each item reports ok, not_found, or conflict when the new name and coordinates are already taken."
+)
+def update_addresses_batch(batch: schemas.AddressBatchPatch, db: Session = Depends(get_db)):
+    with _server_errors("updating addresses in batch"):
+        logger.info("Updating %s addresses in batch", len(batch.items))
+        return _batch_result(crud.update_addresses_batch(db, batch.items))
+
+@router.post(
+    "/batch/delete",
+    response_model=schemas.BatchResult,
+    summary="Delete many addresses by ID",
+    description="Delete the addresses with the given IDs in one transaction. Each item carries the deleted address or not_found."
+)
+def delete_addresses_batch(batch: schemas.BatchIds, db: Session = Depends(get_db)):
+    with _server_errors("deleting addresses in batch"):
+        logger.info("Deleting %s addresses in batch", len(batch.ids))
+        return _batch_result(crud.delete_addresses_batch(db, batch.ids))
+
+def _export_ndjson(batches):
+    for rows in batches:
+        yield b"".join(orjson.dumps(address) + b"\n" for address in _address_dicts(rows))
+
+def _export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(("id", "name", "latitude", "longitude"))
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@router.get(
+    "/export",
+    summary="Export all addresses",
+    description="Stream every address as NDJSON (default) or CSV, in id order. Memory use does not depend on the table size.",
+    response_class=StreamingResponse,
+)
+def export_addresses(format: Literal["ndjson", "csv"] = "ndjson", batch_size: int = Query(1000, ge=1, le=50000), db: Session = Depends(get_read_db)):
+    try:
+        logger.info("Exporting addresses as %s", format)
+        batches = crud.iter_address_rows(db, batch_size=batch_size)
+        if format == "csv":
+            return StreamingResponse(_export_csv(batches), media_type="text/csv",
+                                     headers={"Content-Disposition": 'attachment; filename="addresses.csv"'})
+        return StreamingResponse(_export_ndjson(batches), media_type="application/x-ndjson")
+    except Exception as e:
+        logger.error("Error exporting addresses: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def _ndjson_events(events):
+    for event in events:
+        yield orjson.dumps(event) + b"\n"
+
+@router.get(
+    "/duplicates",
+    summary="Find near-duplicate addresses",
+    description="Scan every address for ones within radius_m meters of each other whose names, casefolded and "
+                "stripped of accents and punctuation, have a similarity ratio of at least name_similarity "
+                "(1 requires equal normalized names). Streams NDJSON events: a progress event after each batch "
+                "read, a cluster event with the addresses of each group of near-duplicates as soon as it is "
+                "complete, and a final done event with the totals.",
+    response_class=StreamingResponse,
+)
+def read_duplicate_addresses(
+    radius_m: float = Query(25, ge=1),
+    name_similarity: float = Query(0.9, ge=0, le=1),
+    batch_size: int = Query(10000, ge=1, le=50000),
+    db: Session = Depends(get_read_db),
+):
+    if radius_m > config.DUPLICATES_MAX_RADIUS_M:
+        raise HTTPException(status_code=400, detail=f"radius_m must not be greater than {config.DUPLICATES_MAX_RADIUS_M:g}")
+    try:
+        logger.info("Finding duplicates within %s m with name similarity %s", radius_m, name_similarity)
+        events = duplicates.iter_duplicate_events(db, radius_m, name_similarity, batch_size=batch_size)
+        return StreamingResponse(_ndjson_events(events), media_type="application/x-ndjson")
+    except Exception as e:
+        logger.error("Error finding duplicate addresses: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def _change_dicts(changes):
+    return [{"seq": seq, "op": op, "id": address_id,
+             "address": {"id": address_id, "name": name, "latitude": latitude, "longitude": longitude} if op == "upsert" else None}
+            for seq, op, address_id, name, latitude, longitude in changes]
+
+@router.get(
+    "/changes",
+    response_model=schemas.AddressChanges,
+    summary="Get changes since a sequence number",
+    description="Return the addresses created, updated or deleted after `since`, oldest first, each once in its "
+                "latest state. Start with since=0 to receive the whole book, then pass `next_since` back while "
+                "`has_more` is true. The cost depends on the number of changes, not on the size of the book."
+)
+def read_changes(since: int = Query(0, ge=0), limit: int = Query(100, ge=1, le=10000), db: Session = Depends(get_read_db)):
+    try:
+        logger.info("Fetching changes after %s", since)
+        changes, has_more = crud.get_changes(db, since=since, limit=limit)
+        return FastJSONResponse({"changes": _change_dicts(changes), "next_since": changes[-1][0] if changes else since,
+                                 "has_more": has_more})
+    except Exception as e:
+        logger.error("Error reading changes: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+# Comment lines sent on an idle stream so proxies do not time it out
+_SSE_KEEPALIVE_SECONDS = 15
+
+def _poll_changes(read_db, since: int, limit: int):
+    # A session per poll from the get_read_db dependency: a stream holds no pooled connection or
+    # read snapshot while it waits
+    sessions = read_db()
+    try:
+        return crud.get_changes(next(sessions), since=since, limit=limit)
+    finally:
+        sessions.close()
+
+async def _change_events(request: Request, since: int):
+    # The response outlives the route's dependencies, so sessions come from the provider itself,
+    # honouring app.dependency_overrides
+    read_db = request.app.dependency_overrides.get(get_read_db, get_read_db)
+    yield f"retry: {int(config.CHANGES_POLL_INTERVAL * 1000)}\n\n".encode()
+    deadline = time.monotonic() + config.CHANGES_STREAM_TIMEOUT
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline and not await request.is_disconnected():
+        changes, has_more = await run_in_threadpool(_poll_changes, read_db, since, 1000)
+        for change in _change_dicts(changes):
+            yield b"id: %d\nevent: %s\ndata: %s\n\n" % (change["seq"], change["op"].encode(), orjson.dumps(change))
+        if changes:
+            since = changes[-1][0]
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= _SSE_KEEPALIVE_SECONDS:
+            yield b": keepalive\n\n"
+            last_sent = time.monotonic()
+        if not has_more:
+            await asyncio.sleep(config.CHANGES_POLL_INTERVAL)
+
+@router.get(
+    "/changes/stream",
+    response_class=StreamingResponse,
+    summary="Stream changes as Server-Sent Events",
+    description="Send the changes after `since` (or the Last-Event-ID header, when reconnecting), then new changes "
+                "as they are committed. Each event has the change sequence number as its id, the operation "
+                "(upsert or delete) as its type and the change as JSON data, as in GET /addresses/changes. "
+                "The stream is closed after ADDRESS_BOOK_CHANGES_STREAM_TIMEOUT seconds; EventSource clients reconnect "
+                "and resume from the last event."
+)
+async def stream_changes(request: Request, since: int = Query(0, ge=0), last_event_id: Optional[str] = Header(None)):
+    if last_event_id is not None:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID must be a change sequence number")
+    logger.info("Streaming changes after %s", since)
+    return StreamingResponse(_change_events(request, since), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def _stream_json_array(batches):
+    # A JSON array written batch by batch, so large results are never held in memory at once
+    yield b"["
+    separator = b""
+    for rows in batches:
+        if rows:
+            yield separator + orjson.dumps(_address_dicts(rows))[1:-1]
+            separator = b","
+    yield b"]"
+
+@router.get(
+    "/in_bbox",
+    response_model=List[schemas.Address],
+    response_class=StreamingResponse,
+    summary="Get addresses inside a bounding box",
+    description="Stream the addresses inside the box as a JSON array, in no particular order. "
+                "A min_lon greater than max_lon selects a box crossing the antimeridian."
+)
+def read_addresses_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    batch_size: int = Query(1000, ge=1, le=50000),
+    db: Session = Depends(get_read_db),
+):
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not be greater than max_lat")
+    try:
+        logger.info("Fetching addresses in box (%s, %s, %s, %s)", min_lat, min_lon, max_lat, max_lon)
+        batches = crud.iter_addresses_in_bbox(db, min_lat, min_lon, max_lat, max_lon, batch_size=batch_size)
+        return StreamingResponse(_stream_json_array(batches), media_type="application/json")
+    except Exception as e:
+        logger.error("Error reading addresses in box: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.post(
+    "/in_polygon",
+    response_model=List[schemas.Address],
+    response_class=StreamingResponse,
+    summary="Get addresses inside a polygon",
+    description="Stream the addresses inside a GeoJSON Polygon or MultiPolygon (holes excluded) as a JSON array, "
+                "in no particular order. Edges are straight lines in longitude and latitude and may cross the antimeridian."
+)
+def read_addresses_in_polygon(
+    geometry: schemas.PolygonGeometry = Body(...),
+    batch_size: int = Query(1000, ge=1, le=50000),
+    db: Session = Depends(get_read_db),
+):
+    polygons = [geometry.coordinates] if geometry.type == "Polygon" else geometry.coordinates
+    vertices = sum(len(ring) for polygon in polygons for ring in polygon)
+    if vertices > config.POLYGON_MAX_VERTICES:
+        raise HTTPException(status_code=400, detail=f"Polygon has more than {config.POLYGON_MAX_VERTICES} vertices")
+    try:
+        logger.info("Fetching addresses in a %s of %s vertices", geometry.type, vertices)
+        batches = crud.iter_addresses_in_polygon(db, [geo.polygon_rings(polygon) for polygon in polygons], batch_size=batch_size)
+        return StreamingResponse(_stream_json_array(batches), media_type="application/json")
+    except Exception as e:
+        logger.error("Error reading addresses in polygon: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+def _parse_bbox(bbox: str):
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be min_lon,min_lat,max_lon,max_lat")
+    if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox is out of range")
+    return min_lon, min_lat, max_lon, max_lat
+
+@router.get(
+    "/clusters",
+    response_model=List[schemas.AddressCluster],
+    summary="Get address counts per map cell",
+    description="Count the addresses in every non-empty Web Mercator tile of the given zoom inside bbox "
+                "(min_lon,min_lat,max_lon,max_lat; min_lon > max_lon crosses the antimeridian), with the centroid "
+                "of each tile. Counts are precomputed, so the cost depends on the number of cells, not of addresses. "
+                "For clusters of about 64 px on a 256 px tile map, ask for the map zoom plus 2."
+)
+def read_address_clusters(bbox: str, zoom: int = Query(..., ge=0, le=clusters.MAX_ZOOM), db: Session = Depends(get_read_db)):
+    box = _parse_bbox(bbox)
+    if clusters.cell_count(*box, zoom) > config.CLUSTER_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"bbox covers more than {config.CLUSTER_MAX_CELLS} cells at zoom {zoom}")
+    try:
+        logger.info("Fetching zoom %s clusters in %s", zoom, bbox)
+        cells = crud.get_address_clusters(db, *box, zoom)
+        return FastJSONResponse([
+            {"x": x, "y": y, "count": count, "latitude": latitude, "longitude": longitude}
+            for x, y, count, latitude, longitude in cells
+        ])
+    except Exception as e:
+        logger.error("Error reading address clusters: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.get(
+    "/search",
+    response_model=List[schemas.AddressSearchResult],
+    summary="Search addresses by name",
+    description="Full-text search over address names: every word must match, the last one as a prefix, and "
+                "accents and case are ignored. Results are ranked by relevance. Pass latitude, longitude and "
+                "distance_km to keep only matches within that distance; order_by=distance then sorts them nearest first."
+)
+def search_addresses(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=1000),
+    latitude: Optional[float] = Query(None, ge=-90, le=90),
+    longitude: Optional[float] = Query(None, ge=-180, le=180),
+    distance_km: Optional[float] = Query(None, gt=0),
+    accuracy: Literal["fast", "exact"] = "exact",
+    order_by: Literal["relevance", "distance"] = "relevance",
+    db: Session = Depends(get_read_db),
+):
+    location = (latitude, longitude, distance_km)
+    if any(value is not None for value in location) and any(value is None for value in location):
+        raise HTTPException(status_code=400, detail="latitude, longitude and distance_km must be given together")
+    if order_by == "distance" and distance_km is None:
+        raise HTTPException(status_code=400, detail="order_by=distance requires latitude, longitude and distance_km")
+    try:
+        logger.info("Searching addresses for %r", q)
+        results = crud.search_addresses(db, q, limit=limit, latitude=latitude, longitude=longitude,
+                                        distance_km=distance_km, accuracy=accuracy, order_by=order_by)
+        return FastJSONResponse([
+            {"id": address_id, "name": name, "latitude": address_latitude, "longitude": address_longitude,
+             "score": score, "distance_km": result_distance}
+            for (address_id, name, address_latitude, address_longitude), score, result_distance in results
+        ])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("Error searching addresses: %s", e)
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+@router.get(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Get an address by ID",
+    description="Retrieve the details of an address by its ID. The response carries an ETag; send it back in "
+                "If-None-Match to get 304 Not Modified while the address is unchanged."
+)
+def read_address(address_id: int, request: Request, db: Session = Depends(get_read_db)):
+    with _server_errors("reading address"):
+        logger.info("Fetching address with ID: %s", address_id)
+        entry = crud.get_address_payload(db, address_id=address_id)
+        if entry is None:
+            logger.warning("Address with ID %s not found", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return _address_response(request, *entry)
+
+@router.delete(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Delete an address by ID",
+    description="Delete an address by its ID. Returns the deleted address details."
+)
+def delete_address(address_id: int, db: Session = Depends(get_db)):
+    with _server_errors("deleting address"):
+        logger.info("Deleting address with ID: %s", address_id)
+        if config.WRITE_COALESCING:
+            db_address = write_coalescer.coalescer.write("delete", address_id)
+        else:
+            db_address = crud.delete_address(db, address_id=address_id)
+        if db_address is None:
+            logger.warning("Address with ID %s not found for deletion", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return schemas.Address.model_validate(db_address)
+
+@router.put(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Update an address by ID",
+    description="Update an address by its ID. The address must be unique."
+)
+def update_address(address_id: int, address: schemas.AddressCreate, db: Session = Depends(get_db)):
+    with _server_errors("updating address"):
+        logger.info("Updating address with ID: %s", address_id)
+        if config.WRITE_COALESCING:
+            db_address = write_coalescer.coalescer.write("update", address_id, address)
+        else:
+            db_address = crud.update_address(db, address_id=address_id, address=address)
+        if db_address is None:
+            logger.warning("Address with ID %s not found for update", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return schemas.Address.model_validate(db_address)
+
+@router.get(
+    "/",
+    response_model=Dict[str, Any],
+    summary="Get a list of addresses with pagination",
+    description="Retrieve a paginated list of addresses. Either specify the page number and page size, "
+                "or pass limit (and the after cursor from a previous response) for keyset pagination. "
+                "The total count is only computed when include_total=true."
+)
+def read_addresses(
+    request: Request,
+    page: int = 1,
+    page_size: int = 10,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    include_total: bool = False,
+    db: Session = Depends(get_read_db),
+):
+    with _server_errors("reading addresses"):
+        if after is not None or limit is not None:
+            limit = limit or page_size
+            after_id = _decode_cursor(after) if after is not None else None
+            logger.info("Fetching %s addresses after cursor %s", limit, after)
+            response = _keyset_page(request, crud.get_addresses_after(db, after_id=after_id, limit=limit + 1), limit)
+        else:
+            logger.info("Fetching addresses for page %s with page size %s", page, page_size)
+            response = _numbered_page(request, crud.get_addresses(db, page=page, page_size=page_size, lookahead=True),
+                                      page, page_size)
+        if include_total:
+            response["total"] = crud.count_addresses(db)
+        logger.info("Returning %s addresses", len(response["addresses"]))
+        return FastJSONResponse(response)
+
+@router.get(
+    "/within_distance/",
+    response_model=List[schemas.Address],
+    summary="Get addresses within a certain distance",
+    description="Retrieve a list of addresses within a specified distance from a given coordinate. "
+                "Use accuracy=fast for spherical distances or accuracy=exact (default) for ellipsoidal geodesic distances."
+)
+def read_addresses_within_distance(latitude: float, longitude: float, distance_km: float, accuracy: Literal["fast", "exact"] = "exact", db: Session = Depends(get_read_db)):
+    with _server_errors("reading addresses within distance"):
+        logger.info("Fetching addresses within %s km of (%s, %s)", distance_km, latitude, longitude)
+        addresses = crud.get_addresses_within_distance(db, latitude, longitude, distance_km, accuracy=accuracy)
+        return FastJSONResponse(_address_dicts(addresses))
+
+@router.post(
+    "/within_distance/batch",
+    response_model=schemas.ProximityBatchResult,
+    summary="Get addresses within distance of many points",
+    description="Answer many within-distance queries in one request, each result holding what "
+                "GET /addresses/within_distance/ returns for that query. Candidates are loaded once for the whole "
+                "batch and large batches are split across a process pool. With matrix=true the response also holds "
+                "the distance in km from every query point to every matched address."
+)
+def read_addresses_within_distance_batch(batch: schemas.ProximityBatch, db: Session = Depends(get_read_db)):
+    with _server_errors("reading addresses within distance of many points"):
+        logger.info("Fetching addresses within distance of %s points", len(batch.queries))
+        queries = [(query.latitude, query.longitude, query.distance_km) for query in batch.queries]
+        results, distances = crud.get_addresses_within_distance_batch(db, queries, accuracy=batch.accuracy, matrix=batch.matrix)
+        return FastJSONResponse({
+            "results": [{"addresses": _address_dicts(rows)} for rows in results],
+            "matrix": {"address_ids": distances[0], "distances_km": distances[1]} if distances is not None else None,
+        })
+
+@router.get(
+    "/nearest/",
+    response_model=List[schemas.AddressWithDistance],
+    summary="Get the nearest addresses",
+    description="Retrieve the k addresses closest to a given coordinate, nearest first, with their distance in km."
+)
+def read_nearest_addresses(latitude: float, longitude: float, k: int = Query(10, ge=1, le=1000), accuracy: Literal["fast", "exact"] = "exact", db: Session = Depends(get_read_db)):
+    with _server_errors("reading nearest addresses"):
+        logger.info("Fetching %s addresses nearest to (%s, %s)", k, latitude, longitude)
+        nearest = crud.get_nearest_addresses(db, latitude, longitude, k, accuracy=accuracy)
+        return FastJSONResponse(_nearest_dicts(nearest))
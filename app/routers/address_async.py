@@ -0,0 +1,147 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+from typing import List, Dict, Any, Literal, Optional
+from .. import async_crud, schemas
+from ..database import AsyncSessionLocal
+from .address import (FastJSONResponse, _address_dicts, _address_response, _decode_cursor, _keyset_page, _nearest_dicts,
+                      _numbered_page, _server_errors)
+
+# Async versions of the core routes in address.py, served when ADDRESS_BOOK_ASYNC_DB is set.
+# Paths, parameters and responses are identical so the two can be compared under load.
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/addresses",
+    tags=["addresses"],
+    responses={404: {"description": "Not found"}},
+)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+@router.post(
+    "/",
+    response_model=schemas.Address,
+    summary="Create a new address",
+    description="Create a new address with the given details. The address must be unique."
+)
+async def create_address(address: schemas.AddressCreate, db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("creating address"):
+        logger.info("Creating address with data: %s", address)
+        db_address = await async_crud.create_address(db=db, address=address)
+        return schemas.Address.model_validate(db_address)
+
+@router.get(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Get an address by ID",
+    description="Retrieve the details of an address by its ID. The response carries an ETag; send it back in "
+                "If-None-Match to get 304 Not Modified while the address is unchanged."
+)
+async def read_address(address_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("reading address"):
+        logger.info("Fetching address with ID: %s", address_id)
+        entry = await async_crud.get_address_payload(db, address_id=address_id)
+        if entry is None:
+            logger.warning("Address with ID %s not found", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return _address_response(request, *entry)
+
+@router.delete(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Delete an address by ID",
+    description="Delete an address by its ID. Returns the deleted address details."
+)
+async def delete_address(address_id: int, db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("deleting address"):
+        logger.info("Deleting address with ID: %s", address_id)
+        db_address = await async_crud.delete_address(db, address_id=address_id)
+        if db_address is None:
+            logger.warning("Address with ID %s not found for deletion", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return schemas.Address.model_validate(db_address)
+
+@router.put(
+    "/{address_id}",
+    response_model=schemas.Address,
+    summary="Update an address by ID",
+    description="Update an address by its ID. The address must be unique."
+)
+async def update_address(address_id: int, address: schemas.AddressCreate, db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("updating address"):
+        logger.info("Updating address with ID: %s", address_id)
+        db_address = await async_crud.update_address(db, address_id=address_id, address=address)
+        if db_address is None:
+            logger.warning("Address with ID %s not found for update", address_id)
+            raise HTTPException(status_code=404, detail="Address not found")
+        return schemas.Address.model_validate(db_address)
+
+@router.get(
+    "/",
+    response_model=Dict[str, Any],
+    summary="Get a list of addresses with pagination",
+    description="Retrieve a paginated list of addresses. Either specify the page number and page size, "
+                "or pass limit (and the after cursor from a previous response) for keyset pagination. "
+                "The total count is only computed when include_total=true."
+)
+async def read_addresses(
+    request: Request,
+    page: int = 1,
+    page_size: int = 10,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    include_total: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    with _server_errors("reading addresses"):
+        if after is not None or limit is not None:
+            limit = limit or page_size
+            after_id = _decode_cursor(after) if after is not None else None
+            logger.info("Fetching %s addresses after cursor %s", limit, after)
+            response = _keyset_page(request, await async_crud.get_addresses_after(db, after_id=after_id, limit=limit + 1), limit)
+        else:
+            logger.info("Fetching addresses for page %s with page size %s", page, page_size)
+            response = _numbered_page(request, await async_crud.get_addresses(db, page=page, page_size=page_size, lookahead=True),
+                                      page, page_size)
+        if include_total:
+            response["total"] = await async_crud.count_addresses(db)
+        logger.info("Returning %s addresses", len(response["addresses"]))
+        return FastJSONResponse(response)
+
+@router.get(
+    "/within_distance/",
+    response_model=List[schemas.Address],
+    summary="Get addresses within a certain distance",
+    description="Retrieve a list of addresses within a specified distance from a given coordinate. "
+                "Use accuracy=fast for spherical distances or accuracy=exact (default) for ellipsoidal geodesic distances."
+)
+async def read_addresses_within_distance(latitude: float, longitude: float, distance_km: float, accuracy: Literal["fast", "exact"] = "exact", db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("reading addresses within distance"):
+        logger.info("Fetching addresses within %s km of (%s, %s)", distance_km, latitude, longitude)
+        addresses = await async_crud.get_addresses_within_distance(db, latitude, longitude, distance_km, accuracy=accuracy)
+        return FastJSONResponse(_address_dicts(addresses))
+
+@router.get(
+    "/nearest/",
+    response_model=List[schemas.AddressWithDistance],
+    summary="Get the nearest addresses",
+    description="Retrieve the k addresses closest to a given coordinate, nearest first, with their distance in km."
+)
+async def read_nearest_addresses(latitude: float, longitude: float, k: int = Query(10, ge=1, le=1000), accuracy: Literal["fast", "exact"] = "exact", db: AsyncSession = Depends(get_async_db)):
+    with _server_errors("reading nearest addresses"):
+        logger.info("Fetching %s addresses nearest to (%s, %s)", k, latitude, longitude)
+        nearest = await async_crud.get_nearest_addresses(db, latitude, longitude, k, accuracy=accuracy)
+        return FastJSONResponse(_nearest_dicts(nearest))
+
+def with_async_routes(sync_router: APIRouter) -> APIRouter:
+    """Return a router with the routes of ``sync_router``, swapping in the async handler for each path
+    and method defined here. Routes keep their positions, so fixed paths such as /export still match
+    before /{address_id}."""
+    async_routes = {(route.path, frozenset(route.methods)): route for route in router.routes}
+    combined = APIRouter()
+    combined.routes = [async_routes.get((route.path, frozenset(route.methods)), route) for route in sync_router.routes]
+    return combined
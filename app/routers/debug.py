@@ -0,0 +1,63 @@
+from fastapi import APIRouter
+import logging
+from typing import Dict, Any
+from .. import profiling, startup
+from ..cache import address_cache
+from ..spatial_index import index as spatial_index
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+)
+
+@router.get(
+    "/spatial_index",
+    response_model=Dict[str, Any],
+    summary="Get spatial index statistics",
+    description="Report the size, pending changes and memory footprint of the in-memory spatial index."
+)
+def read_spatial_index_stats():
+    return spatial_index.stats()
+
+@router.get(
+    "/cache",
+    response_model=Dict[str, Any],
+    summary="Get address cache statistics",
+    description="Report the size, hit ratio, evictions and invalidations of the GET /addresses/{address_id} cache."
+)
+def read_cache_stats():
+    return address_cache.stats()
+
+@router.get(
+    "/profiling",
+    response_model=Dict[str, Any],
+    summary="Get slow queries and query budget violations",
+    description="List the most recent statements slower than ADDRESS_BOOK_SLOW_QUERY_MS, with their EXPLAIN QUERY PLAN, "
+                "and the requests that ran more statements or fetched more rows than the query budget. "
+                "Only populated when ADDRESS_BOOK_PROFILING is enabled."
+)
+def read_profiling():
+    return profiling.snapshot()
+
+@router.delete(
+    "/profiling",
+    response_model=Dict[str, Any],
+    summary="Clear slow queries and query budget violations",
+    description="Empty the slow query and budget violation buffers, e.g. before a staging test run."
+)
+def clear_profiling():
+    profiling.clear()
+    return profiling.snapshot()
+
+@router.get(
+    "/startup",
+    response_model=Dict[str, Any],
+    summary="Get startup timings",
+    description="Report how long each phase of this worker's startup took, in milliseconds: logging, engines, "
+                "database connection check, schema check and spatial index load."
+)
+def read_startup():
+    return startup.report()
+
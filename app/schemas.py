@@ -1,14 +1,138 @@
-from pydantic import BaseModel, ConfigDict
-
-class AddressBase(BaseModel):
-    name: str
-    latitude: float
-    longitude: float
-
-class AddressCreate(AddressBase):
-    pass
-
-class Address(AddressBase):
-    id: int
-
-    model_config = ConfigDict(from_attributes=True) # Enable ORM mode (orm_mode is deprecated)
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Annotated, List, Literal, Optional, Union
+from . import config
+
+class AddressBase(BaseModel):
+    name: str
+    latitude: float
+    longitude: float
+
+class AddressCreate(AddressBase):
+    pass
+
+class Address(AddressBase):
+    id: int
+
+    model_config = ConfigDict(from_attributes=True) # Enable ORM mode (orm_mode is deprecated)
+
+class AddressWithDistance(Address):
+    distance_km: float
+
+class AddressSearchResult(Address):
+    # Negated bm25 rank of the name match; higher is more relevant
+    score: float
+    distance_km: Optional[float] = None
+
+class AddressCluster(BaseModel):
+    # Map tile (x, y) at the requested zoom; latitude and longitude are the centroid of its addresses
+    x: int
+    y: int
+    count: int
+    latitude: float
+    longitude: float
+
+class ProximityQuery(BaseModel):
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    distance_km: float = Field(..., ge=0)
+
+class ProximityBatch(BaseModel):
+    queries: List[ProximityQuery] = Field(..., min_length=1, max_length=config.PROXIMITY_BATCH_MAX_QUERIES)
+    accuracy: Literal["fast", "exact"] = "exact"
+    # Also return the distance from every origin to every matched address
+    matrix: bool = False
+
+class ProximityResult(BaseModel):
+    addresses: List[Address]
+
+class DistanceMatrix(BaseModel):
+    # distances_km[i][j] is the distance from query i to the address address_ids[j]
+    address_ids: List[int]
+    distances_km: List[List[float]]
+
+class ProximityBatchResult(BaseModel):
+    results: List[ProximityResult]
+    matrix: Optional[DistanceMatrix] = None
+
+class AddressChange(BaseModel):
+    # Sequence number of the change; address is null for deletions
+    seq: int
+    op: Literal["upsert", "delete"]
+    id: int
+    address: Optional[Address] = None
+
+class AddressChanges(BaseModel):
+    changes: List[AddressChange]
+    # Pass as since to fetch the changes that follow
+    next_since: int
+    has_more: bool
+
+# GeoJSON positions are [longitude, latitude], optionally followed by an altitude; rings are closed
+Position = Annotated[List[float], Field(min_length=2, max_length=3)]
+LinearRing = Annotated[List[Position], Field(min_length=4)]
+
+def _check_positions(rings: List[List[List[float]]]):
+    for ring in rings:
+        for longitude, latitude, *_ in ring:
+            if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+                raise ValueError(f"position [{longitude}, {latitude}] is out of range")
+
+class GeoJSONPolygon(BaseModel):
+    type: Literal["Polygon"]
+    # Outer ring first, then holes
+    coordinates: List[LinearRing] = Field(..., min_length=1)
+
+    @field_validator("coordinates")
+    @classmethod
+    def positions_in_range(cls, coordinates):
+        _check_positions(coordinates)
+        return coordinates
+
+class GeoJSONMultiPolygon(BaseModel):
+    type: Literal["MultiPolygon"]
+    coordinates: List[Annotated[List[LinearRing], Field(min_length=1)]] = Field(..., min_length=1)
+
+    @field_validator("coordinates")
+    @classmethod
+    def positions_in_range(cls, coordinates):
+        for polygon in coordinates:
+            _check_positions(polygon)
+        return coordinates
+
+PolygonGeometry = Annotated[Union[GeoJSONPolygon, GeoJSONMultiPolygon], Field(discriminator="type")]
+
+class BulkImportIssue(BaseModel):
+    line: int
+    detail: str
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    conflicts: int
+    invalid: int
+    conflict_rows: List[BulkImportIssue]
+    invalid_rows: List[BulkImportIssue]
+
+class BatchIds(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=config.BATCH_MAX_ITEMS)
+
+class AddressPatch(BaseModel):
+    # Fields left out (or null) keep their current value
+    id: int
+    name: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+class AddressBatchPatch(BaseModel):
+    items: List[AddressPatch] = Field(..., min_length=1, max_length=config.BATCH_MAX_ITEMS)
+
+class BatchItemResult(BaseModel):
+    id: int
+    status: Literal["ok", "not_found", "conflict"]
+    address: Optional[Address] = None
+    detail: Optional[str] = None
+
+class BatchResult(BaseModel):
+    ok: int
+    not_found: int
+    conflicts: int
+    items: List[BatchItemResult]
@@ -0,0 +1,272 @@
+import logging
+import sys
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from . import config, models
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of changes before a rebuild is considered, so small books are not rebuilt on every write
+_MIN_REBUILD_CHANGES = 1024
+
+
+class _KDTree:
+    """Static 2-d tree stored as coordinate arrays permuted into tree order.
+
+    The node covering positions ``[lo, hi)`` at ``depth`` splits on latitude
+    (even depth) or longitude (odd depth) at ``mid = (lo + hi) // 2``: positions
+    before ``mid`` hold values <= the split value and positions from ``mid`` on
+    hold values >= it. No node objects are allocated; only the split value of
+    each internal node is kept, keyed by its (unique) ``mid``.
+    """
+
+    def __init__(self, ids: np.ndarray, latitudes: np.ndarray, longitudes: np.ndarray, leaf_size: int):
+        self.leaf_size = max(int(leaf_size), 1)
+        order = np.arange(len(ids))
+        coords = (latitudes, longitudes)
+        self._splits = {}
+        stack = [(0, len(ids), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= self.leaf_size:
+                continue
+            mid = (lo + hi) // 2
+            segment = order[lo:hi]
+            order[lo:hi] = segment[np.argpartition(coords[depth % 2][segment], mid - lo)]
+            self._splits[mid] = float(coords[depth % 2][order[mid]])
+            stack.append((lo, mid, depth + 1))
+            stack.append((mid, hi, depth + 1))
+
+        self.ids = np.ascontiguousarray(ids[order], dtype=np.int64)
+        self.latitudes = np.ascontiguousarray(latitudes[order], dtype=np.float64)
+        self.longitudes = np.ascontiguousarray(longitudes[order], dtype=np.float64)
+        self.alive = np.ones(len(order), dtype=bool)
+        # id -> tree position lookup via binary search
+        self._id_order = np.argsort(self.ids, kind="stable")
+        self._sorted_ids = self.ids[self._id_order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self) -> int:
+        # Each split entry holds an int key and a float value
+        splits_bytes = sys.getsizeof(self._splits) + len(self._splits) * (28 + 24)
+        return (self.ids.nbytes + self.latitudes.nbytes + self.longitudes.nbytes + self.alive.nbytes
+                + self._id_order.nbytes + self._sorted_ids.nbytes + splits_bytes)
+
+    def position(self, address_id: int):
+        i = np.searchsorted(self._sorted_ids, address_id)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == address_id:
+            return int(self._id_order[i])
+        return None
+
+    def query(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> np.ndarray:
+        """Positions of live points inside the box."""
+        bounds = ((min_lat, max_lat), (min_lon, max_lon))
+        found = []
+        stack = [(0, len(self.ids), 0)]
+        while stack:
+            lo, hi, depth = stack.pop()
+            if hi - lo <= self.leaf_size:
+                lats = self.latitudes[lo:hi]
+                lons = self.longitudes[lo:hi]
+                inside = ((lats >= min_lat) & (lats <= max_lat) & (lons >= min_lon) & (lons <= max_lon)
+                          & self.alive[lo:hi])
+                found.append(np.flatnonzero(inside) + lo)
+                continue
+            mid = (lo + hi) // 2
+            dim = depth % 2
+            split = self._splits[mid]
+            if bounds[dim][0] <= split:
+                stack.append((lo, mid, depth + 1))
+            if bounds[dim][1] >= split:
+                stack.append((mid, hi, depth + 1))
+        if not found:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(found)
+
+
+def _empty_tree(leaf_size: int) -> _KDTree:
+    return _KDTree(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), leaf_size)
+
+
+class SpatialIndex:
+    """In-process index of address coordinates kept in sync with CRUD writes.
+
+    Points live in a static :class:`_KDTree`. Writes are applied incrementally:
+    deletes tombstone the tree slot and inserts go to a small pending buffer
+    that queries scan linearly. When tombstones and pending inserts grow past
+    ``rebuild_ratio`` of the tree, a background thread rebuilds the tree and
+    replays the writes that happened meanwhile.
+    """
+
+    def __init__(self, leaf_size: int = 64, rebuild_ratio: float = 0.25):
+        self.leaf_size = leaf_size
+        self.rebuild_ratio = rebuild_ratio
+        self.ready = False
+        self._lock = threading.Lock()
+        self._tree = _empty_tree(leaf_size)
+        self._pending = {}  # id -> (latitude, longitude) inserted since the last build
+        self._tombstones = 0
+        self._rebuild_thread = None
+        self._replay_log = None  # writes made while a rebuild is running
+
+    def build(self, ids, latitudes, longitudes):
+        tree = _KDTree(np.asarray(ids, dtype=np.int64), np.asarray(latitudes, dtype=np.float64),
+                       np.asarray(longitudes, dtype=np.float64), self.leaf_size)
+        with self._lock:
+            self._tree = tree
+            self._pending = {}
+            self._tombstones = 0
+            self.ready = True
+        logger.info("Spatial index built with %d addresses (%d bytes)", len(tree), self.memory_bytes())
+
+    def load(self, db: Session, batch_size: int = 50000):
+        """Build the index from every address in the database."""
+        start = time.perf_counter()
+        ids, latitudes, longitudes = [], [], []
+        stmt = (select(models.Address.id, models.Address.latitude, models.Address.longitude)
+                .where(models.Address.latitude.is_not(None), models.Address.longitude.is_not(None))
+                .execution_options(yield_per=batch_size))
+        for partition in db.execute(stmt).partitions():
+            chunk = np.array(partition, dtype=np.float64).reshape(-1, 3)
+            ids.append(chunk[:, 0].astype(np.int64))
+            latitudes.append(chunk[:, 1])
+            longitudes.append(chunk[:, 2])
+        if ids:
+            self.build(np.concatenate(ids), np.concatenate(latitudes), np.concatenate(longitudes))
+        else:
+            self.build([], [], [])
+        logger.info("Spatial index loaded in %.3fs", time.perf_counter() - start)
+
+    def clear(self):
+        with self._lock:
+            self._tree = _empty_tree(self.leaf_size)
+            self._pending = {}
+            self._tombstones = 0
+            self.ready = False
+
+    def add(self, address_id: int, latitude: float, longitude: float):
+        if latitude is None or longitude is None:
+            return
+        with self._lock:
+            self._remove_locked(address_id)
+            self._pending[address_id] = (latitude, longitude)
+            if self._replay_log is not None:
+                self._replay_log.append((address_id, latitude, longitude))
+        self._maybe_rebuild()
+
+    def remove(self, address_id: int):
+        with self._lock:
+            self._remove_locked(address_id)
+            if self._replay_log is not None:
+                self._replay_log.append((address_id, None, None))
+        self._maybe_rebuild()
+
+    def _remove_locked(self, address_id: int):
+        if self._pending.pop(address_id, None) is not None:
+            return
+        position = self._tree.position(address_id)
+        if position is not None and self._tree.alive[position]:
+            self._tree.alive[position] = False
+            self._tombstones += 1
+
+    def query_bbox(self, min_lat: float, max_lat: float, lon_ranges):
+        """Return ``(ids, latitudes, longitudes)`` arrays of the points inside the box."""
+        with self._lock:
+            tree = self._tree
+            pending = list(self._pending.items())
+        positions = np.concatenate([tree.query(min_lat, max_lat, min_lon, max_lon)
+                                    for min_lon, max_lon in lon_ranges])
+        ids = tree.ids[positions]
+        latitudes = tree.latitudes[positions]
+        longitudes = tree.longitudes[positions]
+        if pending:
+            pending_ids = np.fromiter((item[0] for item in pending), dtype=np.int64, count=len(pending))
+            pending_coords = np.array([item[1] for item in pending], dtype=np.float64)
+            pending_lats, pending_lons = pending_coords[:, 0], pending_coords[:, 1]
+            inside = (pending_lats >= min_lat) & (pending_lats <= max_lat)
+            inside &= np.logical_or.reduce([(pending_lons >= min_lon) & (pending_lons <= max_lon)
+                                            for min_lon, max_lon in lon_ranges])
+            ids = np.concatenate((ids, pending_ids[inside]))
+            latitudes = np.concatenate((latitudes, pending_lats[inside]))
+            longitudes = np.concatenate((longitudes, pending_lons[inside]))
+        return ids, latitudes, longitudes
+
+    def _maybe_rebuild(self):
+        with self._lock:
+            changes = self._tombstones + len(self._pending)
+            if changes < max(_MIN_REBUILD_CHANGES, self.rebuild_ratio * len(self._tree)):
+                return
+            if self._rebuild_thread is not None:
+                return
+            self._rebuild_thread = threading.Thread(target=self._rebuild, name="spatial-index-rebuild", daemon=True)
+            self._rebuild_thread.start()
+
+    def _rebuild(self):
+        try:
+            with self._lock:
+                tree = self._tree
+                alive = tree.alive.copy()
+                pending = list(self._pending.items())
+                self._replay_log = []
+            ids = np.concatenate((tree.ids[alive], np.array([item[0] for item in pending], dtype=np.int64)))
+            coords = np.array([item[1] for item in pending], dtype=np.float64).reshape(-1, 2)
+            latitudes = np.concatenate((tree.latitudes[alive], coords[:, 0]))
+            longitudes = np.concatenate((tree.longitudes[alive], coords[:, 1]))
+            new_tree = _KDTree(ids, latitudes, longitudes, self.leaf_size)
+            with self._lock:
+                replay_log = self._replay_log
+                self._tree = new_tree
+                self._pending = {}
+                self._tombstones = 0
+                self._replay_log = None
+                for address_id, latitude, longitude in replay_log:
+                    self._remove_locked(address_id)
+                    if latitude is not None:
+                        self._pending[address_id] = (latitude, longitude)
+            logger.info("Spatial index rebuilt with %d addresses", len(new_tree))
+        except Exception as e:
+            logger.error("Error rebuilding spatial index: %s", str(e))
+            with self._lock:
+                self._replay_log = None
+        finally:
+            with self._lock:
+                self._rebuild_thread = None
+
+    def wait_for_rebuild(self, timeout: float = None):
+        thread = self._rebuild_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by the index, in bytes."""
+        with self._lock:
+            return self._memory_bytes_locked()
+
+    def _memory_bytes_locked(self) -> int:
+        # Each pending entry holds an int key and a tuple of two floats
+        pending_bytes = sys.getsizeof(self._pending) + len(self._pending) * (28 + 56 + 2 * 24)
+        return self._tree.nbytes + pending_bytes
+
+    def stats(self):
+        with self._lock:
+            size = len(self._tree) - self._tombstones + len(self._pending)
+            return {
+                "ready": self.ready,
+                "size": size,
+                "tree_size": len(self._tree),
+                "tombstones": self._tombstones,
+                "pending": len(self._pending),
+                "rebuilding": self._rebuild_thread is not None,
+                "memory_bytes": self._memory_bytes_locked(),
+            }
+
+
+index = SpatialIndex(leaf_size=config.SPATIAL_INDEX_LEAF_SIZE, rebuild_ratio=config.SPATIAL_INDEX_REBUILD_RATIO)
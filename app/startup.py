@@ -0,0 +1,62 @@
+import logging
+import time
+
+from . import config, database, distance, metrics
+from .logging_config import setup_logging
+from .spatial_index import index as spatial_index
+from .write_coalescer import coalescer as write_coalescer
+
+# Process initialization, run by the FastAPI lifespan in app/main.py rather than at import time.
+# Each phase is timed; the timings are logged, served at /debug/startup and exported as the
+# startup_duration_seconds gauge, so slow worker cold starts show up before they slow autoscaling.
+
+logger = logging.getLogger(__name__)
+
+_phases = {}
+
+
+def _load_spatial_index():
+    if config.WORKERS > 1:
+        # Each worker would hold its own index and miss the writes served by the others
+        raise RuntimeError(f"ADDRESS_BOOK_SPATIAL_INDEX needs a single worker but WEB_CONCURRENCY is {config.WORKERS}; "
+                           "run one worker or turn the spatial index off")
+    db = database.SessionLocal()
+    try:
+        spatial_index.load(db)
+    finally:
+        db.close()
+
+
+def _run_phase(name, fn):
+    start = time.perf_counter()
+    fn()
+    _phases[name] = time.perf_counter() - start
+    metrics.startup_duration_seconds.set(_phases[name], (name,))
+
+
+def startup():
+    """Configure logging, create the engines, check the database and its schema, and load the spatial index."""
+    _phases.clear()
+    start = time.perf_counter()
+    _run_phase("logging", setup_logging)
+    _run_phase("engines", database.init_engines)
+    _run_phase("database", database.check_database)
+    _run_phase("schema", database.check_schema)
+    if config.SPATIAL_INDEX_ENABLED:
+        _run_phase("spatial_index", _load_spatial_index)
+    _phases["total"] = time.perf_counter() - start
+    metrics.startup_duration_seconds.set(_phases["total"], ("total",))
+    logger.info("Startup finished in %.1f ms (%s)", _phases["total"] * 1000,
+                ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in _phases.items() if name != "total"))
+
+
+async def shutdown():
+    write_coalescer.stop()
+    spatial_index.clear()
+    distance.shutdown_pool()
+    await database.dispose_engines()
+
+
+def report():
+    """Duration of each phase of the last startup, in milliseconds."""
+    return {name: round(seconds * 1000, 3) for name, seconds in _phases.items()}
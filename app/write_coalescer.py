@@ -0,0 +1,136 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+
+from . import config, crud, metrics
+from .database import SessionLocal
+
+# Opt-in group commit for single-address writes (ADDRESS_BOOK_WRITE_COALESCING). SQLite has one
+# writer, so concurrent POST/PUT/DELETE requests otherwise queue for the write connection and each
+# pays for its own transaction and commit. Here request threads hand their write to one writer
+# thread, which collects the writes arriving within ADDRESS_BOOK_WRITE_COALESCE_WINDOW_MS of the
+# first, applies them in one transaction (crud.apply_address_writes) and resolves each caller with
+# its own result or error. See benchmarks/bench_write_coalescing.py for throughput and latency.
+
+logger = logging.getLogger(__name__)
+
+
+class WriteCoalescer:
+    """Writer thread applying the writes submitted by concurrent callers in shared transactions.
+
+    The thread starts on the first submit. Writes are the tuples accepted by
+    :func:`crud.apply_address_writes` and are applied in submission order.
+    """
+
+    def __init__(self, session_factory=SessionLocal):
+        self.session_factory = session_factory
+        self._queue = queue.SimpleQueue()  # (write, future), or None to stop the thread
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_batch_size = 1
+
+    def submit(self, *write) -> concurrent.futures.Future:
+        future = concurrent.futures.Future()
+        self._queue.put((write, future))
+        if self._thread is None:
+            self._start()
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="write-coalescer", daemon=True)
+                self._thread.start()
+
+    def write(self, *write):
+        """Submit a write and wait for it; returns or raises what the matching crud function would."""
+        future = self.submit(*write)
+        try:
+            return future.result(timeout=config.DB_WRITE_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            # A write still queued is dropped; one already being applied is waited for
+            if future.cancel():
+                raise TimeoutError("Timed out waiting for the write coalescer") from None
+            return future.result()
+
+    def stop(self, timeout: float = None):
+        """Apply the writes already submitted, then stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+        # Writes submitted while the thread was stopping get a new one
+        if not self._queue.empty():
+            self._start()
+
+    def _collect(self):
+        # Block for the first write, then take the ones arriving within the window, up to the batch
+        # limit. The previous group's size estimates the writers that are active: a lone writer does
+        # not wait at all, and the window closes early once as many writes as last time are in.
+        # Returns (batch, stop).
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        expected = self._last_batch_size
+        deadline = time.perf_counter() + config.WRITE_COALESCE_WINDOW_MS / 1000
+        while len(batch) < config.WRITE_COALESCE_MAX_BATCH:
+            timeout = deadline - time.perf_counter() if len(batch) < expected else 0
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        self._last_batch_size = len(batch)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            # Callers that timed out while their write was queued have cancelled it
+            batch = [(write, future) for write, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.db_write_batch_size.observe(len(batch))
+            try:
+                self._apply(batch)
+            except Exception as e:
+                logger.error("Error in write coalescer: %s", str(e))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _apply(self, batch):
+        db = self.session_factory()
+        try:
+            results = crud.apply_address_writes(db, [write for write, _ in batch])
+        except Exception as e:
+            # The transaction was rolled back (failures after the commit do not raise), so no write
+            # of the batch took effect and each can be retried on its own
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            logger.warning("Coalesced batch of %d writes failed, applying them one by one: %s", len(batch), e)
+            results = None
+        finally:
+            db.close()
+        if results is None:
+            # Only the write that fails on its own gets the error
+            for item in batch:
+                self._apply([item])
+            return
+        for (_, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+coalescer = WriteCoalescer()
@@ -0,0 +1,94 @@
+"""Overhead of the /metrics instrumentation (ASGI middleware and SQL statement events).
+
+Serves the same routes from two apps: one with MetricsMiddleware and an instrumented engine,
+and one with neither, backed by an identical uninstrumented engine on the same database. The two
+apps are called alternately so drift affects both equally. The script reports the median added
+latency per request.
+
+    python -m benchmarks.bench_metrics --rows 10000 --iterations 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["ADDRESS_BOOK_DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ["ADDRESS_BOOK_METRICS"] = "0"
+    os.environ["ADDRESS_BOOK_CACHE_SIZE"] = "0"
+    os.environ.setdefault("ADDRESS_BOOK_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("ADDRESS_BOOK_LOG_FILE", os.path.join(directory, "bench.log"))
+
+    import numpy as np
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy.orm import sessionmaker
+
+    from app import metrics
+    from app.database import SQLALCHEMY_DATABASE_URL, create_db_engine, get_engine
+    from app.routers import address
+    from benchmarks import dataset
+
+    dataset.populate(get_engine(), args.rows)
+    routes = [
+        ("GET /addresses/{address_id}", lambda client, i: client.get(f"/addresses/{i % args.rows + 1}")),
+        ("GET /addresses/?limit=10", lambda client, i: client.get("/addresses/?limit=10")),
+        ("GET /addresses/within_distance/", lambda client, i: client.get(
+            "/addresses/within_distance/?latitude=10&longitude=20&distance_km=50")),
+    ]
+
+    def build_app(instrumented):
+        db_engine = create_db_engine(SQLALCHEMY_DATABASE_URL, read_only=True)
+        if instrumented:
+            metrics.instrument_engine(db_engine, "bench")
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+        def get_db():
+            db = session_factory()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        app = FastAPI()
+        if instrumented:
+            app.add_middleware(metrics.MetricsMiddleware)
+        app.include_router(address.router)
+        app.dependency_overrides[address.get_db] = get_db
+        app.dependency_overrides[address.get_read_db] = get_db
+        return TestClient(app)
+
+    plain, instrumented = build_app(False), build_app(True)
+    print(f"{'route':34s} {'p50 off':>9s} {'p50 on':>9s} {'overhead':>10s}")
+    for name, call in routes:
+        for i in range(50):
+            call(plain, i)
+            call(instrumented, i)
+        latencies = np.empty((2, args.iterations))
+        for i in range(args.iterations):
+            for j, client in enumerate((plain, instrumented)):
+                start = time.perf_counter()
+                call(client, i)
+                latencies[j, i] = time.perf_counter() - start
+        off, on = np.median(latencies, axis=1) * 1000
+        print(f"{name:34s} {off:8.3f}ms {on:8.3f}ms {(on - off) * 1000:7.1f} us ({(on / off - 1) * 100:+.1f}%)")
+
+    histogram = metrics.Histogram("bench_seconds", "Benchmark.", ("method", "route"))
+    start = time.perf_counter()
+    for i in range(100000):
+        histogram.observe(0.003, ("GET", "/addresses/{address_id}"))
+    print(f"Histogram.observe: {(time.perf_counter() - start) / 100000 * 1e9:.0f} ns per call")
+
+
+if __name__ == "__main__":
+    main()
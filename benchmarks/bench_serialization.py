@@ -0,0 +1,80 @@
+"""Per-row cost of building and encoding a large address list response.
+
+Compares the previous read path (Address entities, ``model_validate`` per row, then FastAPI
+validating and serializing the result again against the response model) with the column-row
+path used by the read routes (plain tuples, dicts built once, orjson encoding), and times the
+GET /addresses/ route end to end.
+
+    python -m benchmarks.bench_serialization --rows 10000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["ADDRESS_BOOK_DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ.setdefault("ADDRESS_BOOK_LOG_LEVEL", "WARNING")
+
+    import orjson
+    from fastapi.testclient import TestClient
+    from pydantic import TypeAdapter
+    from sqlalchemy import select
+    from typing import Any, Dict
+
+    from app import crud, models, schemas
+    from app.database import SessionLocal, get_engine
+    from app.main import app
+    from app.routers.address import _address_dicts
+    from benchmarks import dataset
+
+    dataset.populate(get_engine(), args.rows)
+
+    response_adapter = TypeAdapter(Dict[str, Any])
+
+    def before():
+        with SessionLocal() as db:
+            addresses = db.scalars(select(models.Address).order_by(models.Address.id).limit(args.rows)).all()
+            response = {"addresses": [schemas.Address.model_validate(address) for address in addresses]}
+            response_adapter.dump_json(response_adapter.validate_python(response))
+
+    def after():
+        with SessionLocal() as db:
+            rows = crud.get_addresses(db, page=1, page_size=args.rows)
+            orjson.dumps({"addresses": _address_dicts(rows)})
+
+    client = TestClient(app)
+
+    def route():
+        response = client.get(f"/addresses/?page_size={args.rows}")
+        assert len(response.json()["addresses"]) == args.rows
+
+    for name, fn in (("entities + model_validate + response_model", before),
+                     ("column rows + orjson", after),
+                     ("GET /addresses/ end to end", route)):
+        seconds = _timed(fn, args.repeat)
+        print(f"{name:45s} {seconds * 1000:9.1f} ms  {seconds / args.rows * 1e6:7.2f} us/row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Cold start of a worker: importing app.main, then running the lifespan startup.
+
+Each sample runs in a fresh interpreter, as a new worker would, against a database that is
+already migrated, so the schema check only compares revisions. The script reports the median
+import time, the median startup time and the per-phase timings from app/startup.py.
+
+    python -m benchmarks.bench_startup --repeat 5 --rows 100000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+
+_SAMPLE = """
+import json, time
+start = time.perf_counter()
+from app import startup
+from app.main import app
+imported = time.perf_counter() - start
+startup.startup()
+print(json.dumps({"import": imported * 1000, **startup.report()}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--spatial-index", action="store_true", help="Also load the spatial index at startup")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ,
+               ADDRESS_BOOK_DATABASE_URL=f"sqlite:///{os.path.join(directory, 'bench.db')}",
+               ADDRESS_BOOK_SPATIAL_INDEX="1" if args.spatial_index else "0",
+               ADDRESS_BOOK_LOG_LEVEL=os.environ.get("ADDRESS_BOOK_LOG_LEVEL", "WARNING"),
+               ADDRESS_BOOK_LOG_FILE=os.path.join(directory, "bench.log"))
+
+    # Migrate the empty database once, then fill it; samples then find it at the head revision
+    setup = ("from app import database\n"
+             "from benchmarks import dataset\n"
+             "database.check_schema('upgrade')\n"
+             f"dataset.populate(database.get_engine(), {args.rows})\n")
+    subprocess.run([sys.executable, "-c", setup], cwd=ROOT, env=env, check=True)
+
+    samples = []
+    for _ in range(args.repeat):
+        output = subprocess.run([sys.executable, "-c", _SAMPLE], cwd=ROOT, env=env, check=True,
+                                capture_output=True, text=True).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+
+    for phase in samples[0]:
+        print(f"{phase:15s} {statistics.median(sample[phase] for sample in samples):9.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Throughput and latency of single-address writes with and without the write coalescer.
+
+At each concurrency level, that many threads create and update addresses as fast as they can,
+first each on its own session (one transaction and commit per write, queued on the single write
+connection), then through app/write_coalescer.py (one transaction per group of writes). The
+script reports writes per second, mean, median and p99 latency, and the mean writes per commit.
+
+    python -m benchmarks.bench_write_coalescing --rows 10000 --writes 2000 --concurrency 1,4,16,64
+    python -m benchmarks.bench_write_coalescing --synchronous FULL --window-ms 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--writes", type=int, default=2000, help="Writes per concurrency level and mode")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--synchronous", default=os.environ.get("ADDRESS_BOOK_SQLITE_SYNCHRONOUS", "NORMAL"))
+    parser.add_argument("--window-ms", type=float, default=None, help="Coalescing window (default: ADDRESS_BOOK_WRITE_COALESCE_WINDOW_MS)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ["ADDRESS_BOOK_DATABASE_URL"] = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+    os.environ["ADDRESS_BOOK_SQLITE_SYNCHRONOUS"] = args.synchronous
+    os.environ["ADDRESS_BOOK_METRICS"] = "0"
+    os.environ.setdefault("ADDRESS_BOOK_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("ADDRESS_BOOK_LOG_FILE", os.path.join(directory, "bench.log"))
+
+    import numpy as np
+
+    from app import config, crud, metrics, schemas
+    from app.database import SessionLocal, get_engine
+    from app.write_coalescer import WriteCoalescer
+    from benchmarks import dataset
+
+    if args.window_ms is not None:
+        config.WRITE_COALESCE_WINDOW_MS = args.window_ms
+    dataset.populate(get_engine(), args.rows)
+    counter = iter(range(10 ** 9))
+
+    def next_write():
+        # Three creates for every update of an existing address
+        i = next(counter)
+        address = schemas.AddressCreate(name=f"Bench {i}", latitude=(i % 1800) / 10 - 90, longitude=(i % 3600) / 10 - 180)
+        if i % 4 == 3:
+            return ("update", i % args.rows + 1, address)
+        return ("create", address)
+
+    def direct(write):
+        db = SessionLocal()
+        try:
+            if write[0] == "create":
+                crud.create_address(db, *write[1:])
+            else:
+                crud.update_address(db, *write[1:])
+        finally:
+            db.close()
+
+    def run(apply, concurrency):
+        latencies = np.empty(args.writes)
+        writes_per_thread = args.writes // concurrency
+        barrier = threading.Barrier(concurrency + 1)
+
+        def worker(offset):
+            writes = [next_write() for _ in range(writes_per_thread)]
+            barrier.wait()
+            for i, write in enumerate(writes):
+                start = time.perf_counter()
+                apply(write)
+                latencies[offset + i] = time.perf_counter() - start
+
+        threads = [threading.Thread(target=worker, args=(n * writes_per_thread,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done = latencies[:writes_per_thread * concurrency] * 1000
+        return done.size / elapsed, done.mean(), np.percentile(done, 50), np.percentile(done, 99)
+
+    print(f"synchronous={args.synchronous}, window={config.WRITE_COALESCE_WINDOW_MS} ms, {args.writes} writes per row")
+    print(f"{'threads':>7s} {'mode':10s} {'writes/s':>10s} {'mean ms':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'per commit':>10s}")
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        coalescer = WriteCoalescer()
+        for mode, apply in (("direct", direct), ("coalesced", lambda write: coalescer.write(*write))):
+            commits = metrics.db_write_batch_size.count()
+            throughput, mean, p50, p99 = run(apply, concurrency)
+            commits = metrics.db_write_batch_size.count() - commits
+            per_commit = f"{args.writes // concurrency * concurrency / commits:10.1f}" if commits else f"{1:10.1f}"
+            print(f"{concurrency:7d} {mode:10s} {throughput:10.1f} {mean:8.3f} {p50:8.3f} {p99:8.3f} {per_commit}")
+        coalescer.stop()
+
+
+if __name__ == "__main__":
+    main()
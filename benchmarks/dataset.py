@@ -0,0 +1,60 @@
+"""Reproducible synthetic address datasets for the benchmarks."""
+import numpy as np
+from sqlalchemy import insert
+
+from app import clusters, geo, models
+
+DISTRIBUTIONS = ("uniform", "clustered")
+
+# (latitude, longitude) of the cities the clustered distribution draws around
+CITIES = (
+    (35.68, 139.69), (28.61, 77.21), (31.23, 121.47), (-23.55, -46.63), (19.43, -99.13),
+    (30.04, 31.24), (19.08, 72.88), (39.90, 116.40), (23.81, 90.41), (34.69, 135.50),
+    (40.71, -74.01), (24.86, 67.01), (-34.60, -58.38), (41.01, 28.98), (22.57, 88.36),
+    (14.60, 120.98), (6.52, 3.38), (-22.91, -43.17), (55.76, 37.62), (48.86, 2.35),
+    (51.51, -0.13), (-6.21, 106.85), (37.57, 126.98), (34.05, -118.24), (13.76, 100.50),
+    (-33.87, 151.21), (1.35, 103.82), (52.52, 13.40), (-1.29, 36.82), (64.15, -21.94),
+)
+# Standard deviation of the scatter around a city centre, in degrees (roughly 20 km)
+CITY_SPREAD_DEGREES = 0.2
+
+
+def generate(rows: int, distribution: str = "uniform", seed: int = 0):
+    """Return ``(latitudes, longitudes)`` arrays of ``rows`` points; the same arguments give the same points.
+
+    ``uniform`` spreads points evenly over the sphere. ``clustered`` places them around
+    :data:`CITIES` with Zipf-like city sizes, so a few cities are very dense.
+    """
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    rng = np.random.default_rng(seed)
+    if distribution == "uniform":
+        latitudes = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, rows)))
+        longitudes = rng.uniform(-180.0, 180.0, rows)
+    else:
+        weights = 1.0 / np.arange(1, len(CITIES) + 1)
+        city = rng.choice(len(CITIES), size=rows, p=weights / weights.sum())
+        centres = np.array(CITIES)[city]
+        latitudes = np.clip(centres[:, 0] + rng.normal(0.0, CITY_SPREAD_DEGREES, rows), -90.0, 90.0)
+        longitudes = (centres[:, 1] + rng.normal(0.0, CITY_SPREAD_DEGREES, rows) + 180.0) % 360.0 - 180.0
+    return latitudes, longitudes
+
+
+def populate(engine, rows: int, distribution: str = "uniform", seed: int = 0, chunk_size: int = 50000):
+    """Create the schema on ``engine`` and insert a generated dataset, one transaction per chunk."""
+    models.Base.metadata.create_all(bind=engine)
+    latitudes, longitudes = generate(rows, distribution, seed)
+    table = models.Address.__table__
+    for start in range(0, rows, chunk_size):
+        batch = [
+            {"name": f"Address {i}", "latitude": latitude, "longitude": longitude,
+             "geohash": geo.encode_geohash(latitude, longitude)}
+            for i, latitude, longitude in zip(range(start, start + chunk_size),
+                                              latitudes[start:start + chunk_size].tolist(),
+                                              longitudes[start:start + chunk_size].tolist())
+        ]
+        with engine.begin() as conn:
+            conn.execute(insert(table), batch)
+    with engine.begin() as conn:
+        clusters.rebuild(conn)
+    return latitudes, longitudes
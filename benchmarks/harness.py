@@ -0,0 +1,62 @@
+"""Timing, percentile reporting and baseline comparison for the benchmarks."""
+import json
+import time
+
+import numpy as np
+
+METRICS = ("p50", "p95", "p99")
+
+
+def measure(fn, iterations: int, warmup: int = 2):
+    """Call ``fn`` ``warmup + iterations`` times and summarize the timed calls.
+
+    ``fn`` receives the iteration number. Latencies are reported in milliseconds and
+    throughput in calls per second.
+    """
+    for i in range(warmup):
+        fn(i)
+    latencies = np.empty(iterations)
+    start = time.perf_counter()
+    for i in range(iterations):
+        call_start = time.perf_counter()
+        fn(warmup + i)
+        latencies[i] = time.perf_counter() - call_start
+    elapsed = time.perf_counter() - start
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {"iterations": iterations, "p50": float(p50), "p95": float(p95), "p99": float(p99),
+            "throughput": iterations / elapsed if elapsed else float("inf")}
+
+
+def format_table(results) -> str:
+    width = max([len(name) for name in results] + [9])
+    lines = [f"{'benchmark':{width}s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'ops/s':>10s}"]
+    for name, result in results.items():
+        lines.append(f"{name:{width}s} {result['p50']:9.3f} {result['p95']:9.3f} {result['p99']:9.3f} "
+                     f"{result['throughput']:10.1f}")
+    return "\n".join(lines)
+
+
+def load_baseline(path: str):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results, metadata=None):
+    with open(path, "w") as f:
+        json.dump({"metadata": metadata or {}, "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def find_regressions(results, baseline, threshold: float = 0.2, metric: str = "p95"):
+    """Benchmarks whose ``metric`` latency grew by more than ``threshold`` (a fraction) over the baseline.
+
+    Returns ``(name, baseline_ms, current_ms)`` tuples. Benchmarks missing from either side are ignored.
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    regressions = []
+    for name, previous in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is not None and current[metric] > previous[metric] * (1 + threshold):
+            regressions.append((name, previous[metric], current[metric]))
+    return regressions
@@ -0,0 +1,294 @@
+"""Time every crud function and every /addresses route against a generated dataset.
+
+    python -m benchmarks.run --rows 100000 --distribution clustered
+    python -m benchmarks.run --rows 100000 --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --rows 100000 --baseline benchmarks/baseline.json --threshold 0.25
+
+The dataset is written to a temporary SQLite database (or to --db, which is reused when it
+already exists). Exits with status 1 when a benchmark regresses beyond the threshold.
+"""
+import argparse
+import os
+import platform
+import re
+import sys
+import tempfile
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Address book benchmarks")
+    parser.add_argument("--rows", type=int, default=10000, help="addresses in the dataset (10k to 5M)")
+    parser.add_argument("--distribution", choices=("uniform", "clustered"), default="uniform")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="SQLite file to use; populated only if it does not exist yet")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per benchmark")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--radius-km", type=float, default=10.0, help="radius of the within_distance queries")
+    parser.add_argument("--spatial-index", action="store_true", help="answer proximity queries from the in-memory index")
+    parser.add_argument("--only", help="regular expression selecting the benchmarks to run")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="baseline JSON file to compare against")
+    parser.add_argument("--save-baseline", help="write the results to this baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown as a fraction, e.g. 0.2 for 20%%")
+    parser.add_argument("--metric", choices=("p50", "p95", "p99"), default="p95", help="latency compared with the baseline")
+    return parser.parse_args(argv)
+
+
+def _configure_environment(args):
+    # The app reads its settings at import time, so these must be set before importing it
+    directory = tempfile.mkdtemp(prefix="address-book-bench-")
+    db_path = args.db or os.path.join(directory, "bench.db")
+    os.environ["ADDRESS_BOOK_DATABASE_URL"] = f"sqlite:///{os.path.abspath(db_path)}"
+    os.environ["ADDRESS_BOOK_SPATIAL_INDEX"] = "1" if args.spatial_index else "0"
+    os.environ.setdefault("ADDRESS_BOOK_LOG_LEVEL", "WARNING")
+    os.environ.setdefault("ADDRESS_BOOK_LOG_FILE", os.path.join(directory, "bench.log"))
+    return db_path
+
+
+def diamond(min_lat, min_lon, max_lat, max_lon):
+    """GeoJSON polygon coordinates of the diamond inscribed in the box."""
+    mid_lat, mid_lon = (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+    return [[[min_lon, mid_lat], [mid_lon, min_lat], [max_lon, mid_lat], [mid_lon, max_lat], [min_lon, mid_lat]]]
+
+
+def _crud_benchmarks(args, dataset, rng):
+    from app import crud, duplicates, geo, schemas
+    from app.database import ReadSessionLocal, SessionLocal
+
+    latitudes, longitudes = dataset
+    created = []
+    bulk_created = []
+
+    def point(i):
+        j = rng.integers(len(latitudes))
+        return float(latitudes[j]), float(longitudes[j])
+
+    def random_id(i):
+        return int(rng.integers(1, args.rows + 1))
+
+    def viewport(i):
+        # A map viewport of 8.4 x 4.8 degrees around a random address (zoom 8), in cells of 32 px (zoom 11)
+        latitude, longitude = point(i)
+        return max(longitude - 4.2, -180.0), max(latitude - 2.4, -85.0), min(longitude + 4.2, 180.0), min(latitude + 2.4, 85.0)
+
+    def box(i):
+        # (min_lat, min_lon, max_lat, max_lon) of a square of about --radius-km around a random address
+        latitude, longitude = point(i)
+        delta = args.radius_km / 111.0
+        return latitude - delta, longitude - delta, latitude + delta, longitude + delta
+
+    def read(fn):
+        def call(i):
+            with ReadSessionLocal() as db:
+                result = fn(db, i)
+                if hasattr(result, "__next__"):
+                    for _ in result:
+                        pass
+        return call
+
+    def write(fn):
+        def call(i):
+            with SessionLocal() as db:
+                fn(db, i)
+        return call
+
+    def create(db, i):
+        latitude, longitude = point(i)
+        created.append(crud.create_address(db, schemas.AddressCreate(name=f"Bench {i}", latitude=latitude, longitude=longitude)).id)
+
+    def update(db, i):
+        latitude, longitude = point(i)
+        crud.update_address(db, created[i % len(created)], schemas.AddressCreate(name=f"Bench {i} updated", latitude=latitude, longitude=longitude))
+
+    def create_bulk(db, i):
+        rows = [schemas.AddressCreate(name=f"Bulk {i}-{j}", latitude=latitude, longitude=longitude)
+                for j, (latitude, longitude) in enumerate(point(j) for j in range(1000))]
+        bulk_created.extend(address_id for address_id in crud.create_addresses_bulk(db, rows) if address_id is not None)
+
+    return [
+        ("crud.get_address", read(lambda db, i: crud.get_address(db, random_id(i))), args.iterations),
+        ("crud.get_address_payload", read(lambda db, i: crud.get_address_payload(db, random_id(i))), args.iterations),
+        ("crud.get_addresses", read(lambda db, i: crud.get_addresses(db, page=int(rng.integers(1, 101)), page_size=100)), args.iterations),
+        ("crud.get_addresses_after", read(lambda db, i: crud.get_addresses_after(db, after_id=random_id(i), limit=100)), args.iterations),
+        ("crud.get_addresses_batch", read(lambda db, i: crud.get_addresses_batch(db, [random_id(i) for _ in range(100)])), args.iterations),
+        ("crud.count_addresses", read(lambda db, i: crud.count_addresses(db)), args.iterations),
+        ("crud.get_changes", read(lambda db, i: crud.get_changes(db, since=random_id(i), limit=100)), args.iterations),
+        ("crud.iter_address_rows", read(lambda db, i: crud.iter_address_rows(db)), max(3, args.iterations // 10)),
+        ("duplicates.iter_duplicate_events", read(lambda db, i: duplicates.iter_duplicate_events(db, 25, 0.9)), 3),
+        # Dataset names are "Address <n>" and the last word matches as a prefix, so every query finds names
+        ("crud.search_addresses", read(lambda db, i: crud.search_addresses(db, f"address {random_id(i)}")), args.iterations),
+        ("crud.get_addresses_within_distance", read(lambda db, i: crud.get_addresses_within_distance(db, *point(i), args.radius_km)), args.iterations),
+        ("crud.get_addresses_within_distance[fast]", read(lambda db, i: crud.get_addresses_within_distance(db, *point(i), args.radius_km, accuracy="fast")), args.iterations),
+        ("crud.get_addresses_within_distance x100", read(lambda db, i: [crud.get_addresses_within_distance(db, *point(i), args.radius_km)
+                                                                        for _ in range(100)]), max(3, args.iterations // 10)),
+        ("crud.get_addresses_within_distance_batch[100]", read(lambda db, i: crud.get_addresses_within_distance_batch(
+            db, [point(i) + (args.radius_km,) for _ in range(100)])), max(3, args.iterations // 10)),
+        ("crud.get_nearest_addresses", read(lambda db, i: crud.get_nearest_addresses(db, *point(i), 10)), args.iterations),
+        ("crud.get_address_clusters", read(lambda db, i: crud.get_address_clusters(db, *viewport(i), 11)), args.iterations),
+        ("crud.iter_addresses_in_bbox", read(lambda db, i: crud.iter_addresses_in_bbox(db, *box(i))), args.iterations),
+        ("crud.iter_addresses_in_polygon", read(lambda db, i: crud.iter_addresses_in_polygon(
+            db, [geo.polygon_rings(diamond(*box(i)))])), args.iterations),
+        ("crud.create_address", write(create), args.iterations),
+        ("crud.update_address", write(update), args.iterations),
+        ("crud.upsert_address", write(lambda db, i: crud.upsert_address(db, schemas.AddressCreate(
+            name=f"Bench upsert {i // 2}", latitude=1.0, longitude=2.0))), args.iterations),
+        ("crud.delete_address", write(lambda db, i: crud.delete_address(db, created.pop())), args.iterations),
+        ("crud.create_addresses_bulk", write(create_bulk), max(3, args.iterations // 10)),
+        ("crud.update_addresses_batch", write(lambda db, i: crud.update_addresses_batch(
+            db, [schemas.AddressPatch(id=random_id(i), name=f"Patched {i}-{j}") for j in range(100)])), args.iterations),
+        ("crud.delete_addresses_batch", write(lambda db, i: crud.delete_addresses_batch(
+            db, [bulk_created.pop() for _ in range(min(100, len(bulk_created)))])), max(3, args.iterations // 10)),
+    ]
+
+
+def _route_benchmarks(args, client, dataset, rng):
+    latitudes, longitudes = dataset
+    created = []
+    cursor = {"after": None}
+
+    def point():
+        j = rng.integers(len(latitudes))
+        return float(latitudes[j]), float(longitudes[j])
+
+    def random_id():
+        return int(rng.integers(1, args.rows + 1))
+
+    def check(response, *statuses):
+        if response.status_code not in (statuses or (200,)):
+            raise RuntimeError(f"{response.request.method} {response.request.url} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    def create(i):
+        latitude, longitude = point()
+        created.append(check(client.post("/addresses/", json={"name": f"Route {i}", "latitude": latitude, "longitude": longitude})).json()["id"])
+
+    def update(i):
+        latitude, longitude = point()
+        check(client.put(f"/addresses/{created[i % len(created)]}", json={"name": f"Route {i} updated", "latitude": latitude, "longitude": longitude}))
+
+    upserted = []
+
+    def upsert(i):
+        # Odd calls repeat the previous body, so half of them find the existing address
+        if i % 2 == 0 or not upserted:
+            latitude, longitude = point()
+            upserted[:] = [{"name": f"Route upsert {i}", "latitude": latitude, "longitude": longitude}]
+        check(client.put("/addresses/", json=upserted[0]), 200, 201)
+
+    def bulk(i):
+        body = "".join(f'{{"name": "Route bulk {i}-{j}", "latitude": {lat}, "longitude": {lon}}}\n'
+                       for j, (lat, lon) in enumerate(point() for _ in range(1000)))
+        check(client.post("/addresses/bulk?format=ndjson", content=body.encode()))
+
+    def page_by_cursor(i):
+        params = {"limit": 100} if cursor["after"] is None else {"limit": 100, "after": cursor["after"]}
+        cursor["after"] = check(client.get("/addresses/", params=params)).json()["next_cursor"]
+
+    def within_distance(i):
+        latitude, longitude = point()
+        check(client.get("/addresses/within_distance/", params={"latitude": latitude, "longitude": longitude, "distance_km": args.radius_km}))
+
+    def nearest(i):
+        latitude, longitude = point()
+        check(client.get("/addresses/nearest/", params={"latitude": latitude, "longitude": longitude, "k": 10}))
+
+    def in_bbox(i):
+        latitude, longitude = point()
+        delta = args.radius_km / 111.0
+        check(client.get("/addresses/in_bbox", params={"min_lat": latitude - delta, "min_lon": longitude - delta,
+                                                       "max_lat": latitude + delta, "max_lon": longitude + delta}))
+
+    def in_polygon(i):
+        latitude, longitude = point()
+        delta = args.radius_km / 111.0
+        coordinates = diamond(latitude - delta, longitude - delta, latitude + delta, longitude + delta)
+        check(client.post("/addresses/in_polygon", json={"type": "Polygon", "coordinates": coordinates}))
+
+    def address_clusters(i):
+        latitude, longitude = point()
+        bbox = f"{max(longitude - 4.2, -180.0)},{max(latitude - 2.4, -85.0)},{min(longitude + 4.2, 180.0)},{min(latitude + 2.4, 85.0)}"
+        check(client.get("/addresses/clusters", params={"bbox": bbox, "zoom": 11}))
+
+    return [
+        ("GET /addresses/{address_id}", lambda i: check(client.get(f"/addresses/{random_id()}"), 200, 404), args.iterations),
+        ("GET /addresses/?page", lambda i: check(client.get("/addresses/", params={"page": int(rng.integers(1, 101)), "page_size": 100})), args.iterations),
+        ("GET /addresses/?after", page_by_cursor, args.iterations),
+        ("GET /addresses/changes", lambda i: check(client.get("/addresses/changes", params={"since": random_id(), "limit": 100})), args.iterations),
+        ("GET /addresses/search", lambda i: check(client.get("/addresses/search", params={"q": f"address {random_id()}"})), args.iterations),
+        ("GET /addresses/within_distance/", within_distance, args.iterations),
+        ("POST /addresses/within_distance/batch[100]", lambda i: check(client.post("/addresses/within_distance/batch", json={
+            "queries": [dict(zip(("latitude", "longitude", "distance_km"), point() + (args.radius_km,))) for _ in range(100)]})),
+         max(3, args.iterations // 10)),
+        ("GET /addresses/nearest/", nearest, args.iterations),
+        ("GET /addresses/clusters", address_clusters, args.iterations),
+        ("GET /addresses/in_bbox", in_bbox, args.iterations),
+        ("POST /addresses/in_polygon", in_polygon, args.iterations),
+        ("GET /addresses/export", lambda i: check(client.get("/addresses/export")), max(3, args.iterations // 10)),
+        ("GET /addresses/duplicates", lambda i: check(client.get("/addresses/duplicates", params={"radius_m": 25})), 3),
+        ("POST /addresses/batch/get", lambda i: check(client.post("/addresses/batch/get", json={"ids": [random_id() for _ in range(100)]})), args.iterations),
+        ("POST /addresses/", create, args.iterations),
+        ("PUT /addresses/{address_id}", update, args.iterations),
+        ("PUT /addresses/", upsert, args.iterations),
+        ("DELETE /addresses/{address_id}", lambda i: check(client.delete(f"/addresses/{created.pop()}")), args.iterations),
+        ("POST /addresses/bulk", bulk, max(3, args.iterations // 10)),
+        ("PATCH /addresses/batch", lambda i: check(client.patch("/addresses/batch", json={"items": [
+            {"id": random_id(), "name": f"Route patched {i}-{j}"} for j in range(100)]})), args.iterations),
+        ("POST /addresses/batch/delete", lambda i: check(client.post("/addresses/batch/delete", json={"ids": [random_id() for _ in range(100)]})), max(3, args.iterations // 10)),
+    ]
+
+
+def main(argv=None):
+    args = _parse_args(argv)
+    db_path = _configure_environment(args)
+
+    import numpy as np
+    from fastapi.testclient import TestClient
+
+    from app.database import get_engine
+    from app.main import app
+    from benchmarks import dataset, harness
+
+    if args.db and os.path.exists(args.db) and os.path.getsize(args.db) > 0:
+        points = dataset.generate(args.rows, args.distribution, args.seed)
+        print(f"Reusing {db_path}")
+    else:
+        print(f"Generating {args.rows} {args.distribution} addresses in {db_path}")
+        points = dataset.populate(get_engine(), args.rows, args.distribution, args.seed)
+
+    only = re.compile(args.only) if args.only else None
+    results = {}
+    with TestClient(app) as client:
+        rng = np.random.default_rng(args.seed)
+        benchmarks = _crud_benchmarks(args, points, rng) + _route_benchmarks(args, client, points, rng)
+        for name, fn, iterations in benchmarks:
+            if only is not None and not only.search(name):
+                continue
+            results[name] = harness.measure(fn, iterations, warmup=args.warmup)
+            print(f"  {name}: p50 {results[name]['p50']:.3f} ms", file=sys.stderr)
+
+    print(harness.format_table(results))
+    metadata = {"rows": args.rows, "distribution": args.distribution, "seed": args.seed,
+                "spatial_index": args.spatial_index, "python": platform.python_version(), "machine": platform.machine()}
+    if args.output:
+        harness.save_baseline(args.output, results, metadata)
+    if args.save_baseline:
+        harness.save_baseline(args.save_baseline, results, metadata)
+        print(f"Baseline written to {args.save_baseline}")
+    if args.baseline:
+        baseline = harness.load_baseline(args.baseline)
+        mismatched = {key: value for key, value in baseline.get("metadata", {}).items()
+                      if key in ("rows", "distribution", "seed", "spatial_index") and metadata[key] != value}
+        if mismatched:
+            print(f"Warning: baseline was recorded with different settings: {mismatched}", file=sys.stderr)
+        regressions = harness.find_regressions(results, baseline, args.threshold, args.metric)
+        for name, previous, current in regressions:
+            print(f"REGRESSION {name}: {args.metric} {previous:.3f} ms -> {current:.3f} ms "
+                  f"({(current / previous - 1) * 100:+.0f}%, threshold {args.threshold * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold * 100:.0f}% on {args.metric}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.cache import address_cache
+from app.database import Base
+from app.routers import address, address_async
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine("sqlite+aiosqlite:///./test.db")
+TestingAsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+
+async def override_get_async_db():
+    async with TestingAsyncSessionLocal() as db:
+        yield db
+
+app = FastAPI()
+app.include_router(address_async.with_async_routes(address.router))
+app.dependency_overrides[address_async.get_async_db] = override_get_async_db
+
+client = TestClient(app)
+
+@pytest.fixture(scope="function", autouse=True)
+def setup_and_teardown():
+    address_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+def test_async_routes_replace_sync_routes_in_place():
+    routes = address_async.with_async_routes(address.router).routes
+    paths = [(route.path, route.endpoint.__module__) for route in routes]
+    assert ("/addresses/{address_id}", "app.routers.address_async") in paths
+    assert ("/addresses/export", "app.routers.address") in paths
+    assert paths.index(("/addresses/export", "app.routers.address")) < paths.index(("/addresses/{address_id}", "app.routers.address_async"))
+
+def test_async_crud_round_trip():
+    response = client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    assert response.status_code == 200
+    address_id = response.json()["id"]
+    assert client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).status_code == 400
+
+    response = client.put(f"/addresses/{address_id}", json={"name": "Updated", "latitude": 10.01, "longitude": 20.0})
+    assert response.json()["name"] == "Updated"
+    assert client.get(f"/addresses/{address_id}").json()["latitude"] == 10.01
+
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=15")
+    assert [address["name"] for address in response.json()] == ["Updated"]
+    response = client.get("/addresses/nearest/?latitude=10.0&longitude=20.0&k=2")
+    assert [address["name"] for address in response.json()] == ["Updated", "Test Address 3"]
+    assert client.get("/addresses/?limit=1").json()["next_cursor"] is not None
+
+    assert client.put(f"/addresses/{address_id}", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0}).status_code == 400
+    assert client.put("/addresses/999999", json={"name": "Missing", "latitude": 1.0, "longitude": 2.0}).status_code == 404
+
+    assert client.delete(f"/addresses/{address_id}").status_code == 200
+    assert client.get(f"/addresses/{address_id}").status_code == 404
+    assert client.get("/addresses/export").text.count("\n") == 1
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from benchmarks import dataset, harness
+
+
+def test_generated_datasets_are_reproducible():
+    first = dataset.generate(1000, "clustered", seed=3)
+    second = dataset.generate(1000, "clustered", seed=3)
+    assert np.array_equal(first[0], second[0]) and np.array_equal(first[1], second[1])
+    latitudes, longitudes = dataset.generate(1000, "uniform", seed=3)
+    assert latitudes.min() >= -90.0 and latitudes.max() <= 90.0
+    assert longitudes.min() >= -180.0 and longitudes.max() < 180.0
+    with pytest.raises(ValueError):
+        dataset.generate(10, "gaussian")
+
+
+def test_clustered_dataset_concentrates_around_cities():
+    latitudes, longitudes = dataset.generate(5000, "clustered", seed=0)
+    tokyo = (np.abs(latitudes - 35.68) < 1.0) & (np.abs(longitudes - 139.69) < 1.0)
+    # The first city has the largest Zipf weight, about a quarter of the points
+    assert 0.15 < tokyo.mean() < 0.35
+
+
+def test_measure_and_find_regressions():
+    calls = []
+    result = harness.measure(calls.append, iterations=20, warmup=3)
+    assert len(calls) == 23
+    assert result["iterations"] == 20
+    assert result["p50"] <= result["p95"] <= result["p99"]
+
+    baseline = {"results": {"fast": {"p50": 1.0, "p95": 2.0, "p99": 3.0}, "gone": {"p50": 1.0, "p95": 1.0, "p99": 1.0}}}
+    assert harness.find_regressions({"fast": {"p50": 1.1, "p95": 2.3, "p99": 3.0}}, baseline, threshold=0.2) == []
+    assert harness.find_regressions({"fast": {"p50": 1.1, "p95": 2.5, "p99": 3.0}}, baseline, threshold=0.2) == [("fast", 2.0, 2.5)]
+    assert harness.find_regressions({"fast": {"p50": 1.3, "p95": 2.0, "p99": 3.0}}, baseline, threshold=0.2, metric="p50") == [("fast", 1.0, 1.3)]
@@ -0,0 +1,53 @@
+import time
+
+from app.cache import TTLCache
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set(1, "a")
+    cache.set(2, "b")
+    assert cache.get(1) == "a"
+    cache.set(3, "c")
+    assert cache.get(2) is None
+    assert cache.get(1) == "a"
+    assert cache.get(3) == "c"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_cache_expires_and_invalidates():
+    cache = TTLCache(maxsize=10, ttl=0.01)
+    cache.set(1, "a")
+    time.sleep(0.02)
+    assert cache.get(1) is None
+    assert cache.stats()["expirations"] == 1
+
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set(1, "a")
+    cache.invalidate(1)
+    assert cache.get(1) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_ttl_cache_disabled_when_size_is_zero():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set(1, "a")
+    assert cache.get(1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_ttl_cache_drops_values_read_before_an_invalidation():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    cache.set(1, "stale", generation)
+    assert cache.get(1) is None
+    cache.set(1, "fresh", cache.generation(1))
+    assert cache.get(1) == "fresh"
+    # Generations of keys forgotten to bound memory stay conservative
+    generation = cache.generation(1)
+    cache.invalidate(1)
+    for key in range(2, 5):
+        cache.invalidate(key)
+    cache.set(1, "stale", generation)
+    assert cache.get(1) is None
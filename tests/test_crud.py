@@ -1,64 +1,307 @@
-import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app import crud, models, schemas
-from app.database import Base
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-
-@pytest.fixture(scope="function")
-def db():
-    # Create all tables
-    Base.metadata.create_all(bind=engine)
-    db = TestingSessionLocal()
-    yield db
-    db.close()
-    # Drop all tables
-    Base.metadata.drop_all(bind=engine)
-
-def test_create_address(db):
-    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
-    address = crud.create_address(db=db, address=address_in)
-    assert address.name == "Test Address"
-    assert address.latitude == 10.0
-    assert address.longitude == 20.0
-
-def test_get_address(db):
-    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
-    address = crud.create_address(db=db, address=address_in)
-    fetched_address = crud.get_address(db=db, address_id=address.id)
-    assert fetched_address
-    assert fetched_address.name == "Test Address"
-
-def test_delete_address(db):
-    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
-    address = crud.create_address(db=db, address=address_in)
-    crud.delete_address(db=db, address_id=address.id)
-    deleted_address = crud.get_address(db=db, address_id=address.id)
-    assert deleted_address is None
-
-def test_update_address(db):
-    # Create an address
-    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
-    address = crud.create_address(db=db, address=address_in)
-    
-    # Update the address
-    address_update = schemas.AddressCreate(name="Updated Address", latitude=15.0, longitude=25.0)
-    updated_address = crud.update_address(db=db, address_id=address.id, address=address_update)
-    
-    # Verify the update
-    assert updated_address.name == "Updated Address"
-    assert updated_address.latitude == 15.0
-    assert updated_address.longitude == 25.0
-    
-    # Fetch the updated address and verify
-    fetched_address = crud.get_address(db=db, address_id=address.id)
-    assert fetched_address
-    assert fetched_address.name == "Updated Address"
-    assert fetched_address.latitude == 15.0
-    assert fetched_address.longitude == 25.0
+import pytest
+import random
+from geopy.distance import geodesic
+from sqlalchemy import create_engine, delete, select
+from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException
+from app import clusters, config, crud, distance, geo, metrics, models, schemas
+from app.cache import address_cache
+from app.database import Base
+from app.spatial_index import index as spatial_index
+from app.write_coalescer import WriteCoalescer
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+@pytest.fixture(scope="function")
+def db():
+    # Create all tables from the current models
+    address_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = TestingSessionLocal()
+    yield db
+    db.close()
+    # Drop all tables
+    Base.metadata.drop_all(bind=engine)
+
+def test_create_address(db):
+    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
+    address = crud.create_address(db=db, address=address_in)
+    assert address.name == "Test Address"
+    assert address.latitude == 10.0
+    assert address.longitude == 20.0
+
+def test_get_address(db):
+    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
+    address = crud.create_address(db=db, address=address_in)
+    fetched_address = crud.get_address(db=db, address_id=address.id)
+    assert fetched_address
+    assert fetched_address.name == "Test Address"
+
+def test_get_address_payload_does_not_cache_a_row_updated_while_reading(db, monkeypatch):
+    address = crud.create_address(db=db, address=schemas.AddressCreate(name="Before", latitude=10.0, longitude=20.0))
+    execute = db.execute
+
+    def execute_then_update(*args, **kwargs):
+        # The update commits between the SELECT and the cache fill
+        result = execute(*args, **kwargs)
+        writer = TestingSessionLocal()
+        try:
+            crud.update_address(db=writer, address_id=address.id,
+                                address=schemas.AddressCreate(name="After", latitude=10.0, longitude=20.0))
+        finally:
+            writer.close()
+        return result
+
+    monkeypatch.setattr(db, "execute", execute_then_update)
+    assert crud.get_address_payload(db, address.id)[0]["name"] == "Before"
+    monkeypatch.undo()
+    assert crud.get_address_payload(db, address.id)[0]["name"] == "After"
+
+def test_delete_address(db):
+    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
+    address = crud.create_address(db=db, address=address_in)
+    crud.delete_address(db=db, address_id=address.id)
+    deleted_address = crud.get_address(db=db, address_id=address.id)
+    assert deleted_address is None
+
+def test_update_address(db):
+    # Create an address
+    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
+    address = crud.create_address(db=db, address=address_in)
+    
+    # Update the address
+    address_update = schemas.AddressCreate(name="Updated Address", latitude=15.0, longitude=25.0)
+    updated_address = crud.update_address(db=db, address_id=address.id, address=address_update)
+    
+    # Verify the update
+    assert updated_address.name == "Updated Address"
+    assert updated_address.latitude == 15.0
+    assert updated_address.longitude == 25.0
+    
+    # Fetch the updated address and verify
+    fetched_address = crud.get_address(db=db, address_id=address.id)
+    assert fetched_address
+    assert fetched_address.name == "Updated Address"
+    assert fetched_address.latitude == 15.0
+    assert fetched_address.longitude == 25.0
+
+def test_create_address_sets_geohash(db):
+    address_in = schemas.AddressCreate(name="Test Address", latitude=10.0, longitude=20.0)
+    address = crud.create_address(db=db, address=address_in)
+    assert address.geohash == geo.encode_geohash(10.0, 20.0)
+
+def test_get_addresses_within_distance_across_antimeridian(db):
+    crud.create_address(db=db, address=schemas.AddressCreate(name="West", latitude=0.0, longitude=179.99))
+    crud.create_address(db=db, address=schemas.AddressCreate(name="East", latitude=0.0, longitude=-179.99))
+    crud.create_address(db=db, address=schemas.AddressCreate(name="Far", latitude=0.0, longitude=170.0))
+    addresses = crud.get_addresses_within_distance(db, 0.0, 180.0, 5)
+    assert sorted(address.name for address in addresses) == ["East", "West"]
+
+def test_get_addresses_within_distance_uses_spatial_index(db):
+    crud.create_address(db=db, address=schemas.AddressCreate(name="Test Address 1", latitude=10.0, longitude=20.0))
+    spatial_index.load(db)
+    try:
+        crud.create_address(db=db, address=schemas.AddressCreate(name="Test Address 2", latitude=10.05, longitude=20.05))
+        moved = crud.create_address(db=db, address=schemas.AddressCreate(name="Test Address 3", latitude=11.0, longitude=21.0))
+        crud.update_address(db=db, address_id=moved.id, address=schemas.AddressCreate(name="Test Address 3", latitude=10.01, longitude=20.0))
+        crud.delete_address(db=db, address_id=1)
+        assert spatial_index.stats()["size"] == 2
+        addresses = crud.get_addresses_within_distance(db, 10.0, 20.0, 15)
+        assert [address.name for address in addresses] == ["Test Address 2", "Test Address 3"]
+    finally:
+        spatial_index.clear()
+
+def test_get_nearest_addresses_matches_brute_force(db):
+    rng = random.Random(11)
+    for i in range(300):
+        crud.create_address(db=db, address=schemas.AddressCreate(name=f"Address {i}", latitude=rng.uniform(-5, 5), longitude=rng.uniform(-5, 5)))
+    expected = sorted((geodesic((0.5, 0.5), (a.latitude, a.longitude)).km, a.id) for a in db.query(models.Address).all())[:7]
+
+    nearest = crud.get_nearest_addresses(db, 0.5, 0.5, 7)
+    assert [address.id for address, _ in nearest] == [address_id for _, address_id in expected]
+    assert [d for _, d in nearest] == pytest.approx([d for d, _ in expected])
+
+    spatial_index.load(db)
+    try:
+        assert [address.id for address, _ in crud.get_nearest_addresses(db, 0.5, 0.5, 7, accuracy="fast")][:3] == [address_id for _, address_id in expected][:3]
+    finally:
+        spatial_index.clear()
+
+def test_get_nearest_addresses_with_fewer_rows_than_k(db):
+    crud.create_address(db=db, address=schemas.AddressCreate(name="Only", latitude=-40.0, longitude=170.0))
+    nearest = crud.get_nearest_addresses(db, 40.0, -10.0, 5)
+    assert [address.name for address, _ in nearest] == ["Only"]
+
+def test_update_addresses_batch_resolves_conflicts_within_the_batch(db):
+    a, b, c = (crud.create_address(db=db, address=schemas.AddressCreate(name=name, latitude=1.0, longitude=1.0)).id
+               for name in ("A", "B", "C"))
+    items = crud.update_addresses_batch(db, [
+        schemas.AddressPatch(id=a, name="B"),  # B is renamed in the same batch, so the key is free
+        schemas.AddressPatch(id=b, name="D"),
+        schemas.AddressPatch(id=c, name="D"),  # D was claimed first by b
+        schemas.AddressPatch(id=a, name="E"),
+    ])
+    assert [item.status for item in items] == ["ok", "ok", "conflict", "conflict"]
+    names = {address.id: address.name for address in db.query(models.Address).all()}
+    assert names == {a: "B", b: "D", c: "C"}
+    assert db.get(models.Address, a).version == 2
+    assert db.get(models.Address, c).version == 1
+
+def test_update_addresses_batch_swaps_keys(db):
+    a = crud.create_address(db=db, address=schemas.AddressCreate(name="A", latitude=1.0, longitude=1.0)).id
+    b = crud.create_address(db=db, address=schemas.AddressCreate(name="B", latitude=1.0, longitude=1.0)).id
+    items = crud.update_addresses_batch(db, [schemas.AddressPatch(id=a, name="B"), schemas.AddressPatch(id=b, name="A")])
+    assert [item.status for item in items] == ["ok", "ok"]
+    assert {address.id: address.name for address in db.query(models.Address).all()} == {a: "B", b: "A"}
+
+def test_apply_address_writes_matches_single_writes(db):
+    first = schemas.AddressCreate(name="First", latitude=10.0, longitude=20.0)
+    second = schemas.AddressCreate(name="Second", latitude=11.0, longitude=21.0)
+    created, duplicate, upserted, existing, conflict, missing, updated, deleted, gone = crud.apply_address_writes(db, [
+        ("create", first), ("create", first), ("upsert", second), ("upsert", first),
+        ("update", 2, first), ("update", 999, second),
+        ("update", 2, schemas.AddressCreate(name="Moved", latitude=12.0, longitude=22.0)),
+        ("delete", 1), ("delete", 1),
+    ])
+    assert (created.id, created.name) == (1, "First")
+    assert isinstance(duplicate, HTTPException) and duplicate.status_code == 400
+    assert (upserted[0].id, upserted[1]) == (2, True) and existing == (created, False)
+    assert isinstance(conflict, HTTPException) and conflict.status_code == 400
+    assert missing is None and gone is None
+    assert (updated.id, updated.name, updated.version) == (2, "Moved", 2)
+    assert deleted == created
+    assert [(row.id, row.name) for row in crud.get_addresses(db)] == [(2, "Moved")]
+    incremental = _cluster_rows(db)
+    clusters.rebuild(db)
+    assert incremental == _cluster_rows(db)
+
+def _delete_before_lookup(db, monkeypatch, address_id, commit):
+    # Deletes the address just before the second statement, the lookup of the address an upsert
+    # conflicted with, as a concurrent writer could
+    execute = db.execute
+    calls = []
+
+    def execute_after_delete(statement, *args, **kwargs):
+        calls.append(statement)
+        if len(calls) == 2:
+            if commit:
+                db.rollback()
+            execute(delete(models.Address.__table__).where(models.Address.id == address_id))
+            if commit:
+                db.commit()
+        return execute(statement, *args, **kwargs)
+
+    monkeypatch.setattr(db, "execute", execute_after_delete)
+
+def test_upsert_address_inserts_again_when_the_existing_address_is_deleted(db, monkeypatch):
+    address = schemas.AddressCreate(name="Gone", latitude=1.0, longitude=2.0)
+    existing = crud.create_address(db, address)
+    _delete_before_lookup(db, monkeypatch, existing.id, commit=True)
+    row, created = crud.upsert_address(db, address)
+    assert created and row.name == "Gone"
+
+    monkeypatch.undo()
+    _delete_before_lookup(db, monkeypatch, row.id, commit=False)
+    (row, created), = crud.apply_address_writes(db, [("upsert", address)])
+    assert created and row.name == "Gone"
+    monkeypatch.undo()
+    assert [address.id for address in crud.get_addresses(db)] == [row.id]
+
+def test_write_coalescer_applies_concurrent_writes_together(db, monkeypatch):
+    monkeypatch.setattr(config, "WRITE_COALESCE_WINDOW_MS", 200)
+    coalescer = WriteCoalescer(TestingSessionLocal)
+    coalescer._last_batch_size = 7  # as if seven writers were active, so the first write waits for the others
+    batches = metrics.db_write_batch_size.count()
+    try:
+        futures = [coalescer.submit("create", schemas.AddressCreate(name=f"Address {i % 3}", latitude=10.0, longitude=20.0))
+                   for i in range(5)]
+        futures.append(coalescer.submit("delete", 1))
+        assert coalescer.write("update", 2, schemas.AddressCreate(name="Moved", latitude=1.0, longitude=2.0)).name == "Moved"
+    finally:
+        coalescer.stop()
+    assert metrics.db_write_batch_size.count() == batches + 1
+    assert [future.result().id for future in futures[:3]] == [1, 2, 3]
+    for future in futures[3:5]:
+        assert future.exception().status_code == 400
+    assert futures[5].result().name == "Address 0"
+    assert [(row.id, row.name) for row in crud.get_addresses(db)] == [(2, "Moved"), (3, "Address 2")]
+
+def test_write_coalescer_keeps_committed_results_when_the_index_update_fails(db, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("index update failed")
+
+    spatial_index.build([], [], [])
+    monkeypatch.setattr(spatial_index, "add", fail)
+    monkeypatch.setattr(config, "WRITE_COALESCE_WINDOW_MS", 200)
+    coalescer = WriteCoalescer(TestingSessionLocal)
+    coalescer._last_batch_size = 2
+    try:
+        created = coalescer.submit("create", schemas.AddressCreate(name="First", latitude=10.0, longitude=20.0))
+        deleted = coalescer.submit("delete", 1)
+        assert created.result(timeout=5).id == 1
+        assert deleted.result(timeout=5).name == "First"
+    finally:
+        coalescer.stop()
+    # The index may have missed the writes, so queries go back to SQL
+    assert not spatial_index.ready
+    assert crud.get_addresses(db) == []
+
+def _cluster_rows(db):
+    table = models.AddressCluster.__table__
+    return {(row.zoom, row.x, row.y): (row.count, round(row.latitude_sum, 9), round(row.longitude_sum, 9))
+            for row in db.execute(select(table))}
+
+def test_address_clusters_are_maintained_by_writes(db):
+    rng = random.Random(7)
+    points = [(rng.uniform(-60, 60), rng.uniform(-179, 179)) for _ in range(40)]
+    ids = [crud.create_address(db, schemas.AddressCreate(name=f"Address {i}", latitude=lat, longitude=lon)).id
+           for i, (lat, lon) in enumerate(points[:20])]
+    crud.create_addresses_bulk(db, [schemas.AddressCreate(name=f"Bulk {i}", latitude=lat, longitude=lon)
+                                    for i, (lat, lon) in enumerate(points[20:])])
+    crud.update_address(db, ids[0], schemas.AddressCreate(name="Moved", latitude=1.0, longitude=2.0))
+    crud.delete_address(db, ids[1])
+    crud.update_addresses_batch(db, [schemas.AddressPatch(id=ids[2], latitude=-3.0), schemas.AddressPatch(id=ids[3], name="Renamed")])
+    crud.delete_addresses_batch(db, ids[4:8])
+
+    incremental = _cluster_rows(db)
+    clusters.rebuild(db)
+    assert incremental == _cluster_rows(db)
+    assert sum(count for (zoom, _, _), (count, _, _) in incremental.items() if zoom == 0) == 35
+
+    # The whole world at zoom 0 is one cell holding every address
+    ((x, y, count, latitude, longitude),) = crud.get_address_clusters(db, -180, -90, 180, 90, 0)
+    assert (x, y, count) == (0, 0, 35)
+    # A box crossing the antimeridian is split in two tile ranges
+    assert clusters.tile_ranges(170, -10, -170, 10, 2) == [(3, 3, 1, 2), (0, 0, 1, 2)]
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_within_distance_batch_matches_single_queries(db, monkeypatch, use_index):
+    rng = random.Random(7)
+    for i in range(300):
+        crud.create_address(db, schemas.AddressCreate(name=f"Address {i}", latitude=rng.uniform(-3, 3), longitude=(rng.uniform(177, 183) + 180) % 360 - 180))
+    queries = [(rng.uniform(-3, 3), rng.uniform(-180, 180) if i % 5 == 0 else rng.choice([179.5, -179.5]), rng.uniform(10, 200))
+               for i in range(12)]
+    if use_index:
+        spatial_index.load(db)
+        # Split the batch across two worker processes
+        monkeypatch.setattr(config, "PROXIMITY_WORKERS", 2)
+        monkeypatch.setattr(config, "PROXIMITY_PARALLEL_MIN_QUERIES", 2)
+    try:
+        results, (address_ids, distances) = crud.get_addresses_within_distance_batch(db, queries, matrix=True)
+    finally:
+        spatial_index.clear()
+        distance.shutdown_pool()
+    for query, rows in zip(queries, results):
+        assert rows == crud.get_addresses_within_distance(db, *query)
+    assert address_ids.tolist() == sorted({row.id for rows in results for row in rows})
+    assert distances.shape == (len(queries), len(address_ids))
+    i, row = next((i, rows[0]) for i, rows in enumerate(results) if rows)
+    column = address_ids.tolist().index(row.id)
+    assert distances[i, column] == pytest.approx(geodesic(queries[i][:2], (row.latitude, row.longitude)).km)
+
@@ -0,0 +1,72 @@
+import math
+import random
+
+import numpy as np
+import pytest
+from app import distance, duplicates
+from app.duplicates import DuplicateFinder, names_similar, normalize_name
+
+def _near_duplicates(seed=3):
+    # Places entered one to three times with jittered coordinates and name variants, including
+    # points on both sides of the antimeridian and next to the pole
+    rng = random.Random(seed)
+    rows = []
+    for place in range(300):
+        latitude = rng.choice([rng.uniform(-89.0, 89.0), rng.uniform(89.999, 90.0), rng.uniform(50.0, 50.01)])
+        longitude = rng.choice([rng.uniform(-180.0, 180.0), 179.99999, -179.99999, rng.uniform(2.0, 2.01)])
+        name = rng.choice(["Main St 1", "Oak Ave 22", "Café de Flore", "Elm Street 5"])
+        # Up to 30 m apart in each direction
+        scale = 30 / 111195
+        for _ in range(rng.randint(1, 3)):
+            rows.append((len(rows) + 1, rng.choice([name, name.upper(), name + ".", name[:-1], f"Other {len(rows)}"]),
+                         min(90.0, latitude + rng.uniform(-1, 1) * scale),
+                         (longitude + rng.uniform(-1, 1) * scale / max(math.cos(math.radians(latitude)), 1e-3) + 180) % 360 - 180))
+    return sorted(rows, key=lambda row: row[2])
+
+def _brute_force(rows, radius_m, name_similarity):
+    _, _, latitudes, longitudes = (np.array(column) for column in zip(*rows))
+    near = distance.haversine_km(latitudes[:, None], longitudes[:, None], latitudes, longitudes) * 1000 <= radius_m
+    parent = {row[0]: row[0] for row in rows}
+    def find(row_id):
+        while parent[row_id] != row_id:
+            row_id = parent[row_id]
+        return row_id
+    for i, j in zip(*np.nonzero(np.triu(near, 1))):
+        if names_similar(rows[i][1], rows[j][1], name_similarity):
+            parent[find(rows[i][0])] = find(rows[j][0])
+    clusters = {}
+    for row in rows:
+        clusters.setdefault(find(row[0]), []).append(row[0])
+    return sorted(sorted(ids) for ids in clusters.values() if len(ids) > 1)
+
+def test_normalize_name():
+    assert normalize_name("  Café  St.-Louis ") == "cafe st louis"
+    assert names_similar("MAIN ST 1", "main st. 1", 1.0)
+    assert names_similar("Main Street 1", "Main Stret 1", 0.9)
+    assert not names_similar("Main Street 1", "Oak Avenue 22", 0.5)
+
+@pytest.mark.parametrize("radius_m, name_similarity", [(25, 0.9), (25, 1.0), (50, 0.6), (1000, 0.8)])
+def test_duplicate_clusters_match_brute_force(radius_m, name_similarity):
+    rows = _near_duplicates()
+    finder = DuplicateFinder(radius_m, name_similarity)
+    clusters = []
+    for start in range(0, len(rows), 37):
+        clusters.extend(finder.add(rows[start:start + 37]))
+    clusters.extend(finder.finish())
+    assert sorted([row[0] for row in cluster] for cluster in clusters) == _brute_force(rows, radius_m, name_similarity)
+    assert finder.scanned == len(rows)
+    assert finder.clusters == len(clusters)
+
+@pytest.mark.parametrize("name_similarity", [0.9, 1.0])
+def test_names_far_apart_in_the_same_cell_are_not_compared(monkeypatch, name_similarity):
+    compared = []
+    def record(a, b, threshold):
+        compared.append({a, b})
+        return names_similar(a, b, threshold)
+    monkeypatch.setattr(duplicates, "names_similar", record)
+    names = ["Main Street 1", "Oak Avenue 22", "Quay Road 7", "main street 1.", "Pine Hill 5"]
+    rows = [(i + 1, name, 48.0 + i * 1e-6, 2.0) for i, name in enumerate(names)]
+    finder = DuplicateFinder(25, name_similarity)
+    clusters = finder.add(rows) + finder.finish()
+    assert [[row[0] for row in cluster] for cluster in clusters] == [[1, 4]]
+    assert compared == [{"Main Street 1", "main street 1."}]
@@ -0,0 +1,72 @@
+from geopy.distance import geodesic
+import numpy as np
+from app import distance, geo
+
+def test_encode_geohash():
+    assert geo.encode_geohash(57.64911, 10.40744, precision=11) == "u4pruydqqvj"
+    assert geo.encode_geohash(10.0, 20.0, precision=5) == geo.encode_geohash(10.0001, 20.0001, precision=5)
+
+def test_bounding_box_contains_geodesic_circle():
+    for latitude, longitude in [(0.0, 0.0), (45.0, 10.0), (-70.0, 100.0)]:
+        min_lat, max_lat, lon_ranges = geo.bounding_box(latitude, longitude, 50)
+        for bearing in range(0, 360, 15):
+            point = geodesic(kilometers=50).destination((latitude, longitude), bearing)
+            assert min_lat <= point.latitude <= max_lat
+            assert any(min_lon <= point.longitude <= max_lon for min_lon, max_lon in lon_ranges)
+
+def test_bounding_box_splits_at_antimeridian():
+    _, _, lon_ranges = geo.bounding_box(0.0, 179.95, 20)
+    assert len(lon_ranges) == 2
+    assert lon_ranges[0][1] == 180.0
+    assert lon_ranges[1][0] == -180.0
+
+def test_bounding_box_near_pole_covers_all_longitudes():
+    min_lat, max_lat, lon_ranges = geo.bounding_box(89.9, 0.0, 50)
+    assert max_lat == 90.0
+    assert lon_ranges == [(-180.0, 180.0)]
+
+def test_within_distance_mask_matches_geodesic():
+    rng = np.random.default_rng(7)
+    latitudes = 10.0 + rng.uniform(-1.0, 1.0, 2000)
+    longitudes = 20.0 + rng.uniform(-1.0, 1.0, 2000)
+    expected = [geodesic((10.0, 20.0), (lat, lon)).km <= 60 for lat, lon in zip(latitudes, longitudes)]
+    mask = distance.within_distance_mask(10.0, 20.0, latitudes, longitudes, 60, accuracy="exact")
+    assert mask.tolist() == expected
+
+def test_within_distance_mask_fast_uses_haversine():
+    latitudes = np.array([10.0, 10.05, 11.0])
+    longitudes = np.array([20.0, 20.05, 21.0])
+    mask = distance.within_distance_mask(10.0, 20.0, latitudes, longitudes, 15, accuracy="fast")
+    assert mask.tolist() == [True, True, False]
+
+def test_longitude_ranges_split_at_the_antimeridian():
+    assert geo.longitude_ranges(-10.0, 10.0) == [(-10.0, 10.0)]
+    assert geo.longitude_ranges(170.0, -170.0) == [(170.0, 180.0), (-180.0, -170.0)]
+    assert geo.longitude_ranges(170.0, 190.0) == [(170.0, 180.0), (-180.0, -170.0)]
+    assert geo.longitude_ranges(-180.0, 180.0) == [(-180.0, 180.0)]
+
+def test_points_in_polygon_matches_brute_force():
+    rng = np.random.default_rng(3)
+    # A star with a square hole, tested against a per-point ray cast
+    angles = np.linspace(0, 2 * np.pi, 21)[:-1]
+    radii = np.where(np.arange(20) % 2 == 0, 10.0, 4.0)
+    outer = [[r * np.cos(a), r * np.sin(a)] for r, a in zip(radii, angles)]
+    hole = [[-1, -1], [1, -1], [1, 1], [-1, 1]]
+    rings = geo.polygon_rings([outer + outer[:1], hole + hole[:1]])
+    latitudes, longitudes = rng.uniform(-11, 11, 3000), rng.uniform(-11, 11, 3000)
+
+    def inside(x, y, ring):
+        result = False
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                result = not result
+        return result
+
+    expected = [inside(lon, lat, outer) and not inside(lon, lat, hole) for lat, lon in zip(latitudes, longitudes)]
+    assert geo.points_in_polygon(latitudes, longitudes, rings, block_elements=1000).tolist() == expected
+
+def test_points_in_polygon_across_the_antimeridian():
+    rings = geo.polygon_rings([[[170, -10], [-170, -10], [-170, 10], [170, 10], [170, -10]]])
+    assert geo.polygon_bounds(rings) == (-10.0, 10.0, [(170.0, 180.0), (-180.0, -170.0)])
+    mask = geo.points_in_polygon([0, 0, 0, 0, 20], [175, -175, 180, 0, 175], rings)
+    assert mask.tolist() == [True, True, True, False, False]
@@ -0,0 +1,32 @@
+import logging
+from app import logging_config
+
+def _record(name, level):
+    return logging.LogRecord(name, level, __file__, 1, "message %s", ("arg",), None)
+
+def test_parse_sampling():
+    assert logging_config.parse_sampling("app.crud=0.01, app.routers=0.5,") == {"app.crud": 0.01, "app.routers": 0.5}
+    assert logging_config.parse_sampling("") == {}
+
+def test_sampling_filter_only_samples_debug_records_of_configured_loggers():
+    sampling = logging_config.SamplingFilter({"app.crud": 0.0, "app.routers": 1.0})
+    assert not sampling.filter(_record("app.crud", logging.DEBUG))
+    assert not sampling.filter(_record("app.crud.child", logging.DEBUG))
+    assert sampling.filter(_record("app.crud", logging.INFO))
+    assert sampling.filter(_record("app.routers.address", logging.DEBUG))
+    assert sampling.filter(_record("app.database", logging.DEBUG))
+
+def test_setup_logging_moves_handlers_behind_a_queue():
+    listener = logging_config.setup_logging()
+    root = logging.getLogger()
+    assert [type(handler).__name__ for handler in root.handlers] == ["_InProcessQueueHandler"]
+    assert {type(handler).__name__ for handler in listener.handlers} == {"StreamHandler", "RotatingFileHandler"}
+
+def test_several_workers_leave_rotation_to_an_external_tool(monkeypatch):
+    monkeypatch.setattr(logging_config.config, "WORKERS", 2)
+    try:
+        listener = logging_config.setup_logging()
+        assert {type(handler).__name__ for handler in listener.handlers} == {"StreamHandler", "WatchedFileHandler"}
+    finally:
+        monkeypatch.undo()
+        logging_config.setup_logging()
@@ -1,92 +1,547 @@
-import pytest
-from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from app.routers import address
-from app.database import Base
-from app.main import app
-
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-Base.metadata.create_all(bind=engine)
-
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
-        yield db
-    finally:
-        db.close()
-
-app.dependency_overrides[address.get_db] = override_get_db
-
-client = TestClient(app)
-
-@pytest.fixture(scope="function", autouse=True)
-def setup_and_teardown():
-    # Setup: clean the database before each test
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-    yield
-    # Teardown: clean the database after each test
-    Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
-
-def test_create_address():
-    response = client.post(
-        "/addresses/",
-        json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}
-    )
-    assert response.status_code == 200
-    assert response.json()["name"] == "Test Address 1"
-    assert response.json()["latitude"] == 10.0
-    assert response.json()["longitude"] == 20.0
-
-def test_read_addresses_within_distance():
-    # Create some test addresses
-    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
-    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})  # Adjusted coordinates
-    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
-
-    # Fetch addresses within 15 km of (10.0, 20.0)
-    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=15")
-    assert response.status_code == 200
-    addresses = response.json()
-    assert len(addresses) == 2  # Test Address 1 and Test Address 2 should be within 15 km
-    names = [address["name"] for address in addresses]
-    assert "Test Address 1" in names
-    assert "Test Address 2" in names
-    assert "Test Address 3" not in names
-
-def test_read_addresses_within_short_distance():
-    # Create some test addresses
-    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
-    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})
-    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
-
-    # Fetch addresses within 5 km of (10.0, 20.0)
-    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=5")
-    assert response.status_code == 200
-    addresses = response.json()
-    assert len(addresses) == 1  # Only Test Address 1 should be within 5 km
-    assert addresses[0]["name"] == "Test Address 1"
-
-def test_delete_address():
-    # Create an address to delete
-    response = client.post(
-        "/addresses/",
-        json={"name": "Test Address to Delete", "latitude": 10.0, "longitude": 20.0}
-    )
-    address_id = response.json()["id"]
-
-    # Delete the created address
-    response = client.delete(f"/addresses/{address_id}")
-    assert response.status_code == 200
-    assert response.json()["name"] == "Test Address to Delete"
-
-    # Try to read the deleted address
-    response = client.get(f"/addresses/{address_id}")
-    assert response.status_code == 404
+import csv
+import io
+import json
+import os
+import pytest
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app import config, write_coalescer
+from app.cache import address_cache
+from app.routers import address
+from app.database import Base
+from app.main import app
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+Base.metadata.create_all(bind=engine)
+
+def override_get_db():
+    try:
+        db = TestingSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+app.dependency_overrides[address.get_db] = override_get_db
+app.dependency_overrides[address.get_read_db] = override_get_db
+
+client = TestClient(app)
+
+@pytest.fixture(scope="function", autouse=True)
+def setup_and_teardown():
+    # Setup: clean the database before each test
+    address_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    # Teardown: clean the database after each test
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+def test_create_address():
+    response = client.post(
+        "/addresses/",
+        json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}
+    )
+    assert response.status_code == 200
+    assert response.json()["name"] == "Test Address 1"
+    assert response.json()["latitude"] == 10.0
+    assert response.json()["longitude"] == 20.0
+
+@pytest.fixture(params=[False, True], ids=["direct", "coalesced"])
+def write_path(request, monkeypatch):
+    # Single-address writes on the request's session, or through a write coalescer
+    monkeypatch.setattr(config, "WRITE_COALESCING", request.param)
+    coalescer = write_coalescer.WriteCoalescer(TestingSessionLocal)
+    monkeypatch.setattr(write_coalescer, "coalescer", coalescer)
+    yield
+    coalescer.stop()
+
+def test_write_conflicts_and_upsert(write_path):
+    first = client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).json()
+    second = client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.0, "longitude": 20.0}).json()
+    assert client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).status_code == 400
+
+    response = client.put(f"/addresses/{second['id']}", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    assert response.status_code == 400
+    assert client.get(f"/addresses/{second['id']}").json()["name"] == "Test Address 2"
+    assert client.put("/addresses/999999", json={"name": "Missing", "latitude": 1.0, "longitude": 2.0}).status_code == 404
+    assert client.delete("/addresses/999999").status_code == 404
+
+    response = client.put("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    assert response.status_code == 200
+    assert response.json() == first
+    response = client.put("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+    assert response.status_code == 201
+    assert client.put("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0}).json() == response.json()
+    assert client.get("/addresses/clusters", params={"bbox": "0,0,30,30", "zoom": 0}).json()[0]["count"] == 3
+
+def test_read_addresses_within_distance():
+    # Create some test addresses
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})  # Adjusted coordinates
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+
+    # Fetch addresses within 15 km of (10.0, 20.0)
+    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=15")
+    assert response.status_code == 200
+    addresses = response.json()
+    assert len(addresses) == 2  # Test Address 1 and Test Address 2 should be within 15 km
+    names = [address["name"] for address in addresses]
+    assert "Test Address 1" in names
+    assert "Test Address 2" in names
+    assert "Test Address 3" not in names
+
+def test_read_addresses_within_short_distance():
+    # Create some test addresses
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+
+    # Fetch addresses within 5 km of (10.0, 20.0)
+    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=5")
+    assert response.status_code == 200
+    addresses = response.json()
+    assert len(addresses) == 1  # Only Test Address 1 should be within 5 km
+    assert addresses[0]["name"] == "Test Address 1"
+
+def test_delete_address():
+    # Create an address to delete
+    response = client.post(
+        "/addresses/",
+        json={"name": "Test Address to Delete", "latitude": 10.0, "longitude": 20.0}
+    )
+    address_id = response.json()["id"]
+
+    # Delete the created address
+    response = client.delete(f"/addresses/{address_id}")
+    assert response.status_code == 200
+    assert response.json()["name"] == "Test Address to Delete"
+
+    # Try to read the deleted address
+    response = client.get(f"/addresses/{address_id}")
+    assert response.status_code == 404
+
+def test_read_addresses_within_distance_fast_accuracy():
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+
+    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=15&accuracy=fast")
+    assert response.status_code == 200
+    assert [address["name"] for address in response.json()] == ["Test Address 1"]
+
+    response = client.get("/addresses/within_distance/?latitude=10.0&longitude=20.0&distance_km=15&accuracy=approximate")
+    assert response.status_code == 422
+
+def test_read_nearest_addresses():
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+
+    response = client.get("/addresses/nearest/?latitude=10.9&longitude=20.9&k=2")
+    assert response.status_code == 200
+    addresses = response.json()
+    assert [address["name"] for address in addresses] == ["Test Address 3", "Test Address 2"]
+    assert addresses[0]["distance_km"] < addresses[1]["distance_km"]
+
+    response = client.get("/addresses/nearest/?latitude=10.9&longitude=20.9&k=0")
+    assert response.status_code == 422
+
+def test_read_addresses_page_mode():
+    for i in range(5):
+        client.post("/addresses/", json={"name": f"Test Address {i}", "latitude": 10.0 + i, "longitude": 20.0})
+
+    response = client.get("/addresses/?page=2&page_size=2")
+    assert response.status_code == 200
+    body = response.json()
+    assert [address["name"] for address in body["addresses"]] == ["Test Address 2", "Test Address 3"]
+    assert "page=1" in body["previous_page"]
+    assert "page=3" in body["next_page"]
+    assert "total" not in body
+
+    body = client.get("/addresses/?page=3&page_size=2&include_total=true").json()
+    assert body["next_page"] is None
+    assert body["total"] == 5
+
+def test_read_addresses_cursor_mode():
+    for i in range(5):
+        client.post("/addresses/", json={"name": f"Test Address {i}", "latitude": 10.0 + i, "longitude": 20.0})
+
+    names = []
+    body = client.get("/addresses/?limit=2").json()
+    while True:
+        names.extend(address["name"] for address in body["addresses"])
+        if body["next_cursor"] is None:
+            assert body["next"] is None
+            break
+        body = client.get(body["next"]).json()
+    assert names == [f"Test Address {i}" for i in range(5)]
+
+    response = client.get("/addresses/?after=not-a-cursor")
+    assert response.status_code == 400
+
+def test_bulk_create_addresses_ndjson():
+    client.post("/addresses/", json={"name": "Existing", "latitude": 1.0, "longitude": 2.0})
+    body = "\n".join([
+        '{"name": "Bulk 1", "latitude": 10.0, "longitude": 20.0}',
+        '{"name": "Existing", "latitude": 1.0, "longitude": 2.0}',
+        '',
+        '{"name": "Bulk 2", "latitude": "north", "longitude": 20.0}',
+        '{"name": "Bulk 1", "latitude": 10.0, "longitude": 20.0}',
+        'not json',
+        '{"name": "Bulk 3", "latitude": 11.0, "longitude": 21.0}',
+    ])
+    response = client.post("/addresses/bulk?chunk_size=2", content=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    result = response.json()
+    assert result["inserted"] == 2
+    assert result["conflicts"] == 2
+    assert [row["line"] for row in result["conflict_rows"]] == [2, 5]
+    assert result["invalid"] == 2
+    assert [row["line"] for row in result["invalid_rows"]] == [4, 6]
+    assert client.get("/addresses/?include_total=true").json()["total"] == 3
+
+def test_bulk_create_addresses_csv():
+    body = "name,latitude,longitude\r\nBulk 1,10.0,20.0\r\n\"Bulk, 2\",10.5,20.5\r\n"
+    response = client.post("/addresses/bulk", content=body, headers={"Content-Type": "text/csv"})
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    names = [address["name"] for address in client.get("/addresses/").json()["addresses"]]
+    assert names == ["Bulk 1", "Bulk, 2"]
+
+def test_export_addresses():
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test, Address 2", "latitude": 10.5, "longitude": 20.5})
+
+    response = client.get("/addresses/export?batch_size=1")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["name"] for row in rows] == ["Test Address 1", "Test, Address 2"]
+    assert rows[0] == {"id": rows[0]["id"], "name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}
+
+    response = client.get("/addresses/export?format=csv")
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "name", "latitude", "longitude"]
+    assert rows[2][1:] == ["Test, Address 2", "10.5", "20.5"]
+
+def test_read_duplicate_addresses():
+    for name, latitude, longitude in [("Main St 1", 10.0, 20.0), ("MAIN ST. 1", 10.0001, 20.0001), ("Main St 1", 10.005, 20.0),
+                                      ("Oak Ave", 10.0, 20.0001), ("Café Rouge", -5.0, 179.99999), ("Cafe rouge", -5.0, -179.99999)]:
+        client.post("/addresses/", json={"name": name, "latitude": latitude, "longitude": longitude})
+
+    response = client.get("/addresses/duplicates", params={"radius_m": 25, "name_similarity": 1, "batch_size": 2})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [event["scanned"] for event in events if event["type"] == "progress"] == [2, 4, 6]
+    clusters = [[address["name"] for address in event["addresses"]] for event in events if event["type"] == "cluster"]
+    assert sorted(clusters) == [["Café Rouge", "Cafe rouge"], ["Main St 1", "MAIN ST. 1"]]
+    assert events[-1]["type"] == "done"
+    assert (events[-1]["scanned"], events[-1]["total"], events[-1]["clusters"]) == (6, 6, 2)
+
+    response = client.get("/addresses/duplicates", params={"radius_m": 1000, "name_similarity": 0.6})
+    clusters = [event for event in map(json.loads, response.text.splitlines()) if event["type"] == "cluster"]
+    assert sorted(len(event["addresses"]) for event in clusters) == [2, 3]
+    assert client.get("/addresses/duplicates", params={"radius_m": 100000}).status_code == 400
+
+def test_read_connections_are_read_only():
+    db = next(address.get_read_db())
+    try:
+        assert db.execute(text("PRAGMA query_only")).scalar() == 1
+        assert db.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        with pytest.raises(OperationalError):
+            db.execute(text("INSERT INTO addresses (name, latitude, longitude) VALUES ('x', 1.0, 2.0)"))
+    finally:
+        db.close()
+
+def test_lifespan_checks_and_disposes_database():
+    with TestClient(app) as lifespan_client:
+        response = lifespan_client.get("/debug/spatial_index")
+        assert response.status_code == 200
+        phases = lifespan_client.get("/debug/startup").json()
+        assert {"logging", "engines", "database", "schema", "total"} <= set(phases)
+
+def test_spatial_index_refuses_several_workers(monkeypatch):
+    monkeypatch.setattr(config, "SPATIAL_INDEX_ENABLED", True)
+    monkeypatch.setattr(config, "WORKERS", 2)
+    with pytest.raises(RuntimeError, match="single worker"):
+        with TestClient(app):
+            pass
+
+def _run_app_script(tmp_path, script):
+    env = dict(os.environ, ADDRESS_BOOK_DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}",
+               ADDRESS_BOOK_LOG_FILE=str(tmp_path / "startup.log"), ADDRESS_BOOK_SCHEMA_CHECK="upgrade")
+    return subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+
+def test_import_has_no_database_side_effects(tmp_path):
+    _run_app_script(tmp_path, "import app.main")
+    assert not (tmp_path / "startup.db").exists()
+
+def test_lifespan_upgrades_a_new_database(tmp_path):
+    # The app logs to stdout, so the script reports on stderr
+    result = _run_app_script(tmp_path, (
+        "import sys\n"
+        "from fastapi.testclient import TestClient\n"
+        "from app.main import app\n"
+        "with TestClient(app) as client:\n"
+        "    print(client.post('/addresses/', json={'name': 'A', 'latitude': 1.0, 'longitude': 2.0}).status_code, file=sys.stderr)\n"
+    ))
+    assert result.stderr.split() == ["200"]
+    connection = create_engine(f"sqlite:///{tmp_path / 'startup.db'}").connect()
+    try:
+        assert connection.execute(text("SELECT count(*) FROM alembic_version")).scalar() == 1
+    finally:
+        connection.close()
+
+def test_concurrent_workers_upgrade_once(tmp_path):
+    env = dict(os.environ, ADDRESS_BOOK_DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}",
+               ADDRESS_BOOK_LOG_FILE=str(tmp_path / "startup.log"), ADDRESS_BOOK_SCHEMA_CHECK="upgrade")
+    workers = [subprocess.Popen([sys.executable, "-c", "from app import database; database.check_schema()"],
+                                env=env, stderr=subprocess.PIPE, text=True) for _ in range(4)]
+    for worker in workers:
+        _, stderr = worker.communicate()
+        assert worker.returncode == 0, stderr
+
+def test_schema_check_refuses_an_unmigrated_database_by_default(tmp_path):
+    env = dict(os.environ, ADDRESS_BOOK_DATABASE_URL=f"sqlite:///{tmp_path / 'startup.db'}",
+               ADDRESS_BOOK_LOG_FILE=str(tmp_path / "startup.log"))
+    env.pop("ADDRESS_BOOK_SCHEMA_CHECK", None)
+    result = subprocess.run([sys.executable, "-c", "from app import database; database.check_schema()"],
+                            env=env, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "alembic upgrade head" in result.stderr
+
+def test_read_address_etag_and_cache_invalidation():
+    address_id = client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).json()["id"]
+
+    response = client.get(f"/addresses/{address_id}")
+    assert response.status_code == 200
+    assert response.json() == {"id": address_id, "name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}
+    etag = response.headers["etag"]
+    stats = address_cache.stats()
+
+    response = client.get(f"/addresses/{address_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert address_cache.stats()["hits"] == stats["hits"] + 1
+    assert client.get(f"/addresses/{address_id}", headers={"If-None-Match": f"W/{etag}"}).status_code == 304
+
+    client.put(f"/addresses/{address_id}", json={"name": "Updated", "latitude": 10.0, "longitude": 20.0})
+    response = client.get(f"/addresses/{address_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Updated"
+    assert response.headers["etag"] != etag
+
+    client.delete(f"/addresses/{address_id}")
+    assert client.get(f"/addresses/{address_id}").status_code == 404
+    assert client.get("/debug/cache").json()["invalidations"] == stats["invalidations"] + 2
+
+def test_read_address_etag_survives_id_reuse():
+    address_id = client.post("/addresses/", json={"name": "Old", "latitude": 10.0, "longitude": 20.0}).json()["id"]
+    etag = client.get(f"/addresses/{address_id}").headers["etag"]
+    client.delete(f"/addresses/{address_id}")
+
+    # SQLite hands the highest id out again once its row is gone
+    assert client.post("/addresses/", json={"name": "New", "latitude": 30.0, "longitude": 40.0}).json()["id"] == address_id
+    response = client.get(f"/addresses/{address_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "New"
+    assert response.headers["etag"] != etag
+
+def test_batch_get_update_and_delete():
+    ids = [client.post("/addresses/", json={"name": f"Test Address {i}", "latitude": 10.0 + i, "longitude": 20.0}).json()["id"]
+           for i in range(3)]
+
+    response = client.post("/addresses/batch/get", json={"ids": [ids[1], 999, ids[0]]})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["ok"], body["not_found"]) == (2, 1)
+    assert [item["status"] for item in body["items"]] == ["ok", "not_found", "ok"]
+    assert body["items"][0]["address"]["name"] == "Test Address 1"
+
+    etag = client.get(f"/addresses/{ids[0]}").headers["etag"]
+    response = client.patch("/addresses/batch", json={"items": [
+        {"id": ids[0], "name": "Renamed"},
+        {"id": ids[1], "name": "Test Address 2", "latitude": 12.0},  # takes the key of ids[2]
+        {"id": 999, "name": "Missing"},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [item["status"] for item in body["items"]] == ["ok", "conflict", "not_found"]
+    assert body["items"][0]["address"] == {"id": ids[0], "name": "Renamed", "latitude": 10.0, "longitude": 20.0}
+    response = client.get(f"/addresses/{ids[0]}")
+    assert response.json()["name"] == "Renamed"
+    assert response.headers["etag"] != etag
+    assert client.get(f"/addresses/{ids[1]}").json()["latitude"] == 11.0
+
+    response = client.post("/addresses/batch/delete", json={"ids": [ids[0], ids[2], 999]})
+    assert [item["status"] for item in response.json()["items"]] == ["ok", "ok", "not_found"]
+    assert response.json()["items"][1]["address"]["name"] == "Test Address 2"
+    assert client.get(f"/addresses/{ids[0]}").status_code == 404
+    assert client.post("/addresses/batch/get", json={"ids": ids}).json()["ok"] == 1
+    assert client.post("/addresses/batch/delete", json={"ids": []}).status_code == 422
+
+def test_search_addresses():
+    ids = {}
+    for name, latitude, longitude in [("Café Rouge", 48.85, 2.35), ("Cafe Bleu", 48.86, 2.34), ("Cafeteria Central", 48.9, 2.3),
+                                      ("Rouge Bar", 40.7, -74.0), ("Bakery", 48.85, 2.35)]:
+        response = client.post("/addresses/", json={"name": name, "latitude": latitude, "longitude": longitude})
+        ids[name] = response.json()["id"]
+
+    # Accents and case are ignored; whole-word matches rank above prefix-only ones
+    response = client.get("/addresses/search", params={"q": "CAFE"})
+    assert response.status_code == 200
+    names = [item["name"] for item in response.json()]
+    assert sorted(names[:2]) == ["Cafe Bleu", "Café Rouge"]
+    assert names[2] == "Cafeteria Central"
+    assert response.json()[0]["distance_km"] is None
+    assert [item["name"] for item in client.get("/addresses/search", params={"q": "cafe ro"}).json()] == ["Café Rouge"]
+
+    # Renames and deletes are picked up by the index
+    client.put(f"/addresses/{ids['Bakery']}", json={"name": "Rouge Bakery", "latitude": 48.85, "longitude": 2.35})
+    client.delete(f"/addresses/{ids['Rouge Bar']}")
+    assert [item["name"] for item in client.get("/addresses/search", params={"q": "rouge"}).json()] == ["Café Rouge", "Rouge Bakery"]
+
+    response = client.get("/addresses/search", params={"q": "caf", "latitude": 48.85, "longitude": 2.35, "distance_km": 2})
+    assert {item["name"] for item in response.json()} == {"Café Rouge", "Cafe Bleu"}
+    response = client.get("/addresses/search", params={"q": "caf", "latitude": 48.9, "longitude": 2.3, "distance_km": 20,
+                                                      "order_by": "distance"})
+    assert [item["name"] for item in response.json()] == ["Cafeteria Central", "Cafe Bleu", "Café Rouge"]
+    assert response.json()[0]["distance_km"] == pytest.approx(0.0)
+
+    assert client.get("/addresses/search", params={"q": "\"*"}).status_code == 400
+    assert client.get("/addresses/search", params={"q": "cafe", "latitude": 48.85}).status_code == 400
+    assert client.get("/addresses/search", params={"q": "cafe", "order_by": "distance"}).status_code == 400
+
+def test_read_address_clusters():
+    for name, latitude, longitude in [("A", 48.85, 2.35), ("B", 48.86, 2.34), ("C", 40.7, -74.0), ("D", -33.9, 151.2)]:
+        client.post("/addresses/", json={"name": name, "latitude": latitude, "longitude": longitude})
+
+    response = client.get("/addresses/clusters", params={"bbox": "-180,-85,180,85", "zoom": 1})
+    assert response.status_code == 200
+    assert response.json() == [
+        {"x": 0, "y": 0, "count": 1, "latitude": 40.7, "longitude": -74.0},
+        {"x": 1, "y": 0, "count": 2, "latitude": pytest.approx(48.855), "longitude": pytest.approx(2.345)},
+        {"x": 1, "y": 1, "count": 1, "latitude": -33.9, "longitude": 151.2},
+    ]
+    # Paris and Sydney, across the antimeridian from the west
+    response = client.get("/addresses/clusters", params={"bbox": "0,-40,-100,60", "zoom": 3})
+    assert sorted(cell["count"] for cell in response.json()) == [1, 2]
+
+    client.delete("/addresses/1")
+    response = client.get("/addresses/clusters", params={"bbox": "2,48,3,49", "zoom": 16})
+    assert [(cell["count"], cell["latitude"]) for cell in response.json()] == [(1, 48.86)]
+
+    assert client.get("/addresses/clusters", params={"bbox": "1,2,3", "zoom": 1}).status_code == 400
+    assert client.get("/addresses/clusters", params={"bbox": "0,10,1,5", "zoom": 1}).status_code == 400
+    assert client.get("/addresses/clusters", params={"bbox": "-180,-85,180,85", "zoom": 16}).status_code == 400
+    assert client.get("/addresses/clusters", params={"bbox": "-180,-85,180,85", "zoom": 17}).status_code == 422
+
+
+def test_read_addresses_in_bbox_and_polygon():
+    for name, latitude, longitude in [("Suva", -18.1, 178.4), ("Apia", -13.8, -171.8), ("Paris", 48.85, 2.35),
+                                      ("Lyon", 45.76, 4.84), ("Marseille", 43.3, 5.37)]:
+        client.post("/addresses/", json={"name": name, "latitude": latitude, "longitude": longitude})
+
+    def names(response):
+        assert response.status_code == 200
+        return sorted(address["name"] for address in response.json())
+
+    assert names(client.get("/addresses/in_bbox", params={"min_lat": 40, "min_lon": 0, "max_lat": 50, "max_lon": 5})) == ["Lyon", "Paris"]
+    # min_lon > max_lon crosses the antimeridian; a batch size of 1 streams one row per chunk
+    assert names(client.get("/addresses/in_bbox", params={"min_lat": -20, "min_lon": 170, "max_lat": -10, "max_lon": -170,
+                                                          "batch_size": 1})) == ["Apia", "Suva"]
+    assert client.get("/addresses/in_bbox", params={"min_lat": 50, "min_lon": 0, "max_lat": 40, "max_lon": 5}).status_code == 400
+
+    # A triangle holding Lyon and Marseille but not Paris, whose bounding box it covers
+    triangle = {"type": "Polygon", "coordinates": [[[1, 42], [6, 42], [6, 49], [1, 42]]]}
+    assert names(client.post("/addresses/in_polygon", json=triangle)) == ["Lyon", "Marseille"]
+    with_hole = {"type": "Polygon", "coordinates": [[[1, 42], [6, 42], [6, 49], [1, 42]], [[4, 45], [5.5, 45], [5.5, 46.5], [4, 45]]]}
+    assert names(client.post("/addresses/in_polygon", json=with_hole)) == ["Marseille"]
+    across_antimeridian = {"type": "MultiPolygon", "coordinates": [
+        [[[175, -20], [-175, -20], [-175, -10], [175, -10], [175, -20]]],
+        [[[2, 48], [3, 48], [3, 49], [2, 49], [2, 48]]],
+    ]}
+    assert names(client.post("/addresses/in_polygon", json=across_antimeridian)) == ["Paris", "Suva"]
+
+    assert client.post("/addresses/in_polygon", json={"type": "Polygon", "coordinates": [[[0, 0], [1, 1], [0, 0]]]}).status_code == 422
+    assert client.post("/addresses/in_polygon", json={"type": "Polygon", "coordinates": [[[0, 0], [1, 95], [2, 0], [0, 0]]]}).status_code == 422
+    assert client.post("/addresses/in_polygon", json={"type": "Point", "coordinates": [0, 0]}).status_code == 422
+
+def test_changes_feed():
+    ids = [client.post("/addresses/", json={"name": f"Test Address {i}", "latitude": 10.0, "longitude": 20.0 + i}).json()["id"]
+           for i in range(3)]
+    body = client.get("/addresses/changes", params={"since": 0, "limit": 2}).json()
+    assert [change["id"] for change in body["changes"]] == ids[:2]
+    assert body["has_more"] is True
+    since = client.get("/addresses/changes", params={"since": body["next_since"]}).json()["next_since"]
+
+    client.put(f"/addresses/{ids[0]}", json={"name": "Updated", "latitude": 10.0, "longitude": 20.0})
+    client.delete(f"/addresses/{ids[1]}")
+    client.post("/addresses/batch/delete", json={"ids": [ids[2]]})
+    body = client.get("/addresses/changes", params={"since": since}).json()
+    assert [(change["op"], change["id"]) for change in body["changes"]] == [("upsert", ids[0]), ("delete", ids[1]), ("delete", ids[2])]
+    assert body["changes"][0]["address"]["name"] == "Updated"
+    assert body["changes"][1]["address"] is None
+    assert body["has_more"] is False
+    assert client.get("/addresses/changes", params={"since": body["next_since"]}).json() == {
+        "changes": [], "next_since": body["next_since"], "has_more": False}
+
+def test_changes_stream(monkeypatch):
+    monkeypatch.setattr(config, "CHANGES_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(config, "CHANGES_STREAM_TIMEOUT", 0.2)
+    polls = []
+    def counting_get_db():
+        polls.append(1)
+        yield from override_get_db()
+    monkeypatch.setitem(app.dependency_overrides, address.get_read_db, counting_get_db)
+    first = client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).json()["id"]
+    second = client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.0, "longitude": 21.0}).json()["id"]
+    client.delete(f"/addresses/{first}")
+
+    response = client.get("/addresses/changes/stream")
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [dict(line.split(": ", 1) for line in block.splitlines()) for block in response.text.strip().split("\n\n")[1:]]
+    assert [(event["event"], json.loads(event["data"])["id"]) for event in events] == [("upsert", second), ("delete", first)]
+
+    response = client.get("/addresses/changes/stream", headers={"Last-Event-ID": events[0]["id"]})
+    assert response.text.count("event: ") == 1
+    # Every poll of the streams went through the overridden dependency
+    assert len(polls) >= 2
+
+def test_read_addresses_within_distance_batch(monkeypatch):
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    client.post("/addresses/", json={"name": "Test Address 2", "latitude": 10.05, "longitude": 20.05})
+    client.post("/addresses/", json={"name": "Test Address 3", "latitude": 11.0, "longitude": 21.0})
+    queries = [{"latitude": 10.0, "longitude": 20.0, "distance_km": 15}, {"latitude": 11.0, "longitude": 21.0, "distance_km": 1},
+               {"latitude": -40.0, "longitude": 0.0, "distance_km": 100}]
+    response = client.post("/addresses/within_distance/batch", json={"queries": queries, "accuracy": "fast"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["matrix"] is None
+    for query, result in zip(queries, body["results"]):
+        assert result["addresses"] == client.get("/addresses/within_distance/", params=dict(query, accuracy="fast")).json()
+
+    body = client.post("/addresses/within_distance/batch", json={"queries": queries[:2], "matrix": True}).json()
+    assert len(body["matrix"]["address_ids"]) == 3
+    assert [len(row) for row in body["matrix"]["distances_km"]] == [3, 3]
+    assert body["matrix"]["distances_km"][1][2] == 0.0
+
+    monkeypatch.setattr(config, "PROXIMITY_EXACT_MATRIX_MAX_CELLS", 5)
+    assert client.post("/addresses/within_distance/batch", json={"queries": queries[:2], "matrix": True}).status_code == 400
+    fast = {"queries": queries[:2], "matrix": True, "accuracy": "fast"}
+    assert client.post("/addresses/within_distance/batch", json=fast).status_code == 200
+    monkeypatch.setattr(config, "PROXIMITY_MATRIX_MAX_CELLS", 5)
+    assert client.post("/addresses/within_distance/batch", json=fast).status_code == 400
+    assert client.post("/addresses/within_distance/batch", json={"queries": []}).status_code == 422
+
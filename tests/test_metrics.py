@@ -0,0 +1,83 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import metrics
+from app.cache import address_cache
+from app.database import Base
+from app.routers import address
+from app.routers import metrics as metrics_router
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+metrics.instrument_engine(engine, "test")
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
+app.include_router(address.router)
+app.include_router(metrics_router.router)
+app.dependency_overrides[address.get_db] = override_get_db
+app.dependency_overrides[address.get_read_db] = override_get_db
+
+client = TestClient(app)
+
+@pytest.fixture(scope="function", autouse=True)
+def setup_and_teardown():
+    address_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+def test_requests_and_statements_are_recorded_per_route():
+    read_labels = ("GET", "/addresses/{address_id}")
+    ok_before = metrics.http_requests_total.value(read_labels + ("200",))
+    missing_before = metrics.http_requests_total.value(read_labels + ("404",))
+    statements_before = metrics.http_request_db_statements.sum(read_labels)
+    engine_statements_before = metrics.db_statements_total.value(("test",))
+
+    address_id = client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0}).json()["id"]
+    assert client.get(f"/addresses/{address_id}").status_code == 200
+    assert client.get("/addresses/999").status_code == 404
+    assert client.get("/no/such/route").status_code == 404
+
+    assert metrics.http_requests_total.value(read_labels + ("200",)) == ok_before + 1
+    assert metrics.http_requests_total.value(read_labels + ("404",)) == missing_before + 1
+    assert metrics.http_requests_total.value(("GET", "<unmatched>", "404")) >= 1
+    assert metrics.http_request_db_statements.sum(read_labels) >= statements_before + 2
+    assert metrics.db_statements_total.value(("test",)) > engine_statements_before
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert "# TYPE http_request_duration_seconds histogram" in body
+    assert f'http_requests_total{{method="GET",route="/addresses/{{address_id}}",status="200"}} {ok_before + 1}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/addresses/{address_id}",le="+Inf"}' in body
+    assert 'db_statements_total{engine="test"}' in body
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, ("/a",))
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{route="/a",le="0.1"} 2',
+        'test_seconds_bucket{route="/a",le="1.0"} 3',
+        'test_seconds_bucket{route="/a",le="+Inf"} 4',
+        'test_seconds_sum{route="/a"} 3.65',
+        'test_seconds_count{route="/a"} 4',
+    ]
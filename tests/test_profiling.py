@@ -0,0 +1,73 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import config, profiling
+from app.cache import address_cache
+from app.database import Base
+from app.routers import address, debug
+
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False, "factory": profiling.ProfilingConnection})
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+profiling.instrument_engine(engine)
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+app = FastAPI()
+app.add_middleware(profiling.ProfilingMiddleware)
+app.include_router(address.router)
+app.include_router(debug.router)
+app.dependency_overrides[address.get_db] = override_get_db
+app.dependency_overrides[address.get_read_db] = override_get_db
+
+client = TestClient(app)
+
+@pytest.fixture(scope="function", autouse=True)
+def setup_and_teardown():
+    address_cache.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    profiling.clear()
+    yield
+    profiling.clear()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+def test_slow_queries_are_captured_with_their_query_plan(monkeypatch):
+    client.post("/addresses/", json={"name": "Test Address 1", "latitude": 10.0, "longitude": 20.0})
+    monkeypatch.setattr(config, "SLOW_QUERY_MS", 0.0)
+    client.get("/addresses/?include_total=true")
+
+    slow_queries = client.get("/debug/profiling").json()["slow_queries"]
+    count = next(entry for entry in slow_queries if "count(" in entry["statement"])
+    assert count["route"] == "/addresses/"
+    assert count["rows"] == 1
+    assert count["full_scan"] is True
+    page = next(entry for entry in slow_queries if "LIMIT" in entry["statement"])
+    assert any("addresses" in line for line in page["plan"])
+
+    assert client.delete("/debug/profiling").json()["slow_queries"] == []
+
+def test_requests_over_the_row_budget_are_flagged(monkeypatch):
+    for i in range(5):
+        client.post("/addresses/", json={"name": f"Test Address {i}", "latitude": 10.0, "longitude": 20.0 + i})
+    monkeypatch.setattr(config, "QUERY_BUDGET_ROWS", 3)
+    monkeypatch.setattr(config, "QUERY_BUDGET_STATEMENTS", 0)
+    client.get("/addresses/?limit=2")
+    assert client.get("/debug/profiling").json()["budget_violations"] == []
+
+    client.get("/addresses/?page_size=10")
+    violations = client.get("/debug/profiling").json()["budget_violations"]
+    assert len(violations) == 1
+    assert violations[0]["route"] == "/addresses/"
+    assert violations[0]["rows"] == 5
+    assert violations[0]["top_statements"][0]["count"] == 1
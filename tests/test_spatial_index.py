@@ -0,0 +1,59 @@
+import numpy as np
+from app import geo
+from app.spatial_index import SpatialIndex
+
+def _random_points(n, seed=3):
+    rng = np.random.default_rng(seed)
+    return np.arange(1, n + 1), rng.uniform(-60.0, 60.0, n), rng.uniform(-180.0, 180.0, n)
+
+def _brute_force(ids, latitudes, longitudes, min_lat, max_lat, lon_ranges):
+    inside = (latitudes >= min_lat) & (latitudes <= max_lat)
+    inside &= np.logical_or.reduce([(longitudes >= lo) & (longitudes <= hi) for lo, hi in lon_ranges])
+    return set(ids[inside].tolist())
+
+def test_query_bbox_matches_brute_force():
+    ids, latitudes, longitudes = _random_points(5000)
+    index = SpatialIndex(leaf_size=16)
+    index.build(ids, latitudes, longitudes)
+    for latitude, longitude in [(0.0, 0.0), (45.0, 179.9), (-30.0, -120.0)]:
+        box = geo.bounding_box(latitude, longitude, 800)
+        found, _, _ = index.query_bbox(*box)
+        assert set(found.tolist()) == _brute_force(ids, latitudes, longitudes, *box)
+
+def test_incremental_writes_and_background_rebuild():
+    ids, latitudes, longitudes = _random_points(2000)
+    index = SpatialIndex(leaf_size=16, rebuild_ratio=0.25)
+    index.build(ids, latitudes, longitudes)
+
+    index.add(9001, 10.0, 20.0)
+    index.remove(1)
+    index.add(2, 10.01, 20.01)  # update moves an existing point
+    found, _, _ = index.query_bbox(9.9, 10.1, [(19.9, 20.1)])
+    assert {9001, 2} <= set(found.tolist())
+    assert index.stats()["tombstones"] == 2
+    assert index.stats()["pending"] == 2
+
+    # The 1020th remove brings the changes to 1024 and starts the rebuild
+    for address_id in range(3, 1023):
+        index.remove(address_id)
+    index.wait_for_rebuild(timeout=10)
+    stats = index.stats()
+    assert stats["tombstones"] == 0
+    assert stats["pending"] == 0
+    assert not stats["rebuilding"]
+    for address_id in range(1023, 1200):
+        index.remove(address_id)
+    stats = index.stats()
+    assert stats["tombstones"] == 177
+    assert not stats["rebuilding"]
+    assert stats["size"] == 2000 - 1197 - 1 + 1
+    found, _, _ = index.query_bbox(-90.0, 90.0, [(-180.0, 180.0)])
+    assert 1 not in set(found.tolist())
+    assert {2, 9001} <= set(found.tolist())
+
+def test_memory_footprint_is_array_backed():
+    ids, latitudes, longitudes = _random_points(10000)
+    index = SpatialIndex()
+    index.build(ids, latitudes, longitudes)
+    # ids, coordinates and id lookup arrays: 8 bytes per value plus the alive flag
+    assert index.memory_bytes() < 10000 * 50